@@ -127,10 +127,10 @@ while boolean:
             user_id = r
             print("Great! Valid user id fetched! Just one more question before generating your recommendations")
             # decide which personalized recom
-            r = input("Which personalized recommendation would you prefer? \n1. Something new based on people like you; \n2. Something similar to your favorate restaurants; \nPlease enter 1 or 2\n")
+            r = input("Which personalized recommendation would you prefer? \n1. Something new based on people like you; \n2. Something similar to your favorate restaurants; \n3. A blend of both; \nPlease enter 1, 2 or 3\n")
             try: 
                 r = int(r)
-                if r not in [1,2]:
+                if r not in [1,2,3]:
                     print("Ooops, invalid input! Let's give it another try.")
                     continue
                 else:
@@ -139,10 +139,14 @@ while boolean:
                         print("---------")
                         result = recommender.collaborative(user_id=user_id)
                         print("---------")
-                    else:
+                    elif r == 2:
                         print("---------")
                         result = recommender.content(user_id=user_id)
                         print("---------")
+                    else:
+                        print("---------")
+                        result = recommender.hybrid(user_id=user_id)
+                        print("---------")
             except:
                 print("Ooops, invalid input! Let's give it another try.")
                 continue
@@ -174,7 +178,7 @@ while boolean:
         if r.startswith('Y') or r.startswith('y'):
             zipcode, city, state, max_distance, cuisine, style, price = getkeywords()
             print("---------")
-            result = recommender.keyword(df=result, zipcode=zipcode, city=city, state=state, max_distance=max_distance, cuisine=cuisine, style=style, price=price, personalized=personalized)
+            result = recommender.keyword(df=recommender.full_recommendation(), zipcode=zipcode, city=city, state=state, max_distance=max_distance, cuisine=cuisine, style=style, price=price, personalized=personalized)
             print("---------")
                 
     # quit or restart the recommendation engine
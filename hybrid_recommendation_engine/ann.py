@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Approximate maximum inner product search for the hybrid recommendation engine:
+an IVF (inverted file) index with k-means coarse quantization and an optional product-quantized residual,
+followed by an exact re-ranking of the retrieved candidates.
+
+The indices are built offline from the restaurant vectors of the personalized modules:
+    collaborative: the item latent vectors of the open restaurants, augmented with the item bias
+    content: the restaurant pcafeature vectors of the open restaurants
+and saved as 'ann_collaborative.npz' and 'ann_content.npz', which are loaded by Recommender(ann=True).
+Each index records the digest of the restaurant vectors of the model it was built from (see Engine._model_digest),
+an index built from another model is refused by the engine, which then falls back to brute-force scoring.
+
+Usage:
+    python ann.py [--artifact-dir artifacts] [--lists 256] [--subspaces 0] [--out-dir .]
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+# inverted file index class
+class IVFIndex:
+
+    def __init__(self, n_lists=256, n_subspaces=0, n_codes=256, random_state=42):
+        """initiate an IVF index for maximum inner product search.
+        ---
+        n_lists: the number of k-means clusters (inverted lists) of the coarse quantizer
+        n_subspaces: the number of subspaces of the product quantizer of the residuals, 0 to disable product quantization
+            (with product quantization, candidates are first ranked by their approximate scores and only the best are re-ranked exactly)
+        n_codes: the number of centroids per subspace of the product quantizer (at most 256, codes are stored as uint8)
+        ---
+        note: the inner product search is reduced to a nearest neighbor search by augmenting every vector x with sqrt(M^2-|x|^2),
+            M being the max norm, so that the k-means clusters group vectors with large inner products together.
+        """
+        self.n_lists = n_lists
+        self.n_subspaces = n_subspaces
+        self.n_codes = min(n_codes, 256)
+        self.random_state = random_state
+        self.model = None # the fingerprint of the model the vectors come from, set by the builders below
+
+    def fit(self, vectors, ids=None):
+        """Build the index over a 2-D array of vectors, one row per item, with an optional array of item ids"""
+        X = np.ascontiguousarray(vectors, dtype=np.float32)
+        n, d = X.shape
+        self.vectors = X
+        self.ids = np.asarray(ids) if ids is not None else np.arange(n)
+
+        # coarse quantizer: k-means on the augmented vectors, the centroids keep the original d dimensions for scoring the lists
+        norms = np.einsum('ij,ij->i', X, X)
+        aug = np.hstack([X, np.sqrt(np.maximum(norms.max() - norms, 0))[:, None]])
+        km = MiniBatchKMeans(n_clusters=min(self.n_lists, n), random_state=self.random_state, n_init=3, batch_size=4096).fit(aug)
+        self.assign = km.labels_.astype(np.int32)
+        self.centroids = km.cluster_centers_[:, :d].astype(np.float32)
+        # inverted lists: the rows of list l are .list_rows[.list_ptr[l]:.list_ptr[l+1]]
+        self.list_rows = np.argsort(self.assign, kind='stable').astype(np.int64)
+        self.list_ptr = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.assign, minlength=len(self.centroids)), out=self.list_ptr[1:])
+
+        # product quantizer of the residuals: the dimensions are split into n_subspaces groups, each quantized by its own k-means
+        self.codebooks, self.codes = None, None
+        if self.n_subspaces > 0:
+            residual = X - self.centroids[self.assign]
+            self.sub_dims = np.array_split(np.arange(d), min(self.n_subspaces, d))
+            self.codebooks, codes = [], []
+            for dims in self.sub_dims:
+                km = MiniBatchKMeans(n_clusters=min(self.n_codes, n), random_state=self.random_state, n_init=3, batch_size=4096).fit(residual[:, dims])
+                self.codebooks.append(km.cluster_centers_.astype(np.float32))
+                codes.append(km.labels_.astype(np.uint8))
+            self.codes = np.column_stack(codes)
+        return self
+
+    def search(self, query, k, nprobe=8, exclude=None, rerank=None):
+        """Return the k rows with the largest inner product with the query vector, searching only the nprobe most promising lists.
+        ---
+        nprobe: the number of inverted lists to visit, the recall vs latency knob (nprobe = number of lists is an exact search)
+        exclude: an optional boolean mask over the rows of the index, rows set to True are never returned (e.g. already rated items)
+        rerank: with product quantization, the number of candidates re-ranked exactly (default is max(4*k, 100))
+        ---
+        return: a tuple of two arrays: the rows sorted by exact inner product in descending order, and their inner products
+        """
+        q = np.asarray(query, dtype=np.float32)
+        nprobe = min(nprobe, len(self.centroids))
+        list_score = self.centroids.dot(q)
+        probe = np.argpartition(-list_score, nprobe-1)[:nprobe] if nprobe < len(list_score) else np.arange(len(list_score))
+        cand = np.concatenate([self.list_rows[self.list_ptr[l]:self.list_ptr[l+1]] for l in probe])
+        if exclude is not None:
+            cand = cand[~exclude[cand]]
+
+        # shortlist the candidates by their approximate scores: centroid score + quantized residual score
+        rerank = max(4*k, 100) if rerank is None else rerank
+        if self.codes is not None and len(cand) > rerank:
+            approx = list_score[self.assign[cand]]
+            for j, dims in enumerate(self.sub_dims):
+                approx += self.codebooks[j].dot(q[dims])[self.codes[cand, j]]
+            cand = cand[np.argpartition(-approx, rerank-1)[:rerank]]
+
+        # exact re-ranking of the candidates
+        score = self.vectors[cand].dot(q)
+        k = min(k, len(cand))
+        top = np.argpartition(-score, k-1)[:k] if 0 < k < len(cand) else np.arange(k)
+        top = top[np.argsort(-score[top], kind='stable')]
+        return cand[top], score[top]
+
+    def recall(self, queries, k, nprobe=8, rerank=None):
+        """Return the average recall@k of the approximate search against the exact brute-force search over a 2-D array of queries"""
+        hits = 0
+        for q in np.asarray(queries, dtype=np.float32):
+            exact = np.argpartition(-self.vectors.dot(q), k-1)[:k]
+            rows, _ = self.search(q, k, nprobe=nprobe, rerank=rerank)
+            hits += len(np.intersect1d(rows, exact))
+        return hits / float(k * len(queries))
+
+    def save(self, path):
+        """Save the index to a .npz file, written to a temporary name and renamed over an existing index
+        (never overwritten in place, its file may be linked from another version, see artifacts.new_version_dir)
+        """
+        arrays = {'vectors': self.vectors, 'ids': self.ids.astype(str), 'assign': self.assign, 'centroids': self.centroids,
+                  'list_rows': self.list_rows, 'list_ptr': self.list_ptr,
+                  'params': np.array([self.n_lists, self.n_subspaces, self.n_codes, self.random_state])}
+        if self.model is not None:
+            arrays['model'] = np.array(json.dumps(self.model, sort_keys=True))
+        if self.codes is not None:
+            arrays['codes'] = self.codes
+            arrays['sub_sizes'] = np.array([len(dims) for dims in self.sub_dims])
+            for j, codebook in enumerate(self.codebooks):
+                arrays['codebook_{}'.format(j)] = codebook
+        temporary = path + '.tmp.npz'
+        np.savez(temporary, **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved by .save()"""
+        with np.load(path) as f:
+            index = cls(*f['params'].tolist())
+            for key in ['vectors', 'ids', 'assign', 'centroids', 'list_rows', 'list_ptr']:
+                setattr(index, key, f[key])
+            index.model = json.loads(str(f['model'])) if 'model' in f else None # None for the indices built before the fingerprints
+            index.codebooks, index.codes = None, None
+            if 'codes' in f:
+                index.codes = f['codes']
+                index.sub_dims = np.split(np.arange(index.vectors.shape[1]), np.cumsum(f['sub_sizes'])[:-1])
+                index.codebooks = [f['codebook_{}'.format(j)] for j in range(len(index.sub_dims))]
+        return index
+
+    def __len__(self):
+        return len(self.vectors)
+
+def build_collaborative_index(recommender, **kwargs):
+    """Build the IVF index of the collaborative module of an Engine (or Recommender): the item latent vectors of the open restaurants augmented with the item bias,
+    so that the inner product with [user latent vector, 1] ranks the restaurants as the predicted ratings do.
+    """
+    recommender._load_collaborative()
+    info = recommender.svd_trained_info
+    items = recommender._collab_items
+    vectors = np.hstack([np.asarray(info['item_latent'][items]), np.asarray(info['item_bias'][items])[:, None]])
+    ids = recommender.business.business_id.to_numpy(dtype=object)[recommender._collab_pos]
+    index = IVFIndex(**kwargs).fit(vectors, ids)
+    index.model = {'items': recommender._model_digest('collaborative', 'items')}
+    return index
+
+def build_content_index(recommender, **kwargs):
+    """Build the IVF index of the content-based module of an Engine (or Recommender): the pcafeature vectors of the open restaurants"""
+    recommender._load_content()
+    rows = recommender._content_rows
+    ids = recommender.business.business_id.to_numpy(dtype=object)[recommender._content_pos]
+    index = IVFIndex(**kwargs).fit(np.asarray(recommender.rest_pcafeature.values[rows]), ids)
+    index.model = {'items': recommender._model_digest('content', 'items')}
+    return index
+
+if __name__ == '__main__':
+    """Build the approximate search indices of the personalized modules."""
+
+    from engine import Engine
+
+    parser = argparse.ArgumentParser(description='Build the IVF indices for approximate retrieval in the personalized modules.')
+    parser.add_argument('--artifact-dir', type=str, default=None, help='The compiled artifact directory, csv and pickle files are used if omitted.')
+    parser.add_argument('--lists', type=int, default=256, help='The number of inverted lists.')
+    parser.add_argument('--subspaces', type=int, default=0, help='The number of product quantizer subspaces, 0 to disable.')
+    parser.add_argument('--out-dir', type=str, default='.', help='The directory to write ann_collaborative.npz and ann_content.npz to.')
+    parser.add_argument('--nprobe', type=int, default=8, help='The nprobe used to report the recall@10 of the built indices.')
+    args = parser.parse_args()
+
+    engine = Engine(personalized=True, artifact_dir=args.artifact_dir, lazy=True)
+    for module, build, queries in [('collaborative', build_collaborative_index, lambda: np.hstack([engine.svd_trained_info['user_latent'][:200], np.ones((200, 1))])),
+                                   ('content', build_content_index, lambda: engine.user_pcafeature.rows(np.arange(min(200, len(engine.user_pcafeature)))))]:
+        index = build(engine, n_lists=args.lists, n_subspaces=args.subspaces)
+        path = os.path.join(args.out_dir, 'ann_{}.npz'.format(module))
+        index.save(path)
+        print("{} index of {} restaurants saved to {}, recall@10 = {:.3f} at nprobe = {}"
+              .format(module, len(index), path, index.recall(queries(), 10, nprobe=args.nprobe), args.nprobe))
@@ -0,0 +1,725 @@
+# -*- coding: utf-8 -*-
+"""
+Binary artifact store for the hybrid recommendation engine:
+a one-time "compile" step converts the cleaned csv files and the pickled model files into a versioned binary layout,
+Feather files for the tables and .npy files for the matrices and id maps, which are memory-mapped upon loading.
+
+Layout of an artifact directory (format version 2):
+    manifest.json                   format version, creation time, row counts, scalar model information and the model digests
+    business.feather                the 'business' dataset, with categorical 'state', 'city' and 'postal_code' columns
+    review.feather                  the reviews of the restaurants of the 'business' dataset, pruned to the columns used by the engine
+                                    and dictionary-encoded (see compact_review)
+    gazetteer.npz                   the optional offline gazetteer of the place centroids (see gazetteer.py)
+    collaborative/*.npy             user_latent, item_latent, user_bias, item_bias, user_ids, item_ids
+    content/*.npy                   rest_pcafeature, rest_ids, user_pcafeature, user_ids, user_index
+                                    (+ user_pcafeature_scale if the user feature vectors are int8-quantized)
+                                    (+ user_profile_weight, user_profile_norm, the statistics of the incremental profile updates)
+    content/text_projector.npz      the optional TF-IDF -> PCA projection of review texts (see profiles.py)
+
+Layout of a versioned artifact directory, which can be passed wherever an artifact directory is expected:
+    CURRENT                         the name of the current version, replaced atomically to publish a new version (see publish)
+    versions/<version>/             the artifact directory of each version, named by its creation time
+
+The matrices are memory-mapped from the files of one version (shared mappings), so that all the processes of a host loading the same version
+share the page cache of the user matrices (latent vectors, biases and feature vectors), of the restaurant matrices and of the materialized top k.
+Each process still builds its own copies of the rest: the user id dictionaries of the collaborative module (see ArtifactStore.svd_trained_info),
+the restaurant vectors gathered for the open restaurants and the hybrid module, the 'business' and 'review' frames and their indices. A new version is loaded by new engines, or by the running ones upon a reload
+(see reloader.py), while the version being served is left untouched.
+
+Usage:
+    python artifacts.py artifacts/ [--business business_clean.csv] [--review review_clean.csv] ...
+    python artifacts.py models/ --publish [--keep 3] ...    (compile a new version of a versioned directory and make it current)
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+import zlib
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+FORMAT_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2) # version 1 has no user_index: the user feature vectors are stored in their original dtype and indexed by a dictionary
+REVIEW_COLUMNS = ['user_id', 'business_id', 'stars'] # the only review columns used by the engine
+CATEGORICAL_COLUMNS = ['state', 'city', 'postal_code'] # the low-cardinality columns of the 'business' dataset stored as categoricals
+
+def compact_business(business):
+    """Return the 'business' dataset with the columns of CATEGORICAL_COLUMNS converted to categoricals (done in place),
+    each distinct state, city and postal code is stored once and every row holds a small integer code
+    """
+    if business.postal_code.dtype != 'category':
+        business['postal_code'] = business.postal_code.astype(str) # update the data type of the 'postal_code' column to string
+    for c in CATEGORICAL_COLUMNS:
+        business[c] = business[c].astype('category')
+    return business
+
+def compact_review(review, business_ids):
+    """Return the reviews of the restaurants of the catalog, with only the columns used by the engine in a compact form:
+    'user_id' and 'business_id' are categoricals (integer codes, int32 at most, into the dictionaries of distinct ids) and 'stars' is int8.
+    ---
+    review: the 'review' dataset, with plain or categorical id columns
+    business_ids: the business_id column of the 'business' dataset, the categories of 'business_id' so that its codes are the row positions
+        of the restaurants in the 'business' dataset. The reviews of other businesses are left out.
+    """
+    business_ids = pd.Index(business_ids)
+    ids = review.business_id.astype('category') # the distinct business_ids are looked up once
+    codes = business_ids.get_indexer(ids.cat.categories)[ids.cat.codes.values]
+    keep = (ids.cat.codes.values >= 0) & (codes >= 0)
+    user = pd.Categorical(review.user_id)[keep].remove_unused_categories()
+    return pd.DataFrame({'user_id': user, 'business_id': pd.Categorical.from_codes(codes[keep], categories=business_ids),
+                         'stars': review.stars.to_numpy()[keep].astype(np.int8)})
+
+def read_review(path):
+    """Read the columns of the review csv file used by the engine, the ids are dictionary-encoded while parsing (the text is never read)"""
+    return pd.read_csv(path, usecols=REVIEW_COLUMNS, dtype={'user_id': 'category', 'business_id': 'category'})
+
+def load_pickle_chunked(path):
+    """Load a pickled object larger than 2GB, reading the file in chunks smaller than 2GB due to a bug in Python3"""
+    max_bytes = 2**31 - 1
+    bytes_in = bytearray(0)
+    input_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        for _ in range(0, input_size, max_bytes):
+            bytes_in += f.read(max_bytes)
+    return pickle.loads(bytes_in)
+
+# updates of the feature vectors shared by FeatureMatrix and UserFeatureStore
+class _UpdatableRows:
+
+    def _init_updates(self):
+        self._new_ids = {} # id -> row position of the ids added by .update(), numbered after the stored rows
+        self._new_rows = []
+        self._replaced = {} # row position -> feature vector of the stored rows updated
+
+    def update(self, key, vector):
+        """Replace the feature vector of the id of interest, or add it if the id is new.
+        The vector is kept in an in-memory overlay of the stored rows, the stored values (e.g. the memory-mapped files of a published version,
+        shared with other processes) are never modified: see write_user_profiles() to write the updated vectors into a new version.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        pos = self.position(key)
+        if pos < 0:
+            self._new_rows.append(vector)
+            self._new_ids[key] = len(self.index) + len(self._new_rows) - 1
+        elif pos >= len(self.index):
+            self._new_rows[pos - len(self.index)] = vector
+        else:
+            self._replaced[pos] = vector
+
+    def updates(self):
+        """Return the updates of the overlay: the row positions and the feature vectors of the stored rows replaced,
+        and the ids and the feature vectors of the rows added
+        """
+        replaced = dict(self._replaced)
+        d = self.values.shape[1]
+        positions = np.fromiter(replaced.keys(), dtype=np.int64, count=len(replaced))
+        vectors = np.array(list(replaced.values()), dtype=np.float32).reshape(-1, d)
+        new_ids = sorted(self._new_ids, key=self._new_ids.get)
+        return positions, vectors, new_ids, np.array(self._new_rows[:len(new_ids)], dtype=np.float32).reshape(-1, d)
+
+    def _updated_rows(self, positions, rows):
+        """Return the feature vectors of a list of row positions given a function reading the stored rows"""
+        positions = np.asarray(positions)
+        if len(self._new_rows) == 0 and len(self._replaced) == 0:
+            return rows(positions)
+        n = len(self.index)
+        values = np.array(rows(np.where(positions < n, positions, 0)), dtype=np.float32)
+        for i, pos in enumerate(positions.tolist()):
+            if pos >= n:
+                values[i] = self._new_rows[pos - n]
+            elif pos in self._replaced:
+                values[i] = self._replaced[pos]
+        return values
+
+# light-weight container for a matrix of feature vectors keyed by id
+class FeatureMatrix(_UpdatableRows):
+
+    def __init__(self, index, values):
+        """initiate a FeatureMatrix object from an array of ids ('index') and a 2-D array of feature vectors ('values'), one row per id.
+        ---
+        'values' can be a memory-mapped array, rows are only read from disk when accessed.
+        Use .row(id) to look up the feature vector of an id, and 'id in matrix' to check if an id is available.
+        """
+        self.index = np.asarray(index)
+        self.values = values
+        self._row = {k: i for i, k in enumerate(self.index.tolist())}
+        self._init_updates()
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build a FeatureMatrix from a pandas DataFrame indexed by id, e.g. the pickled rest/user pcafeature"""
+        return cls(df.index.values, df.values)
+
+    def row(self, key):
+        """Return the feature vector of the id of interest"""
+        pos = self.position(key)
+        if pos < 0:
+            raise KeyError(key)
+        return self.rows([pos])[0]
+
+    def rows(self, positions):
+        """Return the feature vectors of a list of row positions as a 2-D array"""
+        return self._updated_rows(positions, lambda p: np.asarray(self.values[p]))
+
+    def position(self, key):
+        """Return the row position of the id of interest, or -1 if not available"""
+        pos = self._row.get(key, -1)
+        return pos if pos >= 0 else self._new_ids.get(key, -1)
+
+    def __contains__(self, key):
+        return self.position(key) >= 0
+
+    def __len__(self):
+        return len(self.index) + len(self._new_rows)
+
+def digest(*parts):
+    """Return a hex digest of the content of numpy arrays (memory-mapped or not, with their dtype and shape) and strings,
+    used as the fingerprint of a model by the artifacts derived from it (see Engine._model_digest)
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, str):
+            h.update(part.encode('utf-8'))
+            continue
+        part = np.asarray(part)
+        if part.dtype == object:
+            part = np.asarray(part.astype(str))
+        h.update('{}{}'.format(part.dtype.str, part.shape).encode('utf-8'))
+        h.update(np.ascontiguousarray(part).data)
+    return h.hexdigest()
+
+def model_digests(out_dir, module, mean_rating=None):
+    """Return the digests of the user and restaurant sides of the model of a personalized module written to out_dir/module,
+    {'users': ..., 'items': ...}: the latent vectors and biases (with the mean rating) or the feature vectors (with their scales), with their ids.
+    They are recorded in the manifest as '<module>_digest' when the model is written, so that the engines compare the artifacts derived
+    from the model (see Engine._model_digest) without reading the model.
+    mean_rating: the mean rating of the collaborative module
+    """
+    load = lambda name: np.load(os.path.join(out_dir, module, name + '.npy'), mmap_mode='r')
+    if module == 'collaborative':
+        return {side: digest(load(prefix + '_latent'), load(prefix + '_bias'), repr(float(mean_rating)), load(prefix + '_ids'))
+                for side, prefix in [('users', 'user'), ('items', 'item')]}
+    users = [load('user_pcafeature'), load('user_ids')]
+    if users[0].dtype == np.int8:
+        users.append(load('user_pcafeature_scale'))
+    return {'users': digest(*users), 'items': digest(load('rest_pcafeature'), load('rest_ids'))}
+
+# functions and class for the user_id -> row hash index of the user feature vectors
+def _hash_id(key):
+    """Return a stable 32-bit hash of a string id (python's hash() is salted per process and cannot be persisted)"""
+    return zlib.crc32(key.encode('utf-8'))
+
+def build_hash_index(ids):
+    """Build an open-addressing (linear probing) hash table mapping each id to its row position.
+    The table is an int32 array with a power of two number of slots, at least twice the number of ids, empty slots are -1.
+    """
+    size = 1 << max(int(2*len(ids) - 1).bit_length(), 1)
+    mask = size - 1
+    table = np.full(size, -1, dtype=np.int32)
+    for row, key in enumerate(ids):
+        slot = _hash_id(key) & mask
+        while table[slot] >= 0:
+            slot = (slot + 1) & mask
+        table[slot] = row
+    return table
+
+def hash_lookup(table, ids, key):
+    """Return the row position of an id in the hash table built by build_hash_index() over 'ids', or -1 if not available"""
+    mask = len(table) - 1
+    slot = _hash_id(key) & mask
+    while True:
+        row = table[slot]
+        if row < 0:
+            return -1
+        if ids[row] == key:
+            return int(row)
+        slot = (slot + 1) & mask
+
+# memory-mapped store of the user feature vectors
+class UserFeatureStore(_UpdatableRows):
+
+    def __init__(self, index, values, table, scale=None):
+        """initiate a UserFeatureStore object, with the same interface as FeatureMatrix.
+        ---
+        index: the array of user_ids, one per row
+        values: the 2-D array of feature vectors (float32, or int8 if quantized), typically a np.memmap so that only the queried rows are paged in
+        table: the hash table built by build_hash_index(), mapping a user_id to its row without building a dictionary upon loading
+        scale: the per-row scale of int8-quantized vectors (vector = values[row] * scale[row]), None if not quantized
+        ---
+        """
+        self.index = index
+        self.values = values
+        self.table = table
+        self.scale = scale
+        self._init_updates()
+
+    def position(self, key):
+        """Return the row position of the user_id of interest, or -1 if not available"""
+        pos = hash_lookup(self.table, self.index, key)
+        return pos if pos >= 0 else self._new_ids.get(key, -1)
+
+    def row(self, key):
+        """Return the feature vector of the user_id of interest"""
+        pos = self.position(key)
+        if pos < 0:
+            raise KeyError(key)
+        return self.rows([pos])[0]
+
+    def rows(self, positions):
+        """Return the feature vectors of a list of row positions as a 2-D float32 array"""
+        return self._updated_rows(positions, self._stored_rows)
+
+    def _stored_rows(self, positions):
+        values = np.asarray(self.values[positions], dtype=np.float32)
+        if self.scale is not None:
+            values *= self.scale[positions][:, None]
+        return values
+
+    def __contains__(self, key):
+        return self.position(key) >= 0
+
+    def __len__(self):
+        return len(self.index) + len(self._new_rows)
+
+def write_user_features(df, path, dtype='float32'):
+    """Write the user feature vectors (a DataFrame indexed by user_id, e.g. the pickled user pcafeature) to the directory 'path':
+    user_ids.npy, user_pcafeature.npy and the hash index user_index.npy.
+    ---
+    dtype: 'float32' (default), 'float64' (original precision), or 'int8' to quantize each vector with a per-row scale
+        (written to user_pcafeature_scale.npy), which divides the file size by 8 compared to the original float64 vectors
+    """
+    os.makedirs(path, exist_ok=True)
+    ids = np.asarray(df.index.values, dtype=str)
+    np.save(os.path.join(path, 'user_ids.npy'), ids)
+    np.save(os.path.join(path, 'user_index.npy'), build_hash_index(ids.tolist()))
+    values = df.values
+    if dtype == 'int8':
+        scale = np.empty(len(values), dtype=np.float32)
+        # quantize in blocks of rows to bound the memory use of the intermediate float arrays
+        out = np.lib.format.open_memmap(os.path.join(path, 'user_pcafeature.npy'), mode='w+', dtype=np.int8, shape=values.shape)
+        for start in range(0, len(values), 65536):
+            out[start:start+65536], scale[start:start+65536] = _quantize(values[start:start+65536])
+        out.flush()
+        np.save(os.path.join(path, 'user_pcafeature_scale.npy'), scale)
+    else:
+        np.save(os.path.join(path, 'user_pcafeature.npy'), np.ascontiguousarray(values, dtype=dtype))
+
+def _quantize(values):
+    """Return the int8 rows and the per-row float32 scale of a 2-D array of feature vectors (vector = row * scale)"""
+    scale = (np.abs(values).max(axis=1) / 127.0).astype(np.float32) if len(values) > 0 else np.zeros(0, dtype=np.float32)
+    scale[scale == 0] = 1.0
+    return np.round(values / scale[:, None]).astype(np.int8), scale
+
+def _replace_npy(path, array):
+    """Save an array to path (.npy) through a temporary file renamed over it, so that a file hard-linked from another version is never modified"""
+    temporary = path[:-len('.npy')] + '.tmp.npy'
+    np.save(temporary, array)
+    os.replace(temporary, path)
+
+def write_user_profiles(store, weight, norm, statistics, out_dir, block_size=65536):
+    """Write the user feature vectors of a UserFeatureStore with the updates of its overlay, and their profile statistics, to out_dir/content,
+    e.g. a new version created by new_version_dir(): every file is written to a temporary name and renamed over the old one.
+    ---
+    weight, norm: the stored profile statistics (see profiles.profile_statistics), None if not compiled
+    statistics: a dictionary user_id -> (weight, norm) of the updated profiles (see ProfileUpdater.updated_statistics)
+    block_size: the number of rows copied at once, which bounds the memory use
+    """
+    if not isinstance(store, UserFeatureStore):
+        raise ValueError("only the user feature vectors of artifact format version 2 can be written, please re-compile the artifacts")
+    path = os.path.join(out_dir, 'content')
+    positions, vectors, new_ids, new_vectors = store.updates()
+    n, d = store.values.shape
+    m = n + len(new_ids)
+
+    # the feature vectors: the stored rows are copied by blocks, then the updated and added rows are written over them
+    temporary = os.path.join(path, 'user_pcafeature.tmp.npy')
+    out = np.lib.format.open_memmap(temporary, mode='w+', dtype=store.values.dtype, shape=(m, d))
+    for start in range(0, n, block_size):
+        out[start:min(start+block_size, n)] = store.values[start:start+block_size]
+    rows, updated = np.concatenate([positions, np.arange(n, m)]), np.vstack([vectors, new_vectors])
+    if store.scale is not None:
+        scale = np.empty(m, dtype=np.float32)
+        scale[:n] = store.scale
+        out[rows], scale[rows] = _quantize(updated)
+        _replace_npy(os.path.join(path, 'user_pcafeature_scale.npy'), scale)
+    else:
+        out[rows] = updated
+    out.flush()
+    out = None
+    os.replace(temporary, os.path.join(path, 'user_pcafeature.npy'))
+    if len(new_ids) > 0:
+        ids = np.asarray(np.concatenate([np.asarray(store.index, dtype=object), np.asarray(new_ids, dtype=object)]), dtype=str)
+        _replace_npy(os.path.join(path, 'user_ids.npy'), ids)
+        _replace_npy(os.path.join(path, 'user_index.npy'), build_hash_index(ids.tolist()))
+
+    # the profile statistics of the updated users (the others are estimated from their rating history upon their next update)
+    if weight is not None:
+        new_weight, new_norm = np.zeros(m, dtype=np.float32), np.zeros(m, dtype=np.float32)
+        new_weight[:n], new_norm[:n] = weight, norm
+        for user_id, (w, r) in statistics.items():
+            pos = store.position(user_id)
+            if pos >= 0:
+                new_weight[pos], new_norm[pos] = w, r
+        _replace_npy(os.path.join(path, 'user_profile_weight.npy'), new_weight)
+        _replace_npy(os.path.join(path, 'user_profile_norm.npy'), new_norm)
+    return m
+
+def write_tables(business, review, out_dir):
+    """Write the 'business' and 'review' datasets to out_dir (see compile_artifacts), through temporary files renamed over the old ones"""
+    from pyarrow import feather
+    for name, df in [('business', business), ('review', review)]:
+        temporary = os.path.join(out_dir, name + '.tmp.feather')
+        feather.write_feather(df, temporary, compression='uncompressed')
+        os.replace(temporary, os.path.join(out_dir, name + '.feather'))
+
+def append_reviews(review, new, business_ids):
+    """Return the compact 'review' dataset (see compact_review) with the reviews of the dataframe 'new' appended,
+    the codes of the existing user_ids are kept
+    """
+    new = compact_review(new, business_ids)
+    user = union_categoricals([review.user_id.values, new.user_id.values])
+    business = pd.Categorical.from_codes(np.concatenate([review.business_id.cat.codes.values, new.business_id.cat.codes.values]),
+                                         categories=review.business_id.cat.categories)
+    return pd.DataFrame({'user_id': user, 'business_id': business, 'stars': np.concatenate([review.stars.values, new.stars.values]).astype(np.int8)})
+
+def _save_ids(path, ids):
+    """Save a list of string ids as a fixed-width unicode .npy array, which can be memory-mapped (no pickled objects)"""
+    np.save(path, np.asarray(list(ids), dtype=str))
+
+def write_collaborative(info, out_dir):
+    """Write the trained matrix factorization (the 'svd_trained_info' dictionary) to out_dir/collaborative.
+    Each file is written to a temporary name and renamed, so that the engines memory-mapping the previous files keep reading them.
+    Return the manifest entries of the module.
+    note: the artifacts computed from the previous model of out_dir are stale, see remove_derived()
+    """
+    path = os.path.join(out_dir, 'collaborative')
+    os.makedirs(path, exist_ok=True)
+    def save(name, array):
+        np.save(os.path.join(path, '_' + name + '.npy'), array)
+        os.replace(os.path.join(path, '_' + name + '.npy'), os.path.join(path, name + '.npy'))
+    for key in ['user_latent', 'item_latent', 'user_bias', 'item_bias']:
+        save(key, np.ascontiguousarray(info[key]))
+    for key, name in [('userid_to_index', 'user_ids'), ('itemid_to_index', 'item_ids')]:
+        ids = sorted(info[key], key=info[key].get) # order the ids by their matrix indices
+        save(name, np.asarray(list(ids), dtype=str))
+    entries = {'mean_rating': float(info['mean_rating']), 'collaborative_digest': model_digests(out_dir, 'collaborative', info['mean_rating'])}
+    if 'version' in info: # the version of the model trained by train.py
+        entries['collaborative_version'] = info['version']
+    return entries
+
+def remove_derived(out_dir, module):
+    """Remove the artifacts computed from the model of a personalized module in out_dir, once the model is replaced:
+    its approximate search index (see ann.py) and its materialized top k (see precompute.py), which the engine would refuse anyway.
+    In a new version linked to the previous one (see new_version_dir), only the links are removed.
+    Return the list of the artifacts removed, relative to out_dir.
+    """
+    removed = []
+    for derived in ['ann_{}.npz'.format(module), os.path.join('topk', module)]:
+        path = os.path.join(out_dir, derived)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        else:
+            continue
+        removed.append(derived)
+    return removed
+
+def compile_artifacts(out_dir, business='business_clean.csv', review='review_clean.csv', svd='svd_trained_info.pkl',
+                      rest_feature='rest_pcafeature_all.pkl', user_feature='user_pcafeature_all.pkl', user_dtype='float32',
+                      text_projector='text_projector.npz', gazetteer='gazetteer.npz', verbose=True):
+    """Compile the input files of the recommendation engine into the versioned binary layout described in the module docstring.
+    Any of the model files can be set to None to skip the corresponding module.
+    user_dtype: the storage dtype of the user feature vectors, 'float32' (default), 'float64' or 'int8' (see write_user_features)
+    text_projector: the text projection saved by profiles.py, copied to the content module if the file exists
+    gazetteer: the gazetteer saved by gazetteer.py, copied to out_dir if the file exists (the engine otherwise builds it from the 'business' dataset)
+    Return the manifest dictionary written to out_dir/manifest.json.
+    """
+    from pyarrow import feather
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {'format_version': FORMAT_VERSION, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'modules': []}
+
+    # tables: written uncompressed so that the numerical columns can be memory-mapped
+    t0 = time.time()
+    df = compact_business(pd.read_csv(business)) # same data types as used by the engine
+    feather.write_feather(df, os.path.join(out_dir, 'business.feather'), compression='uncompressed')
+    manifest['business_rows'] = len(df)
+    df = compact_review(read_review(review), df.business_id)
+    feather.write_feather(df, os.path.join(out_dir, 'review.feather'), compression='uncompressed')
+    manifest['review_rows'] = len(df)
+    df = None
+    if gazetteer is not None and os.path.exists(gazetteer):
+        shutil.copyfile(gazetteer, os.path.join(out_dir, 'gazetteer.npz'))
+    if verbose:
+        print("tables compiled in {:.1f}s".format(time.time() - t0))
+
+    # collaborative module: factor matrices, biases and the id maps in the order of the matrix indices
+    if svd is not None:
+        t0 = time.time()
+        with open(svd, 'rb') as f:
+            manifest.update(write_collaborative(pickle.load(f), out_dir))
+        remove_derived(out_dir, 'collaborative')
+        manifest['modules'].append('collaborative')
+        if verbose:
+            print("collaborative module compiled in {:.1f}s".format(time.time() - t0))
+
+    # content-based module: restaurant and user feature vectors with their ids
+    if rest_feature is not None and user_feature is not None:
+        t0 = time.time()
+        path = os.path.join(out_dir, 'content')
+        os.makedirs(path, exist_ok=True)
+        df = load_pickle_chunked(rest_feature)
+        np.save(os.path.join(path, 'rest_pcafeature.npy'), np.ascontiguousarray(df.values))
+        _save_ids(os.path.join(path, 'rest_ids.npy'), df.index.values)
+        rest_ids, rest_values = df.index.values, df.values
+        df = load_pickle_chunked(user_feature)
+        write_user_features(df, path, dtype=user_dtype)
+        # statistics of the user profiles, so that they can be updated incrementally as running weighted means
+        from profiles import profile_statistics
+        weight, norm = profile_statistics(df.index.values, read_review(review), rest_ids, rest_values)
+        np.save(os.path.join(path, 'user_profile_weight.npy'), weight)
+        np.save(os.path.join(path, 'user_profile_norm.npy'), norm)
+        df, rest_values = None, None
+        if text_projector is not None and os.path.exists(text_projector):
+            shutil.copyfile(text_projector, os.path.join(path, 'text_projector.npz'))
+        manifest['user_feature_dtype'] = user_dtype
+        manifest['content_digest'] = model_digests(out_dir, 'content')
+        manifest['modules'].append('content')
+        remove_derived(out_dir, 'content')
+        if verbose:
+            print("content module compiled in {:.1f}s".format(time.time() - t0))
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+# on-disk table of the materialized top k recommendations of every user, see precompute.py
+class TopKTable:
+
+    def __init__(self, path, mode='r'):
+        """open a table of top k recommendations written by TopKTable.create(), the arrays are memory-mapped.
+        ---
+        Layout of a table directory:
+            meta.json           module, k, number of users, creation time and the fingerprint of the model the table was computed from
+            user_ids.npy        the user_ids, one per row, and user_index.npy their hash index (see build_hash_index)
+            codes.npy           int32 (n_users x k), the business codes of the top k restaurants of each user, -1 pads the rows with fewer than k
+            scores.npy          float16 (n_users x k), their scores
+            business_ids.npy    the business_id of each business code (the row positions of the 'business' dataset the table was computed with)
+        """
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        load = lambda name, mode='r': np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)
+        self.user_ids, self.table = load('user_ids'), load('user_index')
+        self.codes, self.scores = load('codes', mode), load('scores', mode)
+        self.business_ids = load('business_ids')
+        self.k = self.meta['k']
+
+    @classmethod
+    def create(cls, path, user_ids, business_ids, k, meta):
+        """Create an empty table for the user_ids and open it for writing, the rows are then filled by the materialization job.
+        An existing table at path is removed first rather than overwritten, as its files may be linked from another version (see new_version_dir).
+        """
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        user_ids = np.asarray(user_ids).astype(str)
+        np.save(os.path.join(path, 'user_ids.npy'), user_ids)
+        np.save(os.path.join(path, 'user_index.npy'), build_hash_index(user_ids.tolist()))
+        np.save(os.path.join(path, 'business_ids.npy'), np.asarray(business_ids).astype(str))
+        np.lib.format.open_memmap(os.path.join(path, 'codes.npy'), mode='w+', dtype=np.int32, shape=(len(user_ids), k))[:] = -1
+        np.lib.format.open_memmap(os.path.join(path, 'scores.npy'), mode='w+', dtype=np.float16, shape=(len(user_ids), k))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(dict(meta, k=k, users=len(user_ids)), f, indent=2)
+        return cls(path, mode='r+')
+
+    def lookup(self, user_id):
+        """Return the (business codes, scores) of the top k recommendations of the user_id of interest, or None if not materialized"""
+        row = hash_lookup(self.table, self.user_ids, user_id)
+        if row < 0:
+            return None
+        codes = np.asarray(self.codes[row])
+        keep = codes >= 0
+        return codes[keep], np.asarray(self.scores[row], dtype=float)[keep]
+
+    def __len__(self):
+        return len(self.user_ids)
+
+# versioned artifact directories, see the module docstring
+CURRENT = 'CURRENT'
+
+def current_version(root):
+    """Return the name of the current version of a versioned artifact directory, None if the directory is not versioned"""
+    try:
+        with open(os.path.join(root, CURRENT)) as f:
+            return f.read().strip() or None
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+def resolve_artifact_dir(path):
+    """Return the directory of the current version of a versioned artifact directory, the path itself if it is not versioned"""
+    version = current_version(path)
+    return os.path.join(path, 'versions', version) if version is not None else path
+
+def new_version_dir(root, link=True):
+    """Create the directory of a new version under root, named by its creation time, and return its path. The version is not published.
+    link: hard-link the files of the current version into the new one (copied if the file system has no hard links), so that only
+        the files that change have to be written. A changed file must be written to a temporary name and renamed over the link
+        (as write_collaborative does), never modified in place, which would also modify the current version.
+        The engines map the artifact files read-only and keep the ingested reviews in memory, Engine.persist() writes them into a new version
+        by the same rule, so the files linked from a published version never change.
+    """
+    base = resolve_artifact_dir(root) if current_version(root) is not None else None
+    name = time.strftime('%Y%m%dT%H%M%S')
+    path, i = os.path.join(root, 'versions', name), 0
+    while os.path.exists(path): # several versions within a second
+        i += 1
+        path = os.path.join(root, 'versions', '{}-{}'.format(name, i))
+    if link and base is not None:
+        def link_or_copy(src, dst):
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+        shutil.copytree(base, path, copy_function=link_or_copy)
+    else:
+        os.makedirs(path)
+    return path
+
+def publish(root, version):
+    """Make a version of a versioned artifact directory current: the CURRENT file is written to a temporary name and renamed over the old one,
+    so that a reader sees either the old or the new version. The engines created or reloaded afterwards load the new version,
+    the running ones keep serving the version they loaded.
+    """
+    if not os.path.exists(os.path.join(root, 'versions', version, 'manifest.json')):
+        raise ValueError("{} is not a compiled version of {}".format(version, root))
+    temporary = os.path.join(root, CURRENT + '.tmp')
+    with open(temporary, 'w') as f:
+        f.write(version + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, os.path.join(root, CURRENT))
+
+def prune_versions(root, keep=3):
+    """Remove the versions of a versioned artifact directory but the 'keep' most recent ones and the current one, return the names removed.
+    note: the processes still serving a removed version keep reading its memory-mapped files, which are only freed once unmapped (POSIX).
+    """
+    current = current_version(root)
+    versions = sorted(os.listdir(os.path.join(root, 'versions')), key=lambda v: os.path.getmtime(os.path.join(root, 'versions', v)))
+    removed = [v for v in versions[:max(0, len(versions) - keep)] if v != current]
+    for version in removed:
+        shutil.rmtree(os.path.join(root, 'versions', version))
+    return removed
+
+# reader of a compiled artifact directory
+class ArtifactStore:
+
+    def __init__(self, path):
+        """open a compiled artifact directory, nothing but the manifest is read until a dataset or module is requested.
+        path: an artifact directory, or a versioned one whose current version is opened. '.root' is the path as passed,
+            '.path' the directory of the version opened and '.version' its name (None if the directory is not versioned).
+        """
+        self.root, self.version = path, current_version(path)
+        self.path = os.path.join(path, 'versions', self.version) if self.version is not None else path
+        with open(os.path.join(self.path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format_version') not in SUPPORTED_VERSIONS:
+            raise ValueError("artifact format version {} in {} is not supported, please re-compile the artifacts (expected version {})"
+                             .format(self.manifest.get('format_version'), self.path, FORMAT_VERSION))
+
+    def _table(self, name):
+        from pyarrow import feather
+        return feather.read_table(os.path.join(self.path, name + '.feather'), memory_map=True).to_pandas()
+
+    def _array(self, *name, mode='r'):
+        return np.load(os.path.join(self.path, *name) + '.npy', mmap_mode=mode)
+
+    def has_module(self, module):
+        return module in self.manifest['modules']
+
+    def business(self):
+        """Return the 'business' dataset, see compact_business"""
+        return compact_business(self._table('business'))
+
+    def review(self):
+        """Return the 'review' dataset (pruned to the columns used by the engine, plain or dictionary-encoded depending on the compiled version)"""
+        return self._table('review')
+
+    def svd_trained_info(self):
+        """Return the trained matrix factorization model as the same dictionary as 'svd_trained_info.pkl', with memory-mapped matrices"""
+        info = {key: self._array('collaborative', key) for key in ['user_latent', 'item_latent', 'user_bias', 'item_bias']}
+        info['mean_rating'] = self.manifest['mean_rating']
+        info['userid_to_index'] = {k: i for i, k in enumerate(self._array('collaborative', 'user_ids').tolist())}
+        info['itemid_to_index'] = {k: i for i, k in enumerate(self._array('collaborative', 'item_ids').tolist())}
+        if 'collaborative_version' in self.manifest:
+            info['version'] = self.manifest['collaborative_version']
+        return info
+
+    def rest_pcafeature(self):
+        """Return the restaurant feature vectors as a FeatureMatrix with memory-mapped values"""
+        return FeatureMatrix(self._array('content', 'rest_ids'), self._array('content', 'rest_pcafeature'))
+
+    def user_pcafeature(self):
+        """Return the user feature vectors as a UserFeatureStore with memory-mapped values and hash index
+        (a FeatureMatrix for artifacts of format version 1), mapped read-only: the updates are kept in an in-memory overlay
+        """
+        if self.manifest['format_version'] < 2:
+            return FeatureMatrix(self._array('content', 'user_ids'), self._array('content', 'user_pcafeature'))
+        scale = None
+        if self.manifest.get('user_feature_dtype') == 'int8':
+            scale = self._array('content', 'user_pcafeature_scale')
+        return UserFeatureStore(self._array('content', 'user_ids'), self._array('content', 'user_pcafeature'),
+                                self._array('content', 'user_index'), scale)
+
+    def profile_statistics(self):
+        """Return the (weight, norm) arrays of the user profiles (see profiles.profile_statistics), or (None, None) if not compiled"""
+        if not os.path.exists(os.path.join(self.path, 'content', 'user_profile_weight.npy')):
+            return None, None
+        return self._array('content', 'user_profile_weight'), self._array('content', 'user_profile_norm')
+
+    def text_projector(self):
+        """Return the TextProjector of the content module, or None if not compiled"""
+        path = os.path.join(self.path, 'content', 'text_projector.npz')
+        if not os.path.exists(path):
+            return None
+        from profiles import TextProjector
+        return TextProjector.load(path)
+
+if __name__ == '__main__':
+    """Compile the input files of the recommendation engine into a binary artifact directory."""
+
+    parser = argparse.ArgumentParser(description='Compile the recommendation engine inputs into memory-mappable binary artifacts.')
+    parser.add_argument('out_dir', type=str, help='The artifact directory to write.')
+    parser.add_argument('--business', type=str, default='business_clean.csv', help='The cleaned business csv file.')
+    parser.add_argument('--review', type=str, default='review_clean.csv', help='The cleaned review csv file.')
+    parser.add_argument('--svd', type=str, default='svd_trained_info.pkl', help='The trained matrix factorization model.')
+    parser.add_argument('--rest-feature', type=str, default='rest_pcafeature_all.pkl', help='The restaurant feature vectors.')
+    parser.add_argument('--user-feature', type=str, default='user_pcafeature_all.pkl', help='The user feature vectors.')
+    parser.add_argument('--user-dtype', type=str, default='float32', choices=['float64', 'float32', 'int8'], help='The storage dtype of the user feature vectors.')
+    parser.add_argument('--text-projector', type=str, default='text_projector.npz', help='The text projection fitted by profiles.py, if available.')
+    parser.add_argument('--gazetteer', type=str, default='gazetteer.npz', help='The offline gazetteer built by gazetteer.py, if available.')
+    parser.add_argument('--no-personalized', action='store_true', help='Only compile the tables, skip the model files.')
+    parser.add_argument('--publish', action='store_true', help='Compile a new version of the versioned directory out_dir and make it current.')
+    parser.add_argument('--keep', type=int, default=3, help='The number of versions kept with --publish, the older ones are removed.')
+    args = parser.parse_args()
+
+    if args.no_personalized:
+        args.svd, args.rest_feature, args.user_feature = None, None, None
+    out_dir = new_version_dir(args.out_dir, link=False) if args.publish else args.out_dir
+    compile_artifacts(out_dir, business=args.business, review=args.review, svd=args.svd,
+                      rest_feature=args.rest_feature, user_feature=args.user_feature, user_dtype=args.user_dtype, text_projector=args.text_projector,
+                      gazetteer=args.gazetteer)
+    if args.publish:
+        publish(args.out_dir, os.path.basename(out_dir))
+        removed = prune_versions(args.out_dir, keep=args.keep)
+        print("version {} published in {}{}".format(os.path.basename(out_dir), args.out_dir, ', removed ' + ', '.join(removed) if removed else ''))
+    else:
+        print("artifacts written to {}".format(out_dir))
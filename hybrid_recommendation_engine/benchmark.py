@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the hybrid recommendation engine:
+the start-up time of the Recommender, and the latency percentiles and throughput of the keyword module (for each combination of filters)
+and of the personalized modules, along with the peak memory use, are recorded into a JSON results file
+that can be compared across commits. The synthetic datasets of synthetic.py stand in for the Yelp files.
+
+Usage:
+    python synthetic.py bench_data/ --businesses 20000 --users 100000 --reviews 1000000 [--artifacts]
+    python benchmark.py bench_data/ [--artifact-dir bench_data/artifacts] [--queries 200] [--out results.json]
+    python benchmark.py bench_data/ --compare baseline.json [--threshold 1.2] [--min-delta-ms 1]    (exits with status 1 if a scenario regressed)
+    python benchmark.py bench_data/ --trace --profile-dir profiles/    (per-stage breakdown of each scenario, and one cProfile dump per scenario)
+    python benchmark.py bench_data/ --memory-report    (memory of the compact tables against the frames of the full csv files)
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+from recommender import Recommender
+from instrument import Tracer, HistogramRegistry, profiled
+
+KEYWORD_FILTERS = ('location', 'cuisine', 'style', 'price') # the keyword filters, every combination is a scenario
+
+def peak_rss_mb():
+    """Return the peak resident set size of the process in MB, None if not available (e.g. on Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10 # bytes on macOS, kB on Linux
+
+def summarize(latencies, elapsed):
+    """Return the latency percentiles (in milliseconds) and the throughput (queries per second) of a scenario"""
+    ms = np.asarray(latencies) * 1000
+    return {'queries': len(ms), 'mean_ms': float(ms.mean()), 'p50_ms': float(np.percentile(ms, 50)), 'p90_ms': float(np.percentile(ms, 90)),
+            'p99_ms': float(np.percentile(ms, 99)), 'max_ms': float(ms.max()), 'throughput_qps': len(ms) / elapsed}
+
+def time_queries(call, queries, warmup=5):
+    """Time a call for each query, the output printed by the Recommender is discarded. Return the summary of the latencies."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        for query in queries[:warmup]:
+            call(query)
+        latencies, t0 = [], time.perf_counter()
+        for query in queries:
+            start = time.perf_counter()
+            call(query)
+            latencies.append(time.perf_counter() - start)
+    return summarize(latencies, time.perf_counter() - t0)
+
+def keyword_queries(business, filters, n, rng):
+    """Return n keyword() arguments with the filters of interest, sampled from the open restaurants so that most queries match"""
+    business = business[business.is_open == 1]
+    rows = business.iloc[rng.randint(0, len(business), n)]
+    tag = lambda values: [v.split(',')[rng.randint(0, len(v.split(',')))].strip() if isinstance(v, str) else 'pizza' for v in values]
+    queries = [{} for _ in range(n)]
+    for query, city, state, cuisine, style, price in zip(queries, rows.city.values, rows.state.values, tag(rows.cuisine.values),
+                                                         tag(rows['style'].values), rows['attributes.RestaurantsPriceRange2'].values):
+        if 'location' in filters:
+            query.update(city=city, state=state, max_distance=10)
+        if 'cuisine' in filters:
+            query['cuisine'] = cuisine
+        if 'style' in filters:
+            query['style'] = style
+        if 'price' in filters:
+            query['price'] = '1,2' if np.isnan(price) else str(int(price))
+    return queries
+
+def frame_mb(df):
+    """Return the memory used by a dataframe in MB, including the strings of object and categorical columns"""
+    return df.memory_usage(deep=True).sum() / 2**20
+
+def memory_report(data_dir, engine):
+    """Return the memory used in MB by the 'business' and 'review' datasets as held by a loaded engine (compact),
+    and as loaded from the csv files of data_dir before the compact tables (legacy): the full 'review' dataset, text included,
+    plus the copy of the reviews of the restaurants in 'review_s'.
+    """
+    business = pd.read_csv(os.path.join(data_dir, 'business_clean.csv'))
+    business['postal_code'] = business.postal_code.astype(str)
+    review = pd.read_csv(os.path.join(data_dir, 'review_clean.csv'))
+    review_s = review[review.business_id.isin(business.business_id.unique())]
+    legacy = {'business': frame_mb(business), 'review': frame_mb(review), 'review_s': frame_mb(review_s)}
+    business = review = review_s = None
+    index = engine.interactions # built from either, the same in both
+    interactions = (index.indptr.nbytes + index.indices.nbytes + index.values.nbytes + index.users.memory_usage(deep=True)) / 2**20
+    legacy.update(interactions=interactions)
+    compact = {'business': frame_mb(engine.business), 'review': frame_mb(engine.review), 'review_s': 0.0, # the same frame as 'review'
+               'interactions': interactions}
+    return {'legacy': legacy, 'compact': compact, 'legacy_total': sum(legacy.values()), 'compact_total': sum(compact.values())}
+
+def git_commit():
+    """Return the current git commit of the repository, None if not available"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(data_dir, artifact_dir=None, n_queries=200, seed=42, trace=False, profile_dir=None, memory=False):
+    """Run the benchmark on the dataset of data_dir (the csv and pickle files, or the compiled artifacts of artifact_dir).
+    Return the results as a JSON-serializable dictionary.
+    ---
+    trace: a boolean to indicate if the stages of the pipeline are measured, their statistics are added to each scenario as 'stages'
+        (the measurement adds a few microseconds per stage to the latencies)
+    profile_dir: a directory to write the cProfile stats of one query of each scenario to, as <scenario>.prof
+    memory: a boolean to indicate if the memory report of the datasets (see memory_report) is added as 'memory'
+    """
+    rng = np.random.RandomState(seed)
+    artifact_dir = os.path.abspath(artifact_dir) if artifact_dir is not None else None
+    if profile_dir is not None:
+        profile_dir = os.path.abspath(profile_dir)
+        os.makedirs(profile_dir, exist_ok=True)
+    registry = HistogramRegistry() if trace else None
+    cwd = os.getcwd()
+    os.chdir(data_dir) # the engine reads the csv and pickle files from the working directory
+    try:
+        # start-up: the datasets, indices and personalized models are all loaded, the result cache is disabled so that every query is computed
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            recommender = Recommender(personalized=True, artifact_dir=artifact_dir, geocoder=False, cache_bytes=0,
+                                      tracer=Tracer([registry]) if trace else None)
+        results = {'startup': {'seconds': time.perf_counter() - t0, 'peak_rss_mb': peak_rss_mb()}, 'scenarios': {}}
+
+        def scenario(name, call, queries):
+            if trace:
+                registry.reset()
+            results['scenarios'][name] = time_queries(call, queries)
+            if trace:
+                results['scenarios'][name]['stages'] = registry.summary()
+            if profile_dir is not None:
+                with contextlib.redirect_stdout(io.StringIO()), profiled(os.path.join(profile_dir, name + '.prof'), limit=0):
+                    call(queries[0])
+
+        for k in range(len(KEYWORD_FILTERS) + 1):
+            for filters in itertools.combinations(KEYWORD_FILTERS, k):
+                queries = keyword_queries(recommender.business, filters, n_queries, rng)
+                name = 'keyword[{}]'.format('+'.join(filters) if filters else 'none')
+                scenario(name, lambda q: recommender.keyword(**q), queries)
+
+        # users with a rating history, and 10% of unknown users (the generic recommendation, or no recommendation)
+        user_ids = recommender.review_s.user_id.drop_duplicates().values
+        users = list(user_ids[rng.randint(0, len(user_ids), n_queries)])
+        users[::10] = ['0' * 22] * len(users[::10])
+        for module in ['collaborative', 'content', 'hybrid']:
+            scenario(module, lambda u: getattr(recommender, module)(user_id=u), users)
+
+        results['peak_rss_mb'] = peak_rss_mb() # measured before the memory report, which loads the full csv files
+        if memory:
+            results['memory'] = memory_report('.', recommender.engine)
+        results['dataset'] = {'business': len(recommender.business), 'review': len(recommender.review), 'review_s': len(recommender.review_s),
+                              'users': len(recommender.svd_trained_info['userid_to_index'])}
+    finally:
+        os.chdir(cwd)
+    results['meta'] = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(), 'data_dir': data_dir, 'artifact_dir': artifact_dir,
+                       'queries': n_queries, 'seed': seed, 'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                       'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+    return results
+
+def compare(results, baseline, threshold=1.2, min_delta_ms=1.0):
+    """Print the ratios of the p50 and p99 latencies of each scenario to those of a baseline results file,
+    as well as those of the start-up time and the peak memory use. Return the list of the metrics whose ratio exceeds the threshold,
+    latencies only count as regressions if they also increased by more than min_delta_ms (sub-millisecond timings are noisy).
+    """
+    regressions = []
+    print("{:40s} {:>10s} {:>10s} {:>8s}".format('metric', 'baseline', 'current', 'ratio'))
+    rows = [('startup seconds', baseline['startup']['seconds'], results['startup']['seconds'], 0),
+            ('peak RSS MB', baseline.get('peak_rss_mb'), results.get('peak_rss_mb'), 0)]
+    for name, scenario in results['scenarios'].items():
+        if name in baseline['scenarios']:
+            rows += [(name + ' p50_ms', baseline['scenarios'][name]['p50_ms'], scenario['p50_ms'], min_delta_ms),
+                     (name + ' p99_ms', baseline['scenarios'][name]['p99_ms'], scenario['p99_ms'], min_delta_ms)]
+    for name, old, new, min_delta in rows:
+        if old is None or new is None:
+            continue
+        ratio = new / old if old > 0 else float('inf')
+        regressed = ratio > threshold and new - old > min_delta
+        print("{:40s} {:10.2f} {:10.2f} {:8.2f}{}".format(name, old, new, ratio, ' <-- regression' if regressed else ''))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+if __name__ == '__main__':
+    """Run the benchmark suite, write the results and optionally compare them to a baseline."""
+
+    parser = argparse.ArgumentParser(description='Benchmark the start-up time, query latency and memory use of the recommendation engine.')
+    parser.add_argument('data_dir', type=str, help='The directory of the csv and pickle files, e.g. written by synthetic.py.')
+    parser.add_argument('--artifact-dir', type=str, default=None, help='The compiled artifact directory, the csv and pickle files are used if omitted.')
+    parser.add_argument('--queries', type=int, default=200, help='The number of timed queries per scenario.')
+    parser.add_argument('--seed', type=int, default=42, help='The random seed of the sampled queries.')
+    parser.add_argument('--out', type=str, default='benchmark_results.json', help='The JSON results file to write.')
+    parser.add_argument('--compare', type=str, default=None, help='A previous results file to compare to.')
+    parser.add_argument('--threshold', type=float, default=1.2, help='The latency ratio above which a scenario is reported as a regression.')
+    parser.add_argument('--trace', action='store_true', help='Record the time spent in each stage of the pipeline for every scenario.')
+    parser.add_argument('--profile-dir', type=str, default=None, help='A directory to write the cProfile stats of one query per scenario to.')
+    parser.add_argument('--memory-report', action='store_true', help='Compare the memory of the datasets to that of the frames of the full csv files.')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='The latency increase below which a scenario is never reported as a regression.')
+    args = parser.parse_args()
+
+    results = run(args.data_dir, artifact_dir=args.artifact_dir, n_queries=args.queries, seed=args.seed, trace=args.trace, profile_dir=args.profile_dir,
+                  memory=args.memory_report)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("start-up {:.2f}s, peak RSS {} MB".format(results['startup']['seconds'], results['peak_rss_mb']))
+    for name, scenario in results['scenarios'].items():
+        print("{:40s} p50 {:8.2f} ms  p99 {:8.2f} ms  {:8.1f} queries/s".format(name, scenario['p50_ms'], scenario['p99_ms'], scenario['throughput_qps']))
+        for stage, stats in scenario.get('stages', {}).items():
+            print("    {:36s} mean {:8.3f} ms  rows {:10.0f} -> {:10.0f}".format(stage, stats['mean_ms'], stats['mean_rows_in'], stats['mean_rows_out']))
+    if 'memory' in results:
+        print("{:40s} {:>10s} {:>10s}".format('dataset memory MB', 'legacy', 'compact'))
+        for name in ['business', 'review', 'review_s', 'interactions']:
+            print("{:40s} {:10.1f} {:10.1f}".format(name, results['memory']['legacy'][name], results['memory']['compact'][name]))
+        print("{:40s} {:10.1f} {:10.1f}".format('total', results['memory']['legacy_total'], results['memory']['compact_total']))
+    print("results written to {}".format(args.out))
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.min_delta_ms)
+        if regressions:
+            sys.exit(1)
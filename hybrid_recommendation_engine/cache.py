@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded result cache for the hybrid recommendation engine:
+the ranked recommendations of repeated queries are kept in an LRU cache with a time to live and a memory budget in bytes.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import collections
+import sys
+import threading
+import time
+import numpy as np
+
+def value_nbytes(value):
+    """Return the approximate size in bytes of a cached value: the buffers of its numpy arrays plus the size of its other items"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(value_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+# LRU/TTL cache class
+class ResultCache:
+
+    def __init__(self, maxbytes=64*2**20, ttl=600):
+        """initiate a thread-safe result cache.
+        ---
+        maxbytes: the memory budget of the cached keys and values in bytes, the least recently used entries are evicted first
+        ttl: the time to live of an entry in seconds, None to never expire
+        ---
+        note: values larger than the whole budget are not cached. Use .invalidate() whenever the data the values were computed from changes.
+        """
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self._cache = collections.OrderedDict() # key -> (value, size in bytes, expiry)
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits, self.misses, self.evictions, self.invalidations = 0, 0, 0, 0
+
+    def get(self, key):
+        """Return the cached value of the key of interest, or None if not cached or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                if entry[2] is None or entry[2] > now:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._pop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Cache the value of the key of interest, evicting the least recently used entries beyond the memory budget"""
+        size = value_nbytes(key) + value_nbytes(value)
+        if size > self.maxbytes:
+            return
+        with self._lock:
+            if key in self._cache:
+                self._pop(key)
+            self._cache[key] = (value, size, None if self.ttl is None else time.monotonic() + self.ttl)
+            self.nbytes += size
+            while self.nbytes > self.maxbytes:
+                self._pop(next(iter(self._cache)))
+                self.evictions += 1
+
+    def _pop(self, key):
+        _, size, _ = self._cache.pop(key)
+        self.nbytes -= size
+
+    def discard(self, key):
+        """Drop the entry of the key of interest if cached, e.g. when the data its value was computed from changes"""
+        with self._lock:
+            if key in self._cache:
+                self._pop(key)
+
+    def invalidate(self):
+        """Drop all the entries, e.g. when the model artifacts or the business catalog are reloaded"""
+        with self._lock:
+            self._cache.clear()
+            self.nbytes = 0
+            self.invalidations += 1
+
+    def stats(self):
+        """Return the counters of the cache as a dictionary"""
+        with self._lock:
+            return {'entries': len(self._cache), 'nbytes': self.nbytes, 'maxbytes': self.maxbytes, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'invalidations': self.invalidations}
+
+    def __len__(self):
+        return len(self._cache)
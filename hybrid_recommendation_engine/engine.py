@@ -0,0 +1,1231 @@
+# -*- coding: utf-8 -*-
+"""
+Read-only core of the hybrid recommendation engine:
+the datasets, indices and models are loaded once into an Engine object, which answers immutable Request objects
+with immutable Result objects. No per-request state is stored on the engine and the shared frames are never modified,
+so that one loaded engine can serve many requests at once, e.g. from a thread pool:
+
+    engine = Engine(personalized=True)
+    result = engine.recommend(Request('keyword', city='Las Vegas', state='NV', cuisine='thai', n=10))
+    engine.frame(result)  # the recommendations as a new dataframe
+
+The interactive Recommender in recommender.py is a thin stateful wrapper over an Engine.
+New reviews are added with Engine.ingest_reviews(batch) while requests are being served, without reloading the engine,
+and are kept in memory until Engine.persist() writes them into a new version of a versioned artifact directory.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import collections
+import json
+import os.path
+import pickle
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import linear_kernel
+from spatial import SpatialIndex
+from gazetteer import Gazetteer, GeocodeCache, NominatimBackend, normalize_place
+from tags import TagIndex
+from interactions import InteractionIndex
+from artifacts import ArtifactStore, FeatureMatrix, TopKTable, CATEGORICAL_COLUMNS, compact_business, compact_review, load_pickle_chunked, read_review, digest
+from artifacts import append_reviews, current_version, new_version_dir, prune_versions, publish, write_tables, write_user_profiles, model_digests
+from ann import IVFIndex
+from cache import ResultCache
+from profiles import ProfileUpdater, TextProjector
+from instrument import Tracer
+
+# named tuple for a recommendation request, fields not passed take the defaults below
+Request = collections.namedtuple('Request', ['module', 'user_id', 'zipcode', 'city', 'state', 'max_distance', 'cuisine', 'style', 'price',
+                                             'match', 'original_score', 'personalized', 'n', 'within', 'exact', 'ratings', 'weights'])
+Request.__new__.__defaults__ = ('keyword', None, None, None, None, 10, None, None, None, 'any', False, False, 5, None, False, None, None)
+Request.__doc__ = """A recommendation request.
+---
+module: 'keyword', 'collaborative', 'content' or 'hybrid'
+user_id: the user_id of interest, required by the personalized modules
+zipcode, city, state, max_distance, cuisine, style, price, match: the keyword filters, same as Recommender.keyword
+original_score: rank the keyword recommendations by the original star rating instead of the adjusted score
+personalized: rank the keyword recommendations by the personalized scores of 'within'
+n: the number of recommendations to return, None for the full ranked list
+within: a previous Result to filter further by keywords instead of the entire catalog of open restaurants
+exact: a boolean to indicate if the personalized modules must score the entire catalog even if an approximate index is loaded
+ratings: an optional dictionary {business_id: stars} of ratings of the user, folded into the matrix factorization by the collaborative module
+    together with the ratings of the user in the review data, see Engine.fold_in
+weights: an optional dictionary of blend weights of the hybrid module, overriding those of Engine.hybrid_weights
+"""
+
+# named tuple for the answer to a Request
+Result = collections.namedtuple('Result', ['request', 'positions', 'business_ids', 'scores', 'score_column', 'distance', 'total', 'exact', 'messages'])
+Result.__doc__ = """The answer to a Request, sorted by score in descending order.
+---
+positions: the row positions of the recommended restaurants in the 'business' dataset
+business_ids, scores: the business_ids of the recommended restaurants and their scores
+score_column: the name of the score, 'adjusted_score', 'stars', 'predicted_stars', 'similarity_score' or 'hybrid_score'
+distance: the distance in miles to the location of interest, None if no location filter was applied
+total: the number of restaurants matching the request before the top n selection
+exact: False if the recommendations were retrieved from an approximate index, .total is then unknown and set to the number returned
+messages: a tuple of messages for the user, e.g. the reason of an empty result
+"""
+
+# functions for scoring many users at once with the collaborative module
+def score_topk(user_vec, user_b, item_vec, item_b, r_mean, k, rated_rows=None, rated_cols=None):
+    """
+    Compute the top k predicted ratings for a chunk of users given the factors of a biased matrix factorization model.
+    Return a tuple of two arrays of shape (n_users, k): the column indices of the top k items sorted by predicted rating and the predicted ratings.
+    ---
+    user_vec, user_b: latent vectors (n_users x f) and biases (n_users) of the chunk of users
+    item_vec, item_b: latent vectors (n_items x f) and biases (n_items) of the candidate items
+    rated_rows, rated_cols: optional arrays of (user row, item column) pairs to exclude, e.g. the items already rated by the users
+    """
+
+    pred = np.dot(user_vec, item_vec.T)
+    pred += item_b
+    pred += (r_mean + user_b)[:, None]
+    if rated_rows is not None and len(rated_rows) > 0:
+        pred[rated_rows, rated_cols] = -np.inf
+    k = min(k, pred.shape[1])
+    top = np.argpartition(-pred, k-1, axis=1)[:, :k] if k < pred.shape[1] else np.tile(np.arange(k), (len(pred), 1))
+    top_pred = np.take_along_axis(pred, top, axis=1)
+    order = np.argsort(-top_pred, axis=1, kind='stable')
+
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_pred, order, axis=1)
+
+_worker_items = None # candidate item factors shared by the worker processes of Engine.collaborative_batch
+
+def _init_score_worker(item_vec, item_b, r_mean, k):
+    """initiate a worker process of Engine.collaborative_batch with the candidate item factors, so they are only sent once per worker"""
+    global _worker_items
+    _worker_items = (item_vec, item_b, r_mean, k)
+
+def _score_topk_worker(user_vec, user_b, rated_rows, rated_cols):
+    item_vec, item_b, r_mean, k = _worker_items
+    return score_topk(user_vec, user_b, item_vec, item_b, r_mean, k, rated_rows, rated_cols)
+
+def select_top(score, n=None):
+    """Return the indices of the top n scores sorted in descending order (NaN last), all the scores are sorted if n is None.
+    note: the top n are selected with np.argpartition, only the selected scores are sorted
+    """
+    if n is None or n >= len(score):
+        return np.argsort(-score, kind='stable')
+    if n <= 0:
+        return np.array([], dtype=np.int64)
+    top = np.argpartition(-score, n-1)[:n]
+    return top[np.argsort(-score[top], kind='stable')]
+
+# engine class
+class Engine:
+
+    personal_scores = ('predicted_stars', 'similarity_score', 'hybrid_score')
+    adjusted_k = 22 # dumping strength k of the adjusted score, which is the 50% quantile of the review counts for all businesses
+    fold_in_reg = 0.05 # regularization of the fold-in of new users, same as 'reg_all' of the notebook model (the 'reg' of a model trained by train.py is used instead)
+    promote_min_ratings = 5 # folded-in users with at least this many ratings are promoted into the user latent vectors of the model
+    promote_batch = 256 # the number of queued users promoted together
+    # linear blend of the hybrid module: hybrid_score = intercept + sum of weight * score, overridden by 'hybrid_model.json' if available.
+    # the defaults weigh the predicted stars (range 1-5), the cosine similarity (range -1-1) and the adjusted score (range 1-5)
+    # by 50%, 30% and 20% of their ranges
+    hybrid_weights = {'intercept': 0.0, 'predicted_stars': 0.5/4, 'similarity_score': 0.3/2, 'adjusted_score': 0.2/4}
+
+    def __init__(self, personalized=False, geocoder=None, artifact_dir=None, lazy=False, ann=False, nprobe=8, cache_bytes=64*2**20, cache_ttl=600, precomputed=False, tracer=None):
+        """initiate an Engine object, the arguments are the same as those of Recommender.
+        ---
+        All the attributes are read-only once the engine is created, except for the data of the personalized modules
+        and the default remote geocoder, which are created upon first use under a lock, the result cache,
+        and the review statistics and interactions updated by .ingest_reviews().
+        """
+
+        self.tracer = tracer if tracer is not None else Tracer() # timing spans of the stages, see instrument.py (no sink: nothing is measured)
+        # the arguments the engine was created with, so that a new engine can be loaded with the same ones (see reloader.py)
+        self.options = {'personalized': personalized, 'geocoder': geocoder, 'artifact_dir': artifact_dir, 'lazy': lazy, 'ann': ann, 'nprobe': nprobe,
+                        'cache_bytes': cache_bytes, 'cache_ttl': cache_ttl, 'precomputed': precomputed, 'tracer': tracer}
+        with self.tracer.span('load.catalog') as span:
+            self._load_catalog(artifact_dir)
+            span.rows_out = len(self.business)
+        # wrap the remote geocoder in a bounded cache, the default Nominatim backend is only created upon the first gazetteer miss
+        if geocoder is None or geocoder is False or isinstance(geocoder, GeocodeCache):
+            self.geocoder = geocoder
+        else:
+            self.geocoder = GeocodeCache(geocoder)
+
+        self.ann, self.nprobe = ann, nprobe
+        self.ann_index = {} # approximate search indices of the personalized modules, keyed by module name
+        self._digests = {} # digests of the loaded models keyed by (module, side), see ._model_digest()
+        self.precomputed = precomputed
+        self.topk = {} # tables of the top k recommendations materialized offline by precompute.py, keyed by module name
+
+        # data of the personalized modules, loaded by ._load_collaborative() and ._load_content()
+        self.svd_trained_info = None
+        # cache of the folded-in latent vectors of the users missing from the matrix factorization, and the queue of the users to promote
+        self.fold_ins = ResultCache(maxbytes=16*2**20, ttl=None)
+        self._promotion, self._user_buffers = {}, None
+        self.rest_pcafeature, self.user_pcafeature = None, None
+        self._hybrid = None # the data of both personalized modules aligned with the open restaurants, loaded by ._load_hybrid()
+        self._load_lock = threading.Lock()
+        self._ingest_lock = threading.Lock() # serializes the writers of .ingest_reviews(), readers never wait
+
+        # cache of the ranked recommendations of repeated requests, the generation is part of the keys so that a reload never serves stale results
+        self.cache = ResultCache(maxbytes=cache_bytes, ttl=cache_ttl) if cache_bytes else None
+        self.generation = 0
+
+        # pre-load additional information if personalized modules are desired
+        if personalized and not lazy:
+            self._load_collaborative()
+            self._load_content()
+
+    def _load_catalog(self, artifact_dir=None):
+        """Load the 'business' and 'review' datasets and build the indices over them.
+        note: this hidden method should only be called within the methods '__init__' and 'reload'
+        """
+
+        # import datasets needed to power the recommendation engine, from the compiled binary artifacts if available
+        # (the current version if the artifact directory is versioned, see artifacts.py)
+        self.artifacts = ArtifactStore(artifact_dir) if artifact_dir is not None else None
+        if self.artifacts is not None:
+            self.business = self.artifacts.business()
+            review = self.artifacts.review()
+        else:
+            self.business = compact_business(pd.read_csv('business_clean.csv'))  # contains business data including location data, attributes and categories
+            review = read_review('review_clean.csv') # the user_id that wrote each review, the business_id the review is written for and its stars, the text is not read
+        # the reviews related to restaurants only, with dictionary-encoded ids and int8 stars (see artifacts.compact_review):
+        # the codes of 'business_id' are the row positions in the 'business' dataset. 'review' and 'review_s' are the same frame,
+        # the reviews of other businesses are never used
+        self.review = self.review_s = compact_review(review, self.business.business_id)
+        review = None
+        # add 'adjusted_score' to the 'business' dataset, which adjusts the restaurnat average star ratings by the number of ratings it has
+        globe_mean = ((self.business.stars * self.business.review_count).sum())/(self.business.review_count.sum())
+        k = self.adjusted_k
+        self.business['adjusted_score'] = (self.business.review_count * self.business.stars + k * globe_mean)/(self.business.review_count + k)
+        # running review count and star sum of each restaurant and of the whole catalog, updated in place by .ingest_reviews():
+        # the 'review_count', 'stars' and 'adjusted_score' columns of the 'business' dataset keep the loaded values,
+        # the current ones are read through .catalog_stats()
+        self._review_count = self.business.review_count.to_numpy(dtype=np.int64, copy=True)
+        self._stars = self.business.stars.to_numpy(dtype=float, copy=True)
+        self._star_sum = self._stars * self._review_count
+        self._total_stars = (self.business.stars * self.business.review_count).sum()
+        self._total_count = self.business.review_count.sum()
+        self._stats_version = 0 # odd while an ingestion is updating the statistics, see .catalog_stats()
+        # map each business_id to its row position in the 'business' dataset, used to look up per-row arrays for any recommendation list
+        self.business_pos = pd.Index(self.business.business_id)
+        self._business_ids = self.business.business_id.to_numpy(dtype=object)
+        # row positions of the open restaurants, the default catalog of the keyword module
+        self._open_pos = np.flatnonzero(self.business.is_open.values == 1)
+        # the distinct values (with NaN last) and the codes of the categorical columns, to decode the rows of the recommendations
+        self._categories = {c: (np.append(self.business[c].cat.categories.to_numpy(dtype=object), np.nan), self.business[c].cat.codes.values)
+                            for c in CATEGORICAL_COLUMNS}
+        # build the spatial index over the restaurant coordinates once, used for all location queries
+        self.spatial_index = SpatialIndex(self.business.latitude.values, self.business.longitude.values)
+        # index the restaurants rated by each user once, restaurants are coded by their row positions in the 'business' dataset
+        self.interactions = InteractionIndex(self.review_s.user_id.values, self.review_s.business_id.cat.codes.values, len(self.business),
+                                             self.review_s.stars.values)
+        self._ingested_users = set() # the users with reviews added by .ingest_reviews(), whose materialized top k are stale
+        self._ingested_reviews = [] # the batches of reviews added by .ingest_reviews() since loaded (or persisted), see .persist()
+        # parse the comma-separated 'cuisine' and 'style' columns once into inverted indices of boolean masks
+        self.cuisine_index = TagIndex(self.business.cuisine.values)
+        self.style_index = TagIndex(self.business['style'].values)
+        # load the offline gazetteer of zipcode, city and state centroids if available (next to the other artifacts, in the version loaded
+        # if the artifact directory is versioned), otherwise build it from the 'business' dataset
+        path = os.path.join(self.artifacts.path if self.artifacts is not None else '.', 'gazetteer.npz')
+        if os.path.exists(path):
+            self.gazetteer = Gazetteer.load(path)
+        else:
+            self.gazetteer = Gazetteer.from_business(self.business)
+
+    def reload(self, artifact_dir=None):
+        """Reload the 'business' and 'review' datasets and the data of the personalized modules, e.g. after new artifacts are compiled.
+        ---
+        artifact_dir: the artifact directory to load from, default is the current one (or the csv and pickle files if no artifact directory is used),
+            the current version of a versioned artifact directory is looked up again
+        ---
+        note: the personalized modules loaded so far are reloaded right away, the others upon their first use.
+            The reviews added by .ingest_reviews() are dropped unless they are in the reloaded datasets. The result cache is invalidated.
+            The engine is updated in place, the requests served meanwhile may see a mix of the old and the new data:
+            use an EngineReloader (see reloader.py) to load a new engine in the background and swap it in instead.
+        """
+        with self._load_lock, self._ingest_lock:
+            loaded = (self.svd_trained_info is not None, self.user_pcafeature is not None, self._hybrid is not None)
+            with self.tracer.span('load.catalog') as span:
+                self._load_catalog(artifact_dir if artifact_dir is not None else (self.artifacts.root if self.artifacts is not None else None))
+                span.rows_out = len(self.business)
+            self.ann_index, self.topk, self._digests = {}, {}, {}
+            self.svd_trained_info = None
+            self.fold_ins.invalidate()
+            self._promotion, self._user_buffers = {}, None
+            self.rest_pcafeature, self.user_pcafeature = None, None
+            self._hybrid = None
+            self.generation += 1
+        if loaded[0]:
+            self._load_collaborative()
+        if loaded[1]:
+            self._load_content()
+        if loaded[2]:
+            self._load_hybrid()
+        self.invalidate()
+
+    def invalidate(self):
+        """Invalidate the result cache, to be called whenever the data the recommendations are computed from changes"""
+        self.generation += 1
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def _load_collaborative(self):
+        """Load the information for the collaborative module if not loaded yet:
+        the memory-mapped artifacts if available, otherwise the pickled 'svd_trained_info.pkl'.
+        """
+        with self._load_lock:
+            if self.svd_trained_info is not None:
+                return
+            with self.tracer.span('load.collaborative') as span:
+                if self.artifacts is not None:
+                    svd_trained_info = self.artifacts.svd_trained_info()
+                else:
+                    with open('svd_trained_info.pkl', 'rb') as f:
+                        svd_trained_info = pickle.load(f)
+                span.rows_out = len(svd_trained_info['userid_to_index'])
+            # align the item indices of the matrix factorization with the open restaurants of the 'business' catalog once:
+            # '._collab_items' are the item indices of the open restaurants and '._collab_pos' their row positions in the 'business' dataset
+            itemid_to_idx = svd_trained_info['itemid_to_index']
+            item_ids = np.empty(len(itemid_to_idx), dtype=object)
+            item_ids[list(itemid_to_idx.values())] = list(itemid_to_idx.keys())
+            item_pos = self.business_pos.get_indexer(item_ids)
+            is_open = np.append(self.business.is_open.values == 1, False) # position -1 (not a restaurant) maps to the appended False
+            self._collab_items = np.flatnonzero(is_open[item_pos])
+            self._collab_pos = item_pos[self._collab_items]
+            # item index of each row position in the 'business' dataset (-1 if not in the model), used by the fold-in of new users
+            self._collab_item_of_pos = np.full(len(self.business), -1, dtype=np.int64)
+            self._collab_item_of_pos[item_pos[item_pos >= 0]] = np.flatnonzero(item_pos >= 0)
+            # the factors of the open restaurants and the column of each row position among them (-1 if none), gathered once for the scoring
+            self._collab_item_vec = np.asarray(svd_trained_info['item_latent'][self._collab_items])
+            self._collab_item_b = np.asarray(svd_trained_info['item_bias'][self._collab_items])
+            self._collab_col_of_pos = np.full(len(self.business), -1, dtype=np.int64)
+            self._collab_col_of_pos[self._collab_pos] = np.arange(len(self._collab_pos))
+            self._load_ann('collaborative', svd_trained_info)
+            self.svd_trained_info = svd_trained_info
+            self._load_topk('collaborative')
+
+    def _load_content(self):
+        """Load the information for the content-based module if not loaded yet:
+        the memory-mapped artifacts if available, otherwise the pickled restaurant and user pcafeature vectors.
+        """
+        with self._load_lock:
+            if self.user_pcafeature is not None:
+                return
+            with self.tracer.span('load.content') as span:
+                if self.artifacts is not None:
+                    rest_pcafeature = self.artifacts.rest_pcafeature()
+                    # mapped read-only: the artifact files may be shared with other processes, the profiles updated by .ingest_reviews()
+                    # are kept in memory until written into a new version by .persist()
+                    user_pcafeature = self.artifacts.user_pcafeature()
+                    weight, norm = self.artifacts.profile_statistics()
+                    text_projector = self.artifacts.text_projector()
+                else:
+                    with open('rest_pcafeature_all.pkl', 'rb') as f:
+                        rest_pcafeature = FeatureMatrix.from_frame(pickle.load(f))   # load the saved restaurant pcafeature vectors
+                    user_pcafeature = FeatureMatrix.from_frame(load_pickle_chunked('user_pcafeature_all.pkl'))  # load the saved user pcafeature vectors
+                    weight, norm = None, None
+                    text_projector = TextProjector.load('text_projector.npz') if os.path.exists('text_projector.npz') else None
+                span.rows_out = len(user_pcafeature)
+            # align the restaurant feature vectors with the open restaurants of the 'business' catalog once:
+            # '._content_rows' are the rows of the open restaurants in 'rest_pcafeature' and '._content_pos' their row positions in the 'business' dataset
+            rest_pos = self.business_pos.get_indexer(rest_pcafeature.index)
+            is_open = np.append(self.business.is_open.values == 1, False) # position -1 (not a restaurant) maps to the appended False
+            self._content_rows = np.flatnonzero(is_open[rest_pos])
+            self._content_pos = rest_pos[self._content_rows]
+            # row in 'rest_pcafeature' of each row position in the 'business' dataset (-1 if none), used by the profile updates
+            self._content_row_of_pos = np.full(len(self.business), -1, dtype=np.int64)
+            self._content_row_of_pos[rest_pos[rest_pos >= 0]] = np.flatnonzero(rest_pos >= 0)
+            # the feature vectors of the open restaurants and the column of each row position among them (-1 if none), gathered once for the scoring
+            self._content_item_vec = np.asarray(rest_pcafeature.values[self._content_rows])
+            self._content_col_of_pos = np.full(len(self.business), -1, dtype=np.int64)
+            self._content_col_of_pos[self._content_pos] = np.arange(len(self._content_pos))
+            if text_projector is not None and len(text_projector.components) != rest_pcafeature.values.shape[1]:
+                print("the text projection has {} components but the restaurant feature vectors {}, review texts are not projected."
+                      .format(len(text_projector.components), rest_pcafeature.values.shape[1]))
+                text_projector = None
+            self.text_projector = text_projector
+            self.profiles = ProfileUpdater(user_pcafeature, weight, norm)
+            self._load_ann('content', (rest_pcafeature, user_pcafeature))
+            self.rest_pcafeature, self.user_pcafeature = rest_pcafeature, user_pcafeature
+            self._load_topk('content')
+
+    def _load_hybrid(self):
+        """Load the information for the hybrid module if not loaded yet: the item latent vectors and biases of the matrix factorization
+        and the restaurant feature vectors are gathered once into arrays aligned with the open restaurants ('._open_pos'),
+        so that all the scores of a request are computed in one pass without merging frames.
+        The restaurants missing from a model get zero vectors, i.e. the generic predicted rating and a cosine similarity of 0.
+        The blend weights are read from 'hybrid_model.json' in the artifact directory (or the working directory) if available.
+        """
+        self._load_collaborative()
+        self._load_content()
+        with self._load_lock:
+            if self._hybrid is not None:
+                return
+            info, pos = self.svd_trained_info, self._open_pos
+            items, rows = self._collab_item_of_pos[pos], self._content_row_of_pos[pos]
+            item_vec = np.zeros((len(pos), info['item_latent'].shape[1]), dtype=info['item_latent'].dtype)
+            item_b = np.zeros(len(pos))
+            item_vec[items >= 0] = info['item_latent'][items[items >= 0]]
+            item_b[items >= 0] = info['item_bias'][items[items >= 0]]
+            rest_vec = np.zeros((len(pos), self.rest_pcafeature.values.shape[1]), dtype=np.float32)
+            rest_vec[rows >= 0] = self.rest_pcafeature.rows(rows[rows >= 0])
+            path = os.path.join(self.artifacts.path if self.artifacts is not None else '.', 'hybrid_model.json')
+            if os.path.exists(path):
+                with open(path) as f:
+                    self.hybrid_weights = dict(self.hybrid_weights, **json.load(f))
+            self._hybrid = (item_vec, item_b, rest_vec)
+
+    def _load_ann(self, module, model):
+        """Load the approximate search index of a personalized module if requested and available, and built from the model being loaded
+        (the 'svd_trained_info' dictionary or the (rest_pcafeature, user_pcafeature) tuple).
+        The rows of the index are aligned with the 'business' dataset by business_id: '.positions' holds their row positions.
+        note: this hidden method should only be called within the methods '_load_collaborative' and '_load_content'
+        """
+        if not self.ann:
+            return
+        path = os.path.join(self.artifacts.path if self.artifacts is not None else '.', 'ann_{}.npz'.format(module))
+        if not os.path.exists(path):
+            print("no approximate search index found at {}, the {} module falls back to brute-force scoring.".format(path, module))
+            return
+        index = IVFIndex.load(path)
+        # the index re-ranks with the restaurant vectors stored in it, it must come from the same model
+        if index.model is None or index.model.get('items') != self._model_digest(module, 'items', model):
+            print("the approximate search index at {} was built from another model, the {} module falls back to brute-force scoring."
+                  .format(path, module))
+            return
+        index.positions = self.business_pos.get_indexer(index.ids)
+        index.missing = index.positions < 0 # restaurants no longer in the catalog are never returned
+        self.ann_index[module] = index
+
+    def _model_digest(self, module, side, model=None):
+        """Return the digest of the restaurant ('items') or user ('users') side of the model of a personalized module, computed once per model:
+        the latent vectors and biases (with the mean rating) or the feature vectors, with their ids in row order (see artifacts.digest).
+        model: the model being loaded, default is the loaded one (the 'svd_trained_info' dictionary or the (rest_pcafeature, user_pcafeature) tuple)
+        note: the digest of the users is that of the loaded vectors, before the updates of .ingest_reviews().
+            The digests of a model loaded from artifacts are those recorded in the manifest when it was written (see artifacts.model_digests),
+            they are only computed (reading the whole model) for the pickled models and the artifacts compiled before they were recorded.
+        """
+        recorded = self.artifacts.manifest.get(module + '_digest') if self.artifacts is not None else None
+        if recorded is not None:
+            return recorded[side]
+        key = (module, side)
+        if key not in self._digests:
+            if module == 'collaborative':
+                info = model if model is not None else self.svd_trained_info
+                ids = info['itemid_to_index'] if side == 'items' else info['userid_to_index']
+                ordered = np.empty(len(ids), dtype=object)
+                ordered[list(ids.values())] = list(ids.keys())
+                prefix = 'item' if side == 'items' else 'user'
+                self._digests[key] = digest(info[prefix + '_latent'], info[prefix + '_bias'], repr(float(info['mean_rating'])), ordered)
+            else:
+                features = (model if model is not None else (self.rest_pcafeature, self.user_pcafeature))[0 if side == 'items' else 1]
+                parts = [features.values, np.asarray(features.index, dtype=object)]
+                if getattr(features, 'scale', None) is not None:
+                    parts.append(features.scale)
+                self._digests[key] = digest(*parts)
+        return self._digests[key]
+
+    def _model_fingerprint(self, module):
+        """Return the fingerprint of the loaded model of a personalized module, recorded with the materialized tables to detect stale ones:
+        the digests of its user and restaurant sides (see ._model_digest), and the version id of a collaborative model trained by train.py
+        """
+        fingerprint = {'users': self._model_digest(module, 'users'), 'items': self._model_digest(module, 'items')}
+        version = self.svd_trained_info.get('version') if module == 'collaborative' else None
+        if isinstance(version, dict) and 'id' in version:
+            fingerprint['version'] = version['id']
+        return fingerprint
+
+    def _load_topk(self, module):
+        """Load the table of the top k recommendations of a personalized module materialized by precompute.py if requested and available.
+        The business codes of the table are mapped to the row positions of the current 'business' dataset by business_id: '.positions' holds them.
+        note: this hidden method should only be called within the methods '_load_collaborative' and '_load_content'
+        """
+        if not self.precomputed:
+            return
+        path = os.path.join(self.artifacts.path if self.artifacts is not None else '.', 'topk', module)
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            print("no materialized top k found at {}, the {} module falls back to live scoring.".format(path, module))
+            return
+        table = TopKTable(path)
+        if table.meta['model'] != self._model_fingerprint(module):
+            print("the materialized top k at {} was computed from another model, the {} module falls back to live scoring.".format(path, module))
+            return
+        # restaurants no longer in the catalog or closed map to -1, as does the padding code -1 (the appended last entry)
+        positions = np.append(self.business_pos.get_indexer(np.asarray(table.business_ids, dtype=object)), -1)
+        is_open = np.append(self.business.is_open.values == 1, False)
+        table.positions = np.where(is_open[positions], positions, -1)
+        self.topk[module] = table
+
+    def precomputed_result(self, request):
+        """Return the Result of a personalized Request answered from the materialized top k (see ._topk_lookup),
+        or None if it has to be scored live (or the module is not loaded yet), e.g. to answer it before batching it with other requests.
+        The Result is the same as returned by .recommend().
+        """
+        if request.module not in ('collaborative', 'content') or request.module not in self.topk or request.user_id is None:
+            return None
+        found = self._topk_lookup(request)
+        if found is None:
+            return None
+        top = select_top(found[1], request.n)
+        pos = found[0][top]
+        return Result(request, pos, self._business_ids[pos], found[1][top], 'predicted_stars' if request.module == 'collaborative' else 'similarity_score',
+                      None, len(top), False, ())
+
+    def _topk_lookup(self, request):
+        """Return the (positions, scores) of the materialized top k of the user of a Request, or None if it has to be scored live:
+        the user is not in the table, more than k or the full list of recommendations are requested, keyword filters or ratings are passed,
+        reviews of the user were ingested since the engine was loaded, or fewer than n of the restaurants of the table row are still open
+        (the row is padded if the user had fewer than k unrated restaurants, or the restaurants were closed since the table was computed).
+        """
+        table = self.topk.get(request.module)
+        if (table is None or request.n is None or request.n > table.k or request.exact or request.ratings is not None
+                or any(v is not None for v in (request.zipcode, request.city, request.state, request.cuisine, request.style, request.price))
+                or request.user_id in self._ingested_users):
+            return None
+        found = table.lookup(request.user_id)
+        if found is None:
+            return None
+        pos = table.positions[found[0]]
+        valid = pos >= 0
+        if valid.sum() < request.n:
+            return None
+        return pos[valid], found[1][valid]
+
+    def _ann_search(self, module, query, n, rated):
+        """Return the (positions, scores) of the top n restaurants of the approximate search, excluding the rated restaurants (positions)"""
+        index = self.ann_index[module]
+        exclude = index.missing | np.isin(index.positions, rated)
+        rows, score = index.search(query, n, nprobe=self.nprobe, exclude=exclude)
+        return index.positions[rows], score
+
+    def catalog_stats(self, pos):
+        """Return a consistent snapshot (review counts, star ratings, adjusted scores) of the restaurants at the positions of interest,
+        including the reviews added by .ingest_reviews().
+        ---
+        note: the statistics are read without lock: the read is retried if an ingestion updated them meanwhile (sequence lock)
+        """
+        while True:
+            version = self._stats_version
+            if version % 2 == 0:
+                count, stars, star_sum = self._review_count[pos], self._stars[pos], self._star_sum[pos]
+                total_stars, total_count = self._total_stars, self._total_count
+                if self._stats_version == version:
+                    break
+            time.sleep(0)
+        globe_mean = total_stars / total_count
+        return count, stars, (star_sum + self.adjusted_k * globe_mean) / (count + self.adjusted_k)
+
+    def ingest_reviews(self, batch):
+        """Add a batch of new reviews to the engine without reloading it, e.g. while requests are being served:
+        the review count, star sum and adjusted score of the reviewed restaurants and the interactions of the reviewers are updated,
+        as well as the content-based profiles (user feature vectors) of the reviewers if the content-based module is loaded.
+        ---
+        batch: a dataframe (or a list of dictionaries) of reviews with the columns 'user_id', 'business_id' and 'stars',
+            and optionally 'text'. The reviews of businesses not in the 'business' dataset are left out
+        ---
+        return: the number of reviews ingested
+        ---
+        note: the cost is proportional to the size of the batch. The global mean of the adjusted score is updated too,
+            which is why the adjusted scores are computed from the running statistics upon each request rather than stored.
+            The star rating of a restaurant is its running average rounded to the half star, as in the Yelp dataset.
+            The 'review' and 'review_s' datasets, the matrix factorization and the restaurant feature vectors are not updated,
+            except for the fold-in of the reviewers missing from the matrix factorization.
+            The profile of a reviewer is updated as a running weighted mean (see profiles.py) in an in-memory overlay of the user feature vectors,
+            the artifact files are never modified. The reviews are kept in memory too, until .persist() writes them into a new version.
+            The result cache is invalidated.
+        """
+        batch = batch if isinstance(batch, pd.DataFrame) else pd.DataFrame(batch)
+        missing = [c for c in ['user_id', 'business_id', 'stars'] if c not in batch.columns]
+        if len(missing) > 0:
+            raise ValueError("the batch of reviews is missing the columns {}".format(missing))
+        pos = self._positions(batch)
+        keep = pos >= 0
+        pos, stars, user_ids = pos[keep], batch.stars.to_numpy(dtype=float)[keep], batch.user_id.to_numpy(dtype=object)[keep]
+        texts = batch.text.to_numpy(dtype=object)[keep] if 'text' in batch.columns else None
+        if len(pos) == 0:
+            return 0
+        # aggregate the batch per restaurant
+        reviewed, inverse = np.unique(pos, return_inverse=True)
+        batch_count, batch_sum = np.bincount(inverse), np.bincount(inverse, weights=stars)
+
+        with self._ingest_lock:
+            count = self._review_count[reviewed] + batch_count
+            star_sum = self._star_sum[reviewed] + batch_sum
+            # the version is odd while the statistics are updated, so that concurrent readers retry rather than read a half-updated state
+            self._stats_version += 1
+            self._review_count[reviewed] = count
+            self._star_sum[reviewed] = star_sum
+            self._stars[reviewed] = np.round(star_sum / count * 2) / 2
+            self._total_stars += stars.sum()
+            self._total_count += len(stars)
+            self._stats_version += 1
+            # fold the reviews into the profiles of the reviewers, before their interactions are added (see ._profile_history())
+            if self.user_pcafeature is not None:
+                self._update_profiles(user_ids, pos, stars, texts)
+            # add the new interactions to the overlay of the index, merged into new CSR arrays once the overlay gets large
+            self.interactions.add(user_ids, pos, stars)
+            if self.interactions.n_added > max(10**5, len(self.interactions.indices) // 10):
+                self.interactions = self.interactions.compacted()
+            # the reviewers missing from the matrix factorization are folded in again upon their next request
+            self._ingested_users.update(user_ids)
+            ingested = pd.DataFrame({'user_id': user_ids, 'business_id': self._business_ids[pos], 'stars': stars})
+            if texts is not None:
+                ingested['text'] = texts
+            self._ingested_reviews.append(ingested)
+            for user_id in set(user_ids):
+                self.fold_ins.discard(user_id)
+                self._promotion.pop(user_id, None)
+        self.invalidate()
+        return len(pos)
+
+    def ingested_reviews(self):
+        """Return the reviews added by .ingest_reviews() since the engine was loaded (or last persisted) as a dataframe,
+        e.g. to add them to a new engine (see reloader.py)
+        """
+        with self._ingest_lock:
+            batches = list(self._ingested_reviews)
+        if len(batches) == 0:
+            return pd.DataFrame({'user_id': [], 'business_id': [], 'stars': []})
+        return pd.concat(batches, ignore_index=True)
+
+    def persist(self, keep=None):
+        """Write the reviews added by .ingest_reviews() into a new version of the versioned artifact directory and publish it:
+        the review statistics of the restaurants ('business'), the reviews ('review') and the updated user profiles (if the content module is loaded)
+        are written into a copy of the version loaded, the other files are hard-linked from it but the materialized top k, which are dropped.
+        ---
+        keep: the number of versions kept, the older ones are removed (see artifacts.prune_versions), all are kept if None
+        ---
+        return: the name of the new version
+        ---
+        note: the engine keeps serving the version it loaded (with the reviews ingested in memory), the engines reloaded afterwards
+            load the new version. The reviews ingested while the content module was not loaded are not folded into the profiles.
+            The star ratings are written rounded to the half star, as in the Yelp dataset, which the adjusted scores of the new version are computed from.
+            Only one process should persist the reviews it ingests into a given versioned artifact directory.
+        """
+        if self.artifacts is None or self.artifacts.version is None:
+            raise ValueError("the ingested reviews can only be persisted into a versioned artifact directory, see artifacts.py")
+        root = self.artifacts.root
+        with self._ingest_lock:
+            if current_version(root) != self.artifacts.version:
+                raise ValueError("version {} was published since version {} was loaded, please reload the engine first"
+                                 .format(current_version(root), self.artifacts.version))
+            t0 = time.time()
+            path = new_version_dir(root)
+            ingested = pd.concat(self._ingested_reviews, ignore_index=True) if len(self._ingested_reviews) > 0 else None
+            # the current review statistics replace the loaded ones, 'adjusted_score' is computed upon loading
+            business = self.business.drop(columns='adjusted_score')
+            business['review_count'], business['stars'] = self._review_count, self._stars
+            review = append_reviews(self.review, ingested, self.business.business_id) if ingested is not None else self.review
+            write_tables(business, review, path)
+            # the top k materialized from the loaded reviews are stale for the reviewers, they are not carried over (the links only are removed)
+            shutil.rmtree(os.path.join(path, 'topk'), ignore_errors=True)
+            with open(os.path.join(path, 'manifest.json')) as f:
+                manifest = json.load(f)
+            manifest.update({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'business_rows': len(business), 'review_rows': len(review),
+                             'persisted_from': self.artifacts.version, 'ingested_reviews': 0 if ingested is None else len(ingested)})
+            if self.user_pcafeature is not None and 'content' in manifest['modules']:
+                write_user_profiles(self.user_pcafeature, self.profiles.weight, self.profiles.norm, self.profiles.updated_statistics(), path)
+                manifest['content_digest'] = model_digests(path, 'content')
+            with open(os.path.join(path, 'manifest.json.tmp'), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(os.path.join(path, 'manifest.json.tmp'), os.path.join(path, 'manifest.json'))
+            version = os.path.basename(path)
+            publish(root, version)
+            self._ingested_reviews = [] # in the published version from now on
+        if keep is not None:
+            prune_versions(root, keep=keep)
+        print("{} ingested reviews persisted into version {} in {:.1f}s".format(manifest['ingested_reviews'], version, time.time() - t0))
+        return version
+
+    def _update_profiles(self, user_ids, pos, stars, texts=None):
+        """Fold a batch of reviews into the user feature vectors of their users, see ProfileUpdater.update.
+        The feature vector of a review is the projection of its text if available, otherwise the feature vector of the reviewed restaurant,
+        as in recommender_content.ipynb. The reviews without either are left out.
+        note: this hidden method should only be called within the method 'ingest_reviews'
+        """
+        rows = self._content_row_of_pos[pos]
+        has = rows >= 0
+        vectors = np.zeros((len(pos), self.rest_pcafeature.values.shape[1]), dtype=np.float32)
+        vectors[has] = self.rest_pcafeature.rows(rows[has])
+        if texts is not None and self.text_projector is not None:
+            has_text = np.array([isinstance(t, str) and len(t) > 0 for t in texts], dtype=bool)
+            if has_text.any():
+                vectors[has_text] = self.text_projector.transform(texts[has_text])
+                has |= has_text
+        user_ids, vectors, stars = user_ids[has], vectors[has], stars[has]
+        # group the reviews by user
+        codes, users = pd.factorize(user_ids)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(users) + 1))
+        for i, user_id in enumerate(users):
+            reviews = order[bounds[i]:bounds[i+1]]
+            self.profiles.update(user_id, vectors[reviews], stars[reviews], lambda: self._profile_history(user_id))
+
+    def _profile_history(self, user_id):
+        """Return the (weight, norm) of the profile of the user_id of interest estimated from its rating history,
+        for the users whose profile statistics are not stored, see ProfileUpdater.statistics
+        """
+        items, ratings = self.interactions.ratings(user_id)
+        rows = self._content_row_of_pos[items]
+        ratings = ratings[rows >= 0].astype(float)
+        if ratings.sum() <= 0:
+            return 0.0, 0.0
+        mean = np.dot(ratings, self.rest_pcafeature.rows(rows[rows >= 0])) / ratings.sum()
+        return float(ratings.sum()), float(np.sqrt(np.dot(mean, mean)))
+
+    def _positions(self, df):
+        """Return the row positions in the 'business' dataset of the restaurants in df, used to look up per-row arrays and masks"""
+        return self.business_pos.get_indexer(df.business_id)
+
+    #------------------------------------------------------------
+    # request API
+    def recommend(self, request):
+        """Answer a Request with a Result, see the docstrings of Request and Result.
+        ---
+        The candidates of the module of interest are scored first (the open restaurants, or the restaurants of 'request.within', for the keyword module),
+        then filtered by the keywords of the request and finally the top n are selected.
+        A Result with no recommendation and the reason in .messages is returned if the request cannot be answered.
+        """
+
+        if request.module not in ('keyword', 'collaborative', 'content', 'hybrid'):
+            raise ValueError("module must be one of 'keyword', 'collaborative', 'content' or 'hybrid', got {}".format(request.module))
+
+        # look up the result cache first
+        with self.tracer.span('recommend.' + request.module) as span:
+            with self.tracer.span('cache') as cache_span:
+                result = self.cached(request)
+                cache_span.rows_out = None if result is None else len(result.positions)
+            if result is None:
+                result = self._recommend(request)
+                self.remember(result)
+            span.rows_out = len(result.positions)
+        return result
+
+    def cached(self, request):
+        """Return the cached Result of a Request, or None if not cached"""
+        key = self._cache_key(request) if self.cache is not None else None
+        cached = self.cache.get(key) if key is not None else None
+        if cached is None:
+            return None
+        pos, score, column, distance, total, exact, messages = cached
+        return Result(request, pos, self._business_ids[pos], score, column, distance, total, exact, messages)
+
+    def remember(self, result):
+        """Cache a Result, e.g. one computed by the batch scoring of the HTTP service.
+        Only the ranked positions (int32 codes of the business_ids) and the scores are cached, not the business_ids nor any dataframe.
+        A Result with no recommendation and a reason (see ._empty()) is not cached, the reason may no longer hold upon the next request.
+        """
+        if len(result.positions) == 0 and result.messages:
+            return
+        key = self._cache_key(result.request) if self.cache is not None else None
+        if key is not None:
+            self.cache.put(key, (result.positions.astype(np.int32), result.scores, result.score_column, result.distance,
+                                 result.total, result.exact, result.messages))
+
+    def _recommend(self, request):
+        """Answer a Request with a Result, bypassing the result cache.
+        note: this hidden method should only be called within the method 'recommend'
+        """
+        with self.tracer.span('score.' + request.module) as span:
+            if request.module == 'keyword':
+                candidates = self._keyword_scores(request)
+            elif request.module == 'hybrid':
+                candidates = self._hybrid_scores(request)
+            else:
+                candidates = self._personalized_scores(request)
+            span.rows_out = len(candidates.positions) if isinstance(candidates, Result) else len(candidates[0])
+        if isinstance(candidates, Result):
+            return candidates
+        pos, score, column, exact, messages = candidates
+
+        # filter the scored candidates by the keywords of the request
+        pos, score, distance, error = self._filter(request, pos, score)
+        if error is not None:
+            return self._empty(request, column, *(messages + error))
+
+        # select the top n recommendations only
+        with self.tracer.span('select_top', rows_in=len(score)) as span:
+            top = select_top(score, request.n)
+            span.rows_out = len(top)
+        return Result(request, pos[top], self._business_ids[pos[top]], score[top], column,
+                      None if distance is None else distance[top], len(pos) if exact else len(top), exact, messages)
+
+    def _cache_key(self, request):
+        """Return the cache key of a Request: its normalized parameters, or None if the request is not cached (requests 'within' a previous result).
+        Parameters without effect on the result are left out, e.g. 'max_distance' without zipcode and city, and place names are normalized.
+        """
+        if request.within is not None:
+            return None
+        tags = lambda t: None if t is None else (t,) if isinstance(t, str) else tuple(t) # the order of the tags is kept, it shows in the messages
+        price = [i.strip() for i in request.price.split(',')] if isinstance(request.price, str) else request.price
+        located = request.zipcode is not None or request.city is not None
+        place = lambda p: None if p is None else normalize_place(p)
+        return (self.generation, request.module, request.user_id if request.module != 'keyword' else None,
+                place(request.zipcode), place(request.city), request.state if not located else place(request.state),
+                float(request.max_distance) if located else None, tags(request.cuisine), tags(request.style), tags(price),
+                request.match if request.cuisine is not None or request.style is not None else None,
+                bool(request.original_score) if request.module == 'keyword' else None,
+                bool(request.personalized) if request.module == 'keyword' else None, request.n, bool(request.exact),
+                None if request.ratings is None else tuple(sorted(request.ratings.items())),
+                None if request.weights is None else tuple(sorted(request.weights.items())))
+
+    def frame(self, result):
+        """Return the dataframe of the recommendations of a Result, a new dataframe built from the rows of the 'business' dataset:
+        the personalized score is added as a column, as well as the distance to the location of interest ('distance_to_interest')
+        for the keyword module or whenever a location filter was applied (NaN if not applied).
+        """
+        with self.tracer.span('frame', rows_in=len(result.positions)) as span:
+            recomm = self.business.iloc[result.positions].reset_index(drop=True)
+            for c, (categories, codes) in self._categories.items(): # plain strings in the recommendations, as in the csv files
+                recomm[c] = categories[codes[result.positions]]
+            recomm['review_count'], recomm['stars'], recomm['adjusted_score'] = self.catalog_stats(result.positions)
+            if result.score_column not in recomm.columns:
+                recomm[result.score_column] = result.scores
+            if result.distance is not None:
+                recomm['distance_to_interest'] = result.distance
+            elif result.request.module == 'keyword':
+                recomm['distance_to_interest'] = np.nan
+            span.rows_out = len(recomm)
+        return recomm
+
+    def as_result(self, df):
+        """Return a Result holding the restaurants of a dataframe of recommendations, e.g. to pass as 'within' of a Request.
+        The personalized score column of the dataframe ('predicted_stars' or 'similarity_score') is kept if present.
+        """
+        pos = self._positions(df)
+        column = next((c for c in self.personal_scores if c in df.columns), None)
+        score = df[column].values.astype(float) if column is not None else np.full(len(df), np.nan)
+        keep = pos >= 0
+        pos, score = pos[keep], score[keep]
+        return Result(Request(n=None), pos, self._business_ids[pos], score, column, None, len(pos), True, ())
+
+    def _empty(self, request, column, *messages):
+        """Return a Result with no recommendation"""
+        pos = np.array([], dtype=np.int64)
+        return Result(request, pos, self._business_ids[pos], np.array([]), column, None, 0, True, messages)
+
+    def _keyword_scores(self, request):
+        """Return the candidates (positions, scores, score column, exact, messages) of the keyword module:
+        the open restaurants (or the restaurants of 'request.within') scored by the adjusted score, the original star rating,
+        or the personalized score of 'request.within' if 'request.personalized'.
+        """
+        within = request.within
+        if request.personalized:
+            if within is None or within.score_column not in self.personal_scores:
+                return self._empty(request, None, "no personalized list of recommendations is generated yet!",
+                                   "please first run the collaborative recommender module or content-based recommender module for a personalized recommendations.")
+            return within.positions, within.scores, within.score_column, True, ()
+        column = 'stars' if request.original_score else 'adjusted_score'
+        pos = within.positions if within is not None else self._open_pos
+        _, stars, adjusted = self.catalog_stats(pos)
+        return pos, stars if request.original_score else adjusted, column, True, ()
+
+    def _personalized_scores(self, request):
+        """Return the candidates (positions, scores, score column, exact, messages) of the collaborative or content-based module.
+        The materialized top k are looked up first if loaded (see ._topk_lookup).
+        The approximate index is only used for the top n if loaded, if no keyword filter is requested and if 'request.exact' is False.
+        """
+        user_id = request.user_id
+        column = 'predicted_stars' if request.module == 'collaborative' else 'similarity_score'
+        if user_id is None:
+            return self._empty(request, column, "no user_id is provided!")
+        if len(user_id) != 22:
+            return self._empty(request, column, "invalid user id!")
+        filtered = any(v is not None for v in (request.zipcode, request.city, request.state, request.cuisine, request.style, request.price))
+        approximate = request.module in self.ann_index and request.n is not None and not request.exact and not filtered
+
+        if request.module == 'collaborative':
+            # extract all necessary information saved from the matrix factorization algorithm, loaded upon the first use of the module
+            self._load_collaborative()
+            precomputed = self._topk_lookup(request)
+            if precomputed is not None:
+                return precomputed[0], precomputed[1], column, False, ()
+            info = self.svd_trained_info
+            messages = ()
+            factors = self._user_factors(info, user_id, request.ratings)
+            rated = self._rated(user_id, request.ratings)
+            if factors is None:
+                messages = ("sorry, no personal data available for this user_id yet!",
+                            "Here is the generic recommendation computed from all the users in our database:")
+            elif approximate:
+                # retrieve the top n from the approximate index: inner product of [user latent vector, 1] with [item latent vector, item bias]
+                pos, score = self._ann_search('collaborative', np.append(factors[0], 1.0), request.n, rated)
+                return pos, info['mean_rating'] + factors[1] + score, column, False, messages
+            pos, score, column = self._collaborative_scores(info, factors, rated)
+            return pos, score, column, True, messages
+
+        # check if previous restaurant rating/review history is available for the user_id of interest
+        if not self.interactions.has_history(user_id):
+            return self._empty(request, column, "sorry, no personal data available for this user_id yet!")
+        # the feature vectors are loaded upon the first use of the module
+        self._load_content()
+        if user_id not in self.user_pcafeature:
+            return self._empty(request, column, "sorry, no personal data available for this user_id yet!")
+        precomputed = self._topk_lookup(request)
+        if precomputed is not None:
+            return precomputed[0], precomputed[1], column, False, ()
+        if approximate:
+            pos, score = self._ann_search('content', self.user_pcafeature.row(user_id), request.n, self.interactions.items(user_id))
+            return pos, score, column, False, ()
+        pos, score, column = self._content_scores(user_id)
+        return pos, score, column, True, ()
+
+    def _hybrid_scores(self, request):
+        """Return the candidates (positions, scores, 'hybrid_score', exact, messages) of the hybrid module: all the unrated open restaurants
+        scored in one pass by a linear blend of the predicted stars of the collaborative module, the cosine similarity of the content-based module
+        and the adjusted score, weighted by .hybrid_weights (updated with 'request.weights').
+        The generic predicted stars are used for the users without latent vector, and a similarity of 0 for the users without feature vector.
+        """
+        user_id = request.user_id
+        if user_id is None:
+            return self._empty(request, 'hybrid_score', "no user_id is provided!")
+        if len(user_id) != 22:
+            return self._empty(request, 'hybrid_score', "invalid user id!")
+        # the aligned data of both modules is loaded upon the first use of the module
+        self._load_hybrid()
+        info, pos = self.svd_trained_info, self._open_pos
+        item_vec, item_b, rest_vec = self._hybrid
+        weights = self.hybrid_weights if request.weights is None else dict(self.hybrid_weights, **request.weights)
+
+        factors = self._user_factors(info, user_id, request.ratings)
+        profile = self.user_pcafeature.row(user_id) if self.interactions.has_history(user_id) and user_id in self.user_pcafeature else None
+        _, _, adjusted = self.catalog_stats(pos)
+        score = weights['intercept'] + weights['adjusted_score'] * adjusted + weights['predicted_stars'] * (info['mean_rating'] + item_b)
+        if factors is not None:
+            score += weights['predicted_stars'] * (factors[1] + np.dot(item_vec, factors[0]))
+        if profile is not None:
+            score += weights['similarity_score'] * np.dot(rest_vec, profile.astype(rest_vec.dtype)) # same dtype, no copy of the matrix
+        if factors is None and profile is None:
+            return pos, score, 'hybrid_score', True, ("sorry, no personal data available for this user_id yet!",
+                                                      "Here is the generic recommendation computed from all the users in our database:")
+        # filter to unrated business_id only by the user_id of interest
+        unrated = ~np.isin(pos, self._rated(user_id, request.ratings))
+        return pos[unrated], score[unrated], 'hybrid_score', True, ()
+
+    def _filter(self, request, pos, score):
+        """Filter the scored candidates by the keywords of the request.
+        Return a tuple (positions, scores, distances, error): distances is None if no location filter is applied,
+        error is None or a tuple of messages explaining why no restaurant is left.
+        note: this hidden method should only be called within the method 'recommend'
+        """
+        distance = None
+
+        # filter by restaurant location
+        if (request.zipcode is not None) or (request.city is not None) or (request.state is not None):
+            with self.tracer.span('filter.location', rows_in=len(pos)) as span:
+                if (request.zipcode is not None) or (request.city is not None): # use zipcode and/or city whenever available
+                    with self.tracer.span('geocode'):
+                        location = self._locate(request)
+                    if location is None:
+                        return pos, score, None, ("Error: failed to locate the address of interest {}".format(self._address(request)),
+                                                  "no restaurant found for the matching location of interest.")
+                    # calculate the geodesic distance between each candidate and the location of interest
+                    # note: only restaurants within max_distance are visited via the spatial index, all others get a distance of NaN
+                    with self.tracer.span('distance', rows_in=len(pos)) as distance_span:
+                        distance = self.spatial_index.distance_to(location.latitude, location.longitude, request.max_distance)[pos]
+                        keep = distance <= request.max_distance
+                        distance = distance[keep]
+                        distance_span.rows_out = len(distance)
+                else: # filter by state if state is the only location information available
+                    keep = self.business.state.values[pos] == request.state.upper()
+                pos, score = pos[keep], score[keep]
+                span.rows_out = len(pos)
+            if len(pos) == 0:
+                return pos, score, distance, ("no restaurant found for the matching location of interest.",)
+
+        # filter by restaurant 'cuisine', 'style' and price range
+        price = request.price
+        if isinstance(price, str):
+            price = [i.strip() for i in price.split(',')] # extract multiple inputs of price range
+        for value, mask, name in [(request.cuisine, lambda: self.cuisine_index.mask(request.cuisine, match=request.match)[pos], 'cuisine'),
+                                  (request.style, lambda: self.style_index.mask(request.style, match=request.match)[pos], 'style'),
+                                  (price, lambda: self.business['attributes.RestaurantsPriceRange2'].iloc[pos].isin(price).values, 'price')]:
+            if value is None:
+                continue
+            with self.tracer.span('filter.' + name, rows_in=len(pos)) as span:
+                keep = mask()
+                pos, score = pos[keep], score[keep]
+                distance = None if distance is None else distance[keep]
+                span.rows_out = len(pos)
+            if len(pos) == 0:
+                return pos, score, distance, ("no restaurant found for the matching {} of {}".format(name, value),)
+
+        return pos, score, distance, None
+
+    def _address(self, request):
+        """Return the address string of the location of interest, e.g. 'Las Vegas,NV,89109'"""
+        address = [request.city, request.state, request.zipcode]
+        return ",".join([str(i) for i in address if i != None])
+
+    def _locate(self, request):
+        """Return the coordinate of the location of interest, or None if it cannot be located.
+        The offline gazetteer is looked up first, the remote geocoder is only queried upon a miss.
+        """
+        location = self.gazetteer.lookup(zipcode=request.zipcode, city=request.city, state=request.state)
+        if location is None and self.geocoder is not False:
+            if self.geocoder is None:
+                with self._load_lock:
+                    if self.geocoder is None:
+                        try:
+                            self.geocoder = GeocodeCache(NominatimBackend(user_agent="yelp_recommender"))
+                        except ImportError: # geopy is not installed, remote geocoding is not available
+                            self.geocoder = False
+            if self.geocoder is False:
+                return None
+            location = self.geocoder(self._address(request))
+        return location
+
+    #------------------------------------------------------------
+    # scoring of the personalized modules
+    def _rated(self, user_id, ratings=None):
+        """Return the positions in the 'business' dataset of the restaurants rated by the user_id of interest, including those of 'ratings'"""
+        rated = self.interactions.items(user_id)
+        if ratings:
+            rated = np.union1d(rated, self.business_pos.get_indexer(list(ratings.keys())))
+        return rated
+
+    def _user_factors(self, info, user_id, ratings=None):
+        """Return the (latent vector, bias) of the user_id of interest in the matrix factorization 'info': trained,
+        folded in from the ratings of the user, or None if no personal data is available (the generic recommendation)
+        """
+        if user_id in info['userid_to_index'] and ratings is None:
+            u_idx = info['userid_to_index'][user_id]
+            return info['user_latent'][u_idx,:], info['user_bias'][u_idx]
+        return self.fold_in(user_id, ratings)
+
+    def _collaborative_scores(self, info, factors, rated):
+        """Return the scored catalog (positions in 'business', predicted ratings, 'predicted_stars') of all the unrated open restaurants
+        by brute-force scoring, given the (latent vector, bias) of the user of interest and the positions of the restaurants rated by the user.
+        The generic predicted ratings are returned if no personal data is available (factors is None).
+        note: many businesses in 'review' dataset are not restaurant-related, therefore not present in 'business' dataset
+        """
+        r_mean = info['mean_rating'] # global mean of all ratings
+        pos = self._collab_pos # positions of the open restaurants in the 'business' catalog
+        item_vec, item_b = self._collab_item_vec, self._collab_item_b # their factors, gathered when the module is loaded
+
+        if factors is not None:
+            user_vec, user_b = factors
+            pred = r_mean + user_b + item_b + np.dot(item_vec, user_vec)
+            # filter to unrated business_id only by the user_id of interest
+            unrated = ~np.isin(pos, rated)
+            pred, pos = pred[unrated], pos[unrated]
+        else:
+            pred = r_mean + item_b
+
+        return pos, pred, 'predicted_stars'
+
+    def fold_in(self, user_id, ratings=None):
+        """Return the (latent vector, bias) of the user_id of interest folded into the trained matrix factorization,
+        e.g. for a user missing from the model, without retraining it.
+        ---
+        ratings: an optional dictionary {business_id: stars} of ratings added to (and overriding) the ratings of the user in the review data
+        ---
+        return: None if the user has no rating of a restaurant of the model
+        ---
+        note: the item latent vectors and biases are fixed, the user vector p and bias b solve the regularized least squares problem
+            min sum (r - mean - b_i - b - q_i.p)^2 + reg * n * (|p|^2 + b^2) over the n ratings of the user, with reg the regularization
+            of the trained model (recorded in its version by train.py, .fold_in_reg for the models without version).
+            The fold-in of the ratings in the review data is cached, and the users with at least .promote_min_ratings ratings
+            are queued for promotion into the user latent vectors of the model, see .promote_users().
+        """
+        self._load_collaborative()
+        info = self.svd_trained_info
+        if ratings is None:
+            factors = self.fold_ins.get(user_id)
+            if factors is not None:
+                return factors
+
+        # ratings of the user, the ratings passed override those in the review data
+        pos, stars = self.interactions.ratings(user_id)
+        if ratings:
+            new_pos = self.business_pos.get_indexer(list(ratings.keys()))
+            new_stars = np.array(list(ratings.values()), dtype=float)
+            old = ~np.isin(pos, new_pos)
+            pos, stars = np.concatenate([pos[old], new_pos[new_pos >= 0]]), np.concatenate([stars[old], new_stars[new_pos >= 0]])
+        idx = self._collab_item_of_pos[pos]
+        keep = idx >= 0
+        if not keep.any():
+            return None
+        idx, stars = idx[keep], stars[keep]
+
+        # solve the normal equations of [p, b] against the augmented item vectors [q_i, 1]
+        x = np.hstack([np.asarray(info['item_latent'][idx], dtype=float), np.ones((len(idx), 1))])
+        y = stars - info['mean_rating'] - np.asarray(info['item_bias'][idx], dtype=float)
+        a = np.dot(x.T, x)
+        version = info.get('version')
+        reg = version['reg'] if isinstance(version, dict) and 'reg' in version else self.fold_in_reg
+        a[np.diag_indices_from(a)] += reg * len(idx)
+        w = np.linalg.solve(a, np.dot(x.T, y))
+        factors = (w[:-1], w[-1])
+
+        if ratings is None:
+            self.fold_ins.put(user_id, factors)
+            if len(idx) >= self.promote_min_ratings and user_id not in info['userid_to_index']:
+                with self._load_lock:
+                    self._promotion[user_id] = factors
+                    full = len(self._promotion) >= self.promote_batch
+                if full:
+                    self.promote_users()
+        return factors
+
+    def promote_users(self):
+        """Append the latent vectors and biases of the queued folded-in users to those of the matrix factorization,
+        so that they are served as trained users from then on, e.g. by the approximate index and the batch scoring.
+        ---
+        return: the number of users promoted
+        ---
+        note: the user latent vectors and biases are copied once into buffers with spare rows, the promoted users are written into the spare rows
+            and a new 'svd_trained_info' dictionary is swapped in, so that concurrent requests see either the old or the new model.
+            The vectors of the promoted users are kept until the next reload, even if more reviews of the users are ingested.
+        """
+        with self._load_lock:
+            info = self.svd_trained_info
+            queue, self._promotion = self._promotion, {}
+            new = [(u, f) for u, f in queue.items() if info is not None and u not in info['userid_to_index']]
+            if len(new) == 0:
+                return 0
+            n, m = len(info['user_bias']), len(info['user_bias']) + len(new)
+            if self._user_buffers is None or len(self._user_buffers[1]) < m:
+                # grow the buffers geometrically, so that the copy of the trained vectors is amortized over many promotions
+                capacity = max(m, n + n // 4)
+                latent = np.empty((capacity, info['user_latent'].shape[1]), dtype=info['user_latent'].dtype)
+                bias = np.empty(capacity, dtype=info['user_bias'].dtype)
+                latent[:n], bias[:n] = info['user_latent'], info['user_bias']
+                self._user_buffers = (latent, bias)
+            latent, bias = self._user_buffers
+            latent[n:m] = [f[0] for _, f in new]
+            bias[n:m] = [f[1] for _, f in new]
+            userid_to_idx = dict(info['userid_to_index'])
+            userid_to_idx.update((u, n + i) for i, (u, _) in enumerate(new))
+            self.svd_trained_info = dict(info, user_latent=latent[:m], user_bias=bias[:m], userid_to_index=userid_to_idx)
+        for u, _ in new:
+            self.fold_ins.discard(u)
+        return len(new)
+
+    def _content_scores(self, user_id):
+        """Return the scored catalog (positions in 'business', cosine similarity scores, 'similarity_score') of all the unrated open restaurants
+        for the user_id of interest by brute-force scoring.
+        """
+        sim = linear_kernel(self.user_pcafeature.row(user_id).reshape(1, -1), self._content_item_vec).flatten()
+        pos = self._content_pos
+        # filter to unrated business_id only by the user_id of interest
+        unrated = ~np.isin(pos, self.interactions.items(user_id))
+        return pos[unrated], sim[unrated], 'similarity_score'
+
+    def collaborative_batch(self, user_ids, k=10, chunk_size=1024, n_jobs=1, executor='thread'):
+        """Batch recommendation by collaborative filtering for many users at once, e.g. for email campaigns: 
+        the top k unrated open restaurants are computed for every user_id, nothing is displayed or stored on the object.
+        ---
+        user_ids: a list of user_ids. The users missing from the model are folded in from their ratings and users without any rating
+            get the generic recommendation, same as the method 'collaborative'
+        k: the number of recommendations per user
+        chunk_size: the number of users scored by one matrix product, memory use is bounded by chunk_size x number of restaurants
+        n_jobs: the number of chunks scored in parallel
+        executor: 'thread' (default, numpy releases the GIL during the matrix products) or 'process'
+        ---
+        return: a tuple of two arrays of shape (len(user_ids), k): the recommended business_ids and their predicted ratings, 
+            sorted by predicted rating in descending order for each user
+        """
+        
+        # extract all necessary information saved from the matrix factorization algorithm
+        self._load_collaborative()
+        info = self.svd_trained_info
+        user_latent, user_bias = info['user_latent'], info['user_bias']
+        r_mean = info['mean_rating'] # global mean of all ratings
+        userid_to_idx = info['userid_to_index']
+        pos, item_vec, item_b = self._collab_pos, self._collab_item_vec, self._collab_item_b # the open restaurants, gathered when the module is loaded
+        
+        # matrix indices of the users, the users missing from the model are folded in from their ratings and indexed after the trained users,
+        # users without personal data get zero latent vectors and biases, i.e. the generic prediction
+        user_ids = np.asarray(user_ids, dtype=object)
+        u_idx = np.array([userid_to_idx.get(u, -1) for u in user_ids], dtype=np.int64)
+        n_trained, folded = len(user_bias), []
+        for i in np.flatnonzero(u_idx < 0):
+            factors = self.fold_in(user_ids[i]) if self.interactions.has_history(user_ids[i]) else None
+            if factors is not None:
+                u_idx[i] = n_trained + len(folded)
+                folded.append(factors)
+        folded_latent = np.array([f[0] for f in folded]).reshape(len(folded), item_vec.shape[1])
+        folded_bias = np.array([f[1] for f in folded])
+        def user_factors(idx):
+            trained, new = (idx >= 0) & (idx < n_trained), idx >= n_trained
+            if not new.any():
+                return (np.where(trained[:, None], np.asarray(user_latent[np.where(trained, idx, 0)]), 0),
+                        np.where(trained, np.asarray(user_bias[np.where(trained, idx, 0)]), 0))
+            vec, b = np.zeros((len(idx), item_vec.shape[1])), np.zeros(len(idx))
+            vec[trained], b[trained] = user_latent[idx[trained]], user_bias[idx[trained]]
+            vec[new], b[new] = folded_latent[idx[new] - n_trained], folded_bias[idx[new] - n_trained]
+            return vec, b
+        top, scores = self._score_batch(user_ids, u_idx, user_factors, item_vec, item_b, r_mean, pos, self._collab_col_of_pos, k,
+                                        chunk_size, n_jobs, executor)
+        return self._business_ids[pos[top]], scores
+
+    def content_batch(self, user_ids, k=10, chunk_size=1024, n_jobs=1, executor='thread'):
+        """Batch recommendation by content-based filtering for many users at once:
+        the top k unrated open restaurants by cosine similarity are computed for every user_id, with one matrix product per chunk of users.
+        ---
+        the arguments are the same as those of the method 'collaborative_batch'
+        ---
+        return: a tuple of two arrays of shape (len(user_ids), k): the recommended business_ids and their similarity scores,
+            sorted by similarity score in descending order for each user. Users without personal data get None business_ids and NaN scores,
+            same as the method 'content' which returns no recommendation for them.
+        """
+
+        # the feature vectors are loaded upon the first use of the module
+        self._load_content()
+        pos, item_vec = self._content_pos, self._content_item_vec # the open restaurants, gathered when the module is loaded
+
+        # rows of the users in 'user_pcafeature', users without rating history or feature vector are scored with zero vectors and blanked out below
+        user_ids = np.asarray(user_ids, dtype=object)
+        u_row = np.array([self.user_pcafeature.position(u) if self.interactions.has_history(u) else -1 for u in user_ids], dtype=np.int64)
+        def user_factors(idx):
+            vec = np.zeros((len(idx), item_vec.shape[1]), dtype=item_vec.dtype)
+            vec[idx >= 0] = self.user_pcafeature.rows(idx[idx >= 0])
+            return vec, np.zeros(len(idx))
+        top, scores = self._score_batch(user_ids, u_row, user_factors, item_vec, np.zeros(len(pos)), 0.0, pos, self._content_col_of_pos, k,
+                                        chunk_size, n_jobs, executor)
+        business_ids = self._business_ids[pos[top]]
+        business_ids[u_row < 0], scores[u_row < 0] = None, np.nan
+        return business_ids, scores
+
+    def _score_batch(self, user_ids, u_idx, user_factors, item_vec, item_b, r_mean, pos, col_of_pos, k, chunk_size, n_jobs, executor):
+        """Return the (item columns, scores) of the top k unrated items of every user, see score_topk.
+        ---
+        u_idx: the row of each user in the user factors, negative if the user has no personal data (nothing is excluded then)
+        user_factors: a function returning the (user vectors, user biases) of an array of rows of a chunk
+        pos: the positions in the 'business' dataset of the item columns
+        col_of_pos: the item column of each position in the 'business' dataset, -1 if none
+        note: this hidden method should only be called within the methods 'collaborative_batch' and 'content_batch'
+        """
+        k = min(k, len(pos))
+        known = u_idx >= 0
+
+        # (user row, item column) pairs of the restaurants already rated by the users with personal data
+        rated_rows, rated_pos = self.interactions.pairs(user_ids[known])
+        rated_rows, rated_cols = np.flatnonzero(known)[rated_rows], col_of_pos[rated_pos]
+        keep = rated_cols >= 0
+        rated_rows, rated_cols = rated_rows[keep], rated_cols[keep]
+        
+        # split the users into chunks and score each chunk by one matrix product
+        chunks = []
+        for start in range(0, len(user_ids), chunk_size):
+            stop = min(start + chunk_size, len(user_ids))
+            user_vec, user_b = user_factors(u_idx[start:stop])
+            lo, hi = np.searchsorted(rated_rows, [start, stop])
+            chunks.append((user_vec, user_b, rated_rows[lo:hi] - start, rated_cols[lo:hi]))
+        
+        with self.tracer.span('score.batch', rows_in=len(user_ids)) as span:
+            if n_jobs == 1:
+                results = [score_topk(user_vec, user_b, item_vec, item_b, r_mean, k, rows, cols) for user_vec, user_b, rows, cols in chunks]
+            elif executor == 'process':
+                with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_score_worker, initargs=(item_vec, item_b, r_mean, k)) as pool:
+                    results = list(pool.map(_score_topk_worker, *zip(*chunks)))
+            else:
+                with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+                    results = list(pool.map(lambda c: score_topk(c[0], c[1], item_vec, item_b, r_mean, k, c[2], c[3]), chunks))
+            span.rows_out = len(user_ids) * k
+        
+        if len(results) == 0:
+            return np.empty((0, k), dtype=np.int64), np.empty((0, k))
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Offline evaluation of the personalized modules of the hybrid recommendation engine:
+the ratings of a holdout set are scored against the trained matrix factorization ('svd_trained_info', collaborative module)
+or the user and restaurant pcafeature vectors (content-based module) with gathered batch dot products, one per chunk of ratings,
+and the RMSE of the predicted ratings and the NDCG@k of the ranking of each user's holdout restaurants are computed
+with grouped numpy operations. The users are split into shards scored by a process pool.
+
+The metrics follow the notebooks: the predicted rating of a user or restaurant unknown to the model only uses the known terms
+(global mean and biases) and is clipped to the rating scale, as in surprise; the NDCG@k of a user ranks its holdout restaurants
+by predicted rating (or similarity score) with the review stars as relevance, and only users with at least k holdout ratings are counted.
+
+Usage:
+    python evaluate.py holdout.csv [--artifact-dir artifacts] [--modules collaborative content] [--k 5 10] [--n-jobs 4] [--out report.json]
+    python evaluate.py holdout.csv --split-from review_clean.csv [--fraction 0.1]    (writes the holdout split first, see split_holdout)
+    python evaluate.py holdout.csv --compare old_report.json    (prints the differences of the metrics to a previous report)
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from artifacts import ArtifactStore, FeatureMatrix, load_pickle_chunked, read_review
+
+RATING_SCALE = (1, 5)
+
+def split_holdout(review, fraction=0.1, seed=42):
+    """Randomly split the ratings into a training set and a holdout set, as in the notebooks (shuffled rows, the last 'fraction' held out).
+    Return the tuple (train, holdout) of dataframes.
+    """
+    idx = np.arange(len(review))
+    np.random.RandomState(seed).shuffle(idx) # shuffle the rows
+    threshold = int((1 - fraction) * len(review))
+    return review.iloc[np.sort(idx[:threshold])], review.iloc[np.sort(idx[threshold:])]
+
+def load_model(module, artifact_dir=None):
+    """Load the model of a personalized module, from the compiled artifacts if artifact_dir is passed, otherwise from the pickled files
+    of the working directory. Return a dictionary of:
+    ---
+    user_ids, item_ids: pd.Index of the user_ids and business_ids, in the order of the rows of the vectors
+    user_rows: a function returning the float vectors of an array of user rows
+    item_vec: the 2-D array of item vectors
+    user_b, item_b, mean: the biases and the global mean rating (None for the content-based module)
+    version: the size and creation time of the model, recorded in the report
+    """
+    store = ArtifactStore(artifact_dir) if artifact_dir is not None else None
+    if module == 'collaborative':
+        if store is not None:
+            info, created = store.svd_trained_info(), store.manifest['created']
+        else:
+            with open('svd_trained_info.pkl', 'rb') as f:
+                info = pickle.load(f)
+            created = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(os.path.getmtime('svd_trained_info.pkl')))
+        ids = lambda mapper: pd.Index(sorted(mapper, key=mapper.get), dtype=object) # order the ids by their matrix indices
+        user_latent = info['user_latent']
+        model = {'user_ids': ids(info['userid_to_index']), 'item_ids': ids(info['itemid_to_index']),
+                 'user_rows': lambda rows: np.asarray(user_latent[rows], dtype=float),
+                 'item_vec': np.asarray(info['item_latent'], dtype=float),
+                 'user_b': np.asarray(info['user_bias'], dtype=float), 'item_b': np.asarray(info['item_bias'], dtype=float),
+                 'mean': float(info['mean_rating'])}
+        model['version'] = {'module': module, 'created': created, 'users': len(model['user_ids']), 'items': len(model['item_ids']),
+                            'factors': int(model['item_vec'].shape[1]), 'mean_rating': model['mean']}
+        if 'version' in info: # the version of the model trained by train.py
+            model['version'].update(info['version'])
+    elif module == 'content':
+        if store is not None:
+            rest, user, created = store.rest_pcafeature(), store.user_pcafeature(), store.manifest['created']
+        else:
+            with open('rest_pcafeature_all.pkl', 'rb') as f:
+                rest = FeatureMatrix.from_frame(pickle.load(f))
+            user = FeatureMatrix.from_frame(load_pickle_chunked('user_pcafeature_all.pkl'))
+            created = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(os.path.getmtime('user_pcafeature_all.pkl')))
+        model = {'user_ids': pd.Index(np.asarray(user.index, dtype=object), dtype=object),
+                 'item_ids': pd.Index(np.asarray(rest.index, dtype=object), dtype=object),
+                 'user_rows': lambda rows: np.asarray(user.rows(rows), dtype=float),
+                 'item_vec': np.asarray(rest.values, dtype=float), 'user_b': None, 'item_b': None, 'mean': None}
+        model['version'] = {'module': module, 'created': created, 'users': len(model['user_ids']), 'restaurants': len(model['item_ids']),
+                            'features': int(model['item_vec'].shape[1])}
+    else:
+        raise ValueError("module must be either 'collaborative' or 'content', got {}".format(module))
+    return model
+
+def ndcg_at_k(user, score, relevance, k, n_users):
+    """Return the NDCG@k of each user, computed for all users at once with grouped numpy operations.
+    ---
+    user: the code (0 to n_users-1) of the user of each rating
+    score: the predicted score of each rating, the restaurants of each user are ranked by it in descending order
+    relevance: the relevance of each rating, i.e. the review stars
+    ---
+    return: an array of n_users NDCG scores, NaN for the users without rating. The gains are discounted by 1/log2(rank+1), rank starting at 1,
+        and normalized by the DCG of the ranking by relevance, as 'ndcg_at_k' of the notebooks.
+    """
+    count = np.bincount(user, minlength=n_users)
+    start = np.cumsum(count) - count # position of the first rating of each user once sorted by user
+
+    def dcg(key):
+        order = np.lexsort((-key, user)) # by user, then by key in descending order
+        rank = np.arange(len(order)) - start[user[order]]
+        gain = np.where(rank < k, relevance[order] / np.log2(rank + 2), 0.0)
+        return np.bincount(user[order], weights=gain, minlength=n_users)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return dcg(score) / dcg(relevance)
+
+_worker = None # item vectors and biases of a worker process
+
+def _init_worker(item_vec, item_b, mean, ks, clip, chunk_size):
+    global _worker
+    _worker = (item_vec, item_b, mean, ks, clip, chunk_size)
+
+def _evaluate_shard(user_vec, user_b, user, item, stars):
+    """Score the ratings of a shard of users and return (sum of squared errors, sum of absolute errors, number of ratings,
+    ratings per user, {k: NDCG@k per user}), the users of the shard being coded 0 to len(user_vec)-1 and the unknown items -1.
+    """
+    item_vec, item_b, mean, ks, clip, chunk_size = _worker
+    known_item = item >= 0
+    item = np.maximum(item, 0)
+    score = np.empty(len(user))
+    for start in range(0, len(user), chunk_size):
+        u, i = user[start:start+chunk_size], item[start:start+chunk_size]
+        # gathered batch dot product: the user and item vectors of each rating, multiplied element-wise and summed over the factors
+        score[start:start+chunk_size] = np.einsum('ij,ij->i', user_vec[u], item_vec[i])
+    score[~known_item] = 0.0 # unknown items only get the known terms
+    squared, absolute = np.nan, np.nan
+    if mean is not None:
+        score += mean + user_b[user] + np.where(known_item, item_b[item], 0.0)
+        score = np.clip(score, *clip) if clip is not None else score
+        error = score - stars
+        squared, absolute = float(np.dot(error, error)), float(np.abs(error).sum())
+    count = np.bincount(user, minlength=len(user_vec))
+    return squared, absolute, len(user), count, {k: ndcg_at_k(user, score, stars, k, len(user_vec)) for k in ks}
+
+def evaluate(model, holdout, ks=(5, 10), n_jobs=1, chunk_size=65536, clip=RATING_SCALE, known_only=False):
+    """Evaluate the model of a personalized module (see load_model) on a holdout set of ratings.
+    ---
+    holdout: a dataframe with the columns 'user_id', 'business_id' and 'stars'
+    ks: the cutoffs of the NDCG@k, computed over the users with at least k holdout ratings
+    n_jobs: the number of worker processes the shards of users are scored by, the shards are scored in the calling process if 1
+    chunk_size: the number of ratings scored by one gathered dot product
+    clip: the rating scale the predicted ratings are clipped to, None to disable
+    known_only: a boolean to indicate if the ratings of users or restaurants unknown to the model are left out
+        (by default they are scored with the known terms only, the user and restaurant vectors count as zeros)
+    ---
+    return: the report of the metrics as a JSON-serializable dictionary
+    """
+    t0 = time.time()
+    user_ids = holdout.user_id.to_numpy(dtype=object)
+    item = model['item_ids'].get_indexer(holdout.business_id.to_numpy(dtype=object))
+    stars = holdout.stars.to_numpy(dtype=float)
+    # distinct holdout users and their rows in the model, the users are coded in the order of their first rating
+    user, distinct = pd.factorize(user_ids)
+    user_row = model['user_ids'].get_indexer(distinct)
+    n_ratings, n_users = len(user), len(distinct)
+    coverage = {'ratings': n_ratings, 'users': n_users, 'known_users': int((user_row >= 0).sum()),
+                'ratings_known_user_and_item': int(((user_row[user] >= 0) & (item >= 0)).sum())}
+    if known_only:
+        keep = (user_row[user] >= 0) & (item >= 0)
+        user, item, stars = user[keep], item[keep], stars[keep]
+        user, distinct_rows = pd.factorize(user)
+        user_row = user_row[distinct_rows]
+
+    # sort the ratings by user and split the users into n_jobs shards of about the same number of ratings
+    order = np.argsort(user, kind='stable')
+    user, item, stars = user[order], item[order], stars[order]
+    cut = np.searchsorted(np.cumsum(np.bincount(user, minlength=len(user_row))), np.linspace(0, len(user), n_jobs + 1)[1:-1]) + 1
+    starts = np.unique(np.concatenate([[0], np.searchsorted(user, cut), [len(user)]])) # first rating of each shard
+    shards = []
+    for lo, hi in zip(starts[:-1], starts[1:]):
+        first, last = user[lo], user[hi-1] + 1
+        rows = user_row[first:last]
+        # user vectors and biases of the shard, zeros for the users unknown to the model
+        vec = np.zeros((last - first, model['item_vec'].shape[1]))
+        vec[rows >= 0] = model['user_rows'](rows[rows >= 0])
+        b = np.zeros(last - first)
+        if model['user_b'] is not None:
+            b[rows >= 0] = model['user_b'][rows[rows >= 0]]
+        shards.append((vec, b, user[lo:hi] - first, item[lo:hi], stars[lo:hi]))
+
+    initargs = (model['item_vec'], model['item_b'], model['mean'], tuple(ks), clip, chunk_size)
+    if n_jobs == 1:
+        _init_worker(*initargs)
+        results = [_evaluate_shard(*shard) for shard in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=initargs) as pool:
+            results = list(pool.map(_evaluate_shard, *zip(*shards)))
+
+    n = sum(r[2] for r in results)
+    count = np.concatenate([r[3] for r in results]) if results else np.array([], dtype=np.int64)
+    report = {'model': model['version'], 'coverage': coverage, 'known_only': known_only, 'ratings': n}
+    if model['mean'] is not None:
+        report['rmse'] = float(np.sqrt(sum(r[0] for r in results) / n)) if n else None
+        report['mae'] = float(sum(r[1] for r in results) / n) if n else None
+    for k in ks:
+        ndcg = np.concatenate([r[4][k] for r in results]) if results else np.array([])
+        ndcg = ndcg[count >= k] # only the users with at least k holdout ratings, as in the notebooks
+        report['ndcg@{}'.format(k)] = {'users': len(ndcg), 'mean': float(ndcg.mean()) if len(ndcg) else None,
+                                       'median': float(np.median(ndcg)) if len(ndcg) else None}
+    report['seconds'] = time.time() - t0
+    return report
+
+def compare(report, baseline):
+    """Print the metrics of a report of evaluate() next to those of a previous report, module by module"""
+    print("{:40s} {:>10s} {:>10s} {:>10s}".format('metric', 'baseline', 'current', 'delta'))
+    for module, metrics in report['modules'].items():
+        old = baseline['modules'].get(module)
+        if old is None:
+            continue
+        rows = [(module + ' ' + m, old.get(m), metrics.get(m)) for m in ['rmse', 'mae']]
+        rows += [(module + ' ' + m + ' mean', old[m]['mean'], metrics[m]['mean']) for m in metrics if m.startswith('ndcg@') and m in old]
+        for name, a, b in rows:
+            if a is not None and b is not None:
+                print("{:40s} {:10.4f} {:10.4f} {:+10.4f}".format(name, a, b, b - a))
+
+if __name__ == '__main__':
+    """Evaluate the personalized modules on a holdout set of ratings and write the report."""
+
+    parser = argparse.ArgumentParser(description='Evaluate the RMSE and NDCG@k of the personalized modules on a holdout set of ratings.')
+    parser.add_argument('holdout', type=str, help='The csv file of the holdout ratings (user_id, business_id, stars).')
+    parser.add_argument('--artifact-dir', type=str, default=None, help='The compiled artifact directory, the pickle files are used if omitted.')
+    parser.add_argument('--modules', type=str, nargs='+', default=['collaborative', 'content'], choices=['collaborative', 'content'], help='The modules to evaluate.')
+    parser.add_argument('--k', type=int, nargs='+', default=[5, 10], help='The cutoffs of the NDCG@k.')
+    parser.add_argument('--n-jobs', type=int, default=os.cpu_count(), help='The number of worker processes.')
+    parser.add_argument('--known-only', action='store_true', help='Leave out the ratings of users or restaurants unknown to the model.')
+    parser.add_argument('--split-from', type=str, default=None, help='A review csv file to split into the holdout file (and train_<holdout> beside it) first.')
+    parser.add_argument('--fraction', type=float, default=0.1, help='The fraction of the ratings held out by --split-from.')
+    parser.add_argument('--out', type=str, default='evaluation_report.json', help='The JSON report to write.')
+    parser.add_argument('--compare', type=str, default=None, help='A previous report to compare to.')
+    args = parser.parse_args()
+
+    if args.split_from is not None:
+        train, holdout = split_holdout(read_review(args.split_from), fraction=args.fraction)
+        head, tail = os.path.split(args.holdout)
+        train.to_csv(os.path.join(head, 'train_' + tail), index=False)
+        holdout.to_csv(args.holdout, index=False)
+        print("{} training and {} holdout ratings written".format(len(train), len(holdout)))
+    holdout = read_review(args.holdout)
+    report = {'holdout': os.path.abspath(args.holdout), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'modules': {}}
+    for module in args.modules:
+        report['modules'][module] = evaluate(load_model(module, args.artifact_dir), holdout, ks=args.k, n_jobs=args.n_jobs, known_only=args.known_only)
+        metrics = report['modules'][module]
+        print("{} module: {} ratings of {} users evaluated in {:.1f}s".format(module, metrics['ratings'], metrics['coverage']['users'], metrics['seconds']))
+        if 'rmse' in metrics:
+            print("    RMSE {:.4f}, MAE {:.4f}".format(metrics['rmse'], metrics['mae']))
+        for k in args.k:
+            ndcg = metrics['ndcg@{}'.format(k)]
+            if ndcg['users']:
+                print("    NDCG@{} {:.4f} (median {:.4f}) over {} users".format(k, ndcg['mean'], ndcg['median'], ndcg['users']))
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("report written to {}".format(args.out))
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Feature builder of the content-based module of the hybrid recommendation engine:
+the restaurant and user feature vectors of recommender_content.ipynb (rest_pcafeature and user_pcafeature) built from the reviews
+streamed in chunks, with a peak memory bounded by the size of the feature matrices rather than by the size of the review texts.
+
+The notebook concatenates all the reviews of each restaurant into one document, runs TfidfVectorizer (top 1000 words, mono & bigrams),
+densifies the matrix and runs a full PCA, computing every component to keep 300. Here:
+    1. the vocabulary (the top max_features terms by frequency) is counted chunk by chunk, the running counts being pruned to max_terms terms,
+       or taken from an existing text projection (fixed vocabulary)
+    2. the term counts of each review are summed by restaurant into a sparse (restaurants x terms) matrix, chunk by chunk,
+       which is the count matrix of the concatenated documents, weighted by the idf and rescaled to the unit length as by TfidfVectorizer
+    3. the top n_components are computed by a randomized truncated SVD of the sparse tf-idf matrix, centered implicitly within the matrix products,
+       which is the PCA of the notebook without densifying nor centering the matrix, or exactly from its (terms x terms) covariance matrix
+       (solver='covariance')
+    4. the user feature vectors are the rating-weighted sums of the restaurant feature vectors, by a sparse product, chunk by chunk of users
+The feature vectors are rescaled to the unit length and written in the format of the notebook, along with the text projection (see profiles.py).
+
+Usage:
+    python features.py review_clean.csv [--business business_clean.csv] [--out-dir .] [--max-features 1000] [--n-components 300] [--chunk-size 50000]
+    python features.py review_clean.csv --business business_clean.csv --compare    (time and peak memory against the notebook pipeline)
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+from profiles import TextProjector
+
+def _chunks(path, columns, chunk_size, restaurants=None):
+    """Read the review csv file chunk by chunk, yielding the chunks restricted to the reviews of the restaurants (all reviews if None)"""
+    for chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_size):
+        if restaurants is not None:
+            chunk = chunk[restaurants.get_indexer(chunk.business_id.values) >= 0]
+        yield chunk
+
+def _encode(index, ids):
+    """Return the index extended with the ids it does not contain yet, and the positions of the ids in it"""
+    codes = index.get_indexer(ids)
+    new = codes < 0
+    if new.any():
+        index = index.append(pd.Index(pd.unique(ids[new]), dtype=object))
+        codes[new] = index.get_indexer(ids[new])
+    return index, codes
+
+def top_terms(path, max_features=1000, chunk_size=50000, max_terms=200000, restaurants=None, ngram_range=(1, 2), stop_words='english'):
+    """Return the max_features most frequent terms of the review texts, in the order of their frequency.
+    The counts are merged chunk by chunk and pruned to the max_terms most frequent terms after each chunk, so that the rare bigrams
+    (the vast majority of the distinct terms) never accumulate. Pruning only affects the terms close to the cutoff when max_terms >> max_features.
+    """
+    counts = pd.Series(dtype=float)
+    for chunk in _chunks(path, ['business_id', 'text'], chunk_size, restaurants):
+        counter = CountVectorizer(stop_words=stop_words, ngram_range=ngram_range)
+        try:
+            x = counter.fit_transform(chunk.text.fillna('').astype(str).values)
+        except ValueError: # no term in the chunk
+            continue
+        counts = counts.add(pd.Series(np.asarray(x.sum(axis=0)).ravel(), index=counter.get_feature_names_out()), fill_value=0)
+        if len(counts) > max_terms:
+            counts = counts.nlargest(max_terms)
+    # ties are broken by term, as the max_features of TfidfVectorizer
+    counts = counts.sort_index(kind='stable').sort_values(ascending=False, kind='stable')
+    return counts.index[:max_features].tolist()
+
+def restaurant_counts(path, vocabulary, chunk_size=50000, restaurants=None, ngram_range=(1, 2), stop_words='english'):
+    """Stream the reviews and return the tuple of:
+    ---
+    counts: the sparse (restaurants x terms) matrix of the term counts of the reviews of each restaurant, i.e. of its concatenated reviews
+    rest_ids: the pd.Index of the business_ids of the restaurants with reviews, in the order of the rows of counts
+    ratings: the (user_id, business_id position, stars) arrays of the reviews, used to build the user feature vectors
+    """
+    counter = CountVectorizer(stop_words=stop_words, ngram_range=ngram_range, vocabulary=list(vocabulary))
+    rest_ids, user_ids = pd.Index([], dtype=object), pd.Index([], dtype=object)
+    counts = sparse.csr_matrix((0, len(vocabulary)), dtype=np.float64)
+    users, rests, stars = [], [], []
+    for chunk in _chunks(path, ['user_id', 'business_id', 'stars', 'text'], chunk_size, restaurants):
+        rest_ids, rest = _encode(rest_ids, chunk.business_id.to_numpy(dtype=object))
+        user_ids, user = _encode(user_ids, chunk.user_id.to_numpy(dtype=object))
+        x = counter.transform(chunk.text.fillna('').astype(str).values)
+        # sum the counts of the reviews by restaurant: (restaurants x reviews) indicator matrix x (reviews x terms) counts
+        by_rest = sparse.csr_matrix((np.ones(len(rest)), (rest, np.arange(len(rest)))), shape=(len(rest_ids), len(rest))).dot(x)
+        counts.resize((len(rest_ids), len(vocabulary)))
+        counts = counts + by_rest
+        users.append(user.astype(np.int32))
+        rests.append(rest.astype(np.int32))
+        stars.append(chunk.stars.to_numpy(dtype=np.float32))
+    ratings = (user_ids, np.concatenate(users or [np.zeros(0, np.int32)]), np.concatenate(rests or [np.zeros(0, np.int32)]),
+               np.concatenate(stars or [np.zeros(0, np.float32)]))
+    return counts.tocsr(), rest_ids, ratings
+
+def tfidf(counts):
+    """Return the tf-idf matrix of a sparse count matrix (documents x terms) and the idf, with the defaults of TfidfVectorizer:
+    idf = ln((1 + n) / (1 + df)) + 1, raw term counts, rows rescaled to the unit length.
+    """
+    counts = counts.tocsr()
+    counts.eliminate_zeros()
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log((1 + counts.shape[0]) / (1 + df)) + 1
+    return normalize(counts.multiply(idf).tocsr()), idf
+
+def _flip_signs(components):
+    """Orient each component so that its largest loading is positive, which makes the output deterministic (the dot products are unchanged)"""
+    signs = np.sign(components[np.arange(len(components)), np.abs(components).argmax(axis=1)])
+    signs[signs == 0] = 1
+    return components * signs[:, None]
+
+def randomized_components(x, mean, n_components, n_oversamples=10, n_iter=7, seed=42):
+    """Return the top n_components right singular vectors of (x - mean) by a randomized range finder with power iterations
+    (Halko, Martinsson & Tropp 2011, as sklearn's randomized_svd). The centered matrix is never formed, its products are those of the sparse x
+    corrected by the mean: (x - mean) q = x q - mean.q and (x - mean).T p = x.T p - mean * sum(p).
+    """
+    rng = np.random.RandomState(seed)
+    k = min(n_components + n_oversamples, min(x.shape))
+    dot = lambda q: x.dot(q) - mean.dot(q)[None, :]                             # (x - mean) q
+    dot_t = lambda p: x.T.dot(p) - np.outer(mean, p.sum(axis=0))                # (x - mean).T p
+    q = dot(rng.normal(size=(x.shape[1], k)))
+    for _ in range(n_iter): # the power iterations sharpen the spectrum, each product is re-orthonormalized for stability
+        q, _ = np.linalg.qr(q)
+        q, _ = np.linalg.qr(dot_t(q))
+        q = dot(q)
+    q, _ = np.linalg.qr(q)
+    _, _, vt = np.linalg.svd(dot_t(q).T, full_matrices=False) # the small (k x terms) projection of the centered matrix onto the range
+    return vt[:n_components]
+
+def principal_components(x, n_components=300, solver='randomized', seed=42):
+    """Return the (mean, components) of the top n_components of a sparse matrix.
+    ---
+    solver: 'randomized' (default) for the randomized truncated SVD of the centered x (see randomized_components): its memory grows with
+            the non-zero entries of x and n_components, so it scales to large vocabularies (e.g. --max-features 100000),
+        or 'covariance' for the exact PCA of the notebook, from the eigenvectors of the (terms x terms) covariance matrix of x
+            (x is never centered nor densified, but the covariance matrix is dense: its memory grows with the square of the vocabulary)
+    """
+    n_components = min(n_components, x.shape[0], x.shape[1])
+    mean = np.asarray(x.mean(axis=0)).ravel()
+    if solver == 'randomized':
+        return mean, _flip_signs(randomized_components(x, mean, n_components, seed=seed))
+    gram = x.T.dot(x)
+    covariance = (gram.toarray() if sparse.issparse(gram) else gram) - x.shape[0] * np.outer(mean, mean)
+    values, vectors = np.linalg.eigh(covariance / max(x.shape[0] - 1, 1)) # eigenvalues in ascending order
+    return mean, _flip_signs(vectors[:, ::-1][:, :n_components].T)
+
+def user_features(ratings, rest_values, chunk_size=8192):
+    """Return the unit-length rating-weighted sums of the restaurant feature vectors rated by each user, as in the notebook
+    (a restaurant reviewed several times by the same user counts several times), computed chunk by chunk of users.
+    ratings: the (user_ids, user positions, restaurant positions, stars) returned by restaurant_counts()
+    """
+    user_ids, users, rests, stars = ratings
+    matrix = sparse.csr_matrix((stars.astype(float), (users, rests)), shape=(len(user_ids), len(rest_values)))
+    values = np.empty((len(user_ids), rest_values.shape[1]))
+    for start in range(0, len(user_ids), chunk_size):
+        values[start:start+chunk_size] = normalize(matrix[start:start+chunk_size].dot(rest_values), copy=False)
+    return values
+
+def build_features(path, business=None, max_features=1000, n_components=300, chunk_size=50000, max_terms=200000,
+                   solver='randomized', vocabulary=None, seed=42, verbose=True):
+    """Build the restaurant and user feature vectors from the review csv file, streaming the reviews in chunks.
+    ---
+    path: the review csv file (with the 'text' column)
+    business: the business_ids of the catalog (e.g. the business_id column of business_clean.csv), only their reviews are used, all if None
+    max_features, n_components: the number of terms and of components kept (1000 and 300 in the notebook)
+    chunk_size: the number of reviews read at once, max_terms: see top_terms()
+    solver: see principal_components()
+    vocabulary: a fixed vocabulary (e.g. TextProjector.load('text_projector.npz').vocabulary), counted from the reviews if None
+    ---
+    return: the tuple (rest_pcafeature, user_pcafeature, projector) of the restaurant and user feature DataFrames, indexed by business_id and
+        user_id with the columns '1' to 'n_components' as in the notebook, and the TextProjector projecting new review texts onto the same space
+    """
+    t0 = time.time()
+    restaurants = pd.Index(np.asarray(business, dtype=object), dtype=object) if business is not None else None
+    if vocabulary is None:
+        vocabulary = top_terms(path, max_features=max_features, chunk_size=chunk_size, max_terms=max_terms, restaurants=restaurants)
+        if verbose:
+            print("vocabulary of {} terms counted in {:.1f}s".format(len(vocabulary), time.time() - t0))
+    t1 = time.time()
+    counts, rest_ids, ratings = restaurant_counts(path, vocabulary, chunk_size=chunk_size, restaurants=restaurants)
+    x, idf = tfidf(counts)
+    counts = None
+    if verbose:
+        print("tf-idf of {} restaurants ({} non-zero) built in {:.1f}s".format(x.shape[0], x.nnz, time.time() - t1))
+
+    t1 = time.time()
+    mean, components = principal_components(x, n_components=n_components, solver=solver, seed=seed)
+    rest_values = x.dot(components.T)
+    rest_values -= np.dot(components, mean) # the projection of the mean, the tf-idf matrix is never centered
+    rest_values = normalize(rest_values, copy=False)
+    x = None
+    if verbose:
+        print("{} components computed in {:.1f}s".format(len(components), time.time() - t1))
+    t1 = time.time()
+    user_values = user_features(ratings, rest_values)
+    if verbose:
+        print("feature vectors of {} users computed in {:.1f}s".format(len(user_values), time.time() - t1))
+
+    columns = pd.Index([str(i) for i in np.arange(1, len(components) + 1)], name='pca_components')
+    rest_pcafeature = pd.DataFrame(rest_values, index=pd.Index(rest_ids, name='business_id'), columns=columns, copy=False)
+    user_pcafeature = pd.DataFrame(user_values, index=pd.Index(ratings[0], name='user_id'), columns=columns, copy=False)
+    return rest_pcafeature, user_pcafeature, TextProjector(vocabulary, idf, mean, components)
+
+def notebook_features(path, business=None, max_features=1000, n_components=300):
+    """The pipeline of recommender_content.ipynb, kept as the reference of the comparison (--compare --notebook):
+    all reviews are loaded, concatenated by restaurant, vectorized by TfidfVectorizer, densified and projected by a full PCA.
+    The row-by-row normalizations of the notebook are vectorized, so that the comparison is about the memory of the pipeline.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.decomposition import PCA
+    review = pd.read_csv(path)
+    if business is not None:
+        review = review[review.business_id.isin(business)].reset_index(drop=True)
+    rev_by_rest = review.groupby('business_id').text.agg(lambda i: '###'.join(i.fillna('').astype(str)))
+    vectorizer = TfidfVectorizer(stop_words='english', ngram_range=(1, 2), max_features=max_features)
+    x = vectorizer.fit_transform(rev_by_rest.values).toarray() # the SparseDataFrame filled with 0 of the notebook is dense
+    pca = PCA()
+    rest_values = pca.fit_transform(x)[:, :n_components]
+    columns = pd.Index([str(i) for i in np.arange(1, rest_values.shape[1] + 1)], name='pca_components')
+    rest_pcafeature = pd.DataFrame(normalize(rest_values), index=rev_by_rest.index, columns=columns)
+    user_pcafeature = pd.merge(review[['user_id', 'business_id', 'stars']], rest_pcafeature, how='inner', left_on='business_id', right_index=True).drop('business_id', axis=1)
+    user_pcafeature.loc[:, columns] = user_pcafeature.loc[:, columns].multiply(user_pcafeature.stars, axis=0)
+    user_pcafeature = user_pcafeature.drop('stars', axis=1).groupby('user_id').sum()
+    user_pcafeature = pd.DataFrame(normalize(user_pcafeature.values), index=user_pcafeature.index, columns=columns)
+    return rest_pcafeature, user_pcafeature, TextProjector.from_sklearn(vectorizer, pca, n_components)
+
+def save_features(rest_pcafeature, user_pcafeature, projector, out_dir='.', suffix='all'):
+    """Write rest_pcafeature_<suffix>.pkl, user_pcafeature_<suffix>.pkl and text_projector.npz to out_dir"""
+    os.makedirs(out_dir, exist_ok=True)
+    for name, df in [('rest_pcafeature', rest_pcafeature), ('user_pcafeature', user_pcafeature)]:
+        with open(os.path.join(out_dir, '{}_{}.pkl'.format(name, suffix)), 'wb') as f:
+            pickle.dump(df, f, protocol=5) # protocol 5 writes the arrays without copying them (Python 3.8+), and supports objects larger than 4GB
+    projector.save(os.path.join(out_dir, 'text_projector.npz'))
+
+def compare(argv, out_dir, suffix='all'):
+    """Run the streaming and the notebook pipelines in separate processes (so that their peak RSS are measured apart)
+    with the same arguments, print and return their time and peak memory and the agreement of their feature vectors.
+    """
+    report = {}
+    for method in ['streaming', 'notebook']:
+        path = os.path.join(out_dir, method)
+        command = [sys.executable, os.path.abspath(__file__)] + argv + ['--out-dir', path, '--report', path + '.json', '--quiet']
+        t0 = time.time()
+        returncode = subprocess.call(command + (['--notebook'] if method == 'notebook' else []))
+        if returncode != 0: # e.g. killed when out of memory
+            report[method] = {'seconds': time.time() - t0, 'returncode': returncode}
+            print("{}: failed with return code {} after {:.1f}s".format(method, returncode, report[method]['seconds']))
+            continue
+        with open(path + '.json') as f:
+            report[method] = json.load(f)
+        print("{}: {:.1f}s, peak RSS {:.0f} MB".format(method, report[method]['seconds'], report[method]['peak_rss_mb']))
+
+    if any('returncode' in r for r in report.values()):
+        return report
+    # the components may differ by their signs, the user x restaurant scores used by the content module do not.
+    # The vocabularies may differ by a few bigrams: the notebook joins the reviews of a restaurant with '###', which is not a token,
+    # so that the last word of a review and the first word of the next one make a bigram
+    vocabulary, frames = {}, {}
+    for method in ['streaming', 'notebook']:
+        vocabulary[method] = set(TextProjector.load(os.path.join(out_dir, method, 'text_projector.npz')).vocabulary.tolist())
+        with open(os.path.join(out_dir, method, 'rest_pcafeature_{}.pkl'.format(suffix)), 'rb') as f:
+            rest = pickle.load(f)
+        with open(os.path.join(out_dir, method, 'user_pcafeature_{}.pkl'.format(suffix)), 'rb') as f:
+            user = pickle.load(f)
+        frames[method] = (rest, user)
+    report['shared_terms'] = len(vocabulary['streaming'] & vocabulary['notebook'])
+    rest_ids = frames['notebook'][0].index.intersection(frames['streaming'][0].index)
+    user_ids = frames['notebook'][1].index.intersection(frames['streaming'][1].index)[:1000]
+    scores = {m: frames[m][1].loc[user_ids].values.dot(frames[m][0].loc[rest_ids].values.T) for m in frames}
+    difference = np.abs(scores['streaming'] - scores['notebook'])
+    report['mean_score_difference'], report['max_score_difference'] = float(difference.mean()), float(difference.max())
+    print("{} terms in common, difference of the user x restaurant scores: mean {:.4f}, max {:.4f}"
+          .format(report['shared_terms'], report['mean_score_difference'], report['max_score_difference']))
+    return report
+
+if __name__ == '__main__':
+    """Build the restaurant and user feature vectors of the content-based module from the reviews and save them."""
+
+    parser = argparse.ArgumentParser(description='Build the feature vectors of the content-based module by streaming the reviews.')
+    parser.add_argument('review', type=str, help='The cleaned review csv file, with the text of the reviews.')
+    parser.add_argument('--business', type=str, default=None, help='The cleaned business csv file, only the reviews of its restaurants are used if passed.')
+    parser.add_argument('--out-dir', type=str, default='.', help='The directory of the output files.')
+    parser.add_argument('--suffix', type=str, default='all', help="The suffix of the pickled files, e.g. 'all' for rest_pcafeature_all.pkl.")
+    parser.add_argument('--max-features', type=int, default=1000, help='The number of words (mono & bigrams) kept.')
+    parser.add_argument('--n-components', type=int, default=300, help='The number of components kept.')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='The number of reviews read at once.')
+    parser.add_argument('--max-terms', type=int, default=200000, help='The number of terms whose counts are kept while counting the vocabulary.')
+    parser.add_argument('--solver', type=str, default='randomized', choices=['randomized', 'covariance'],
+                        help='The decomposition of the tf-idf matrix: randomized TruncatedSVD, or the exact PCA of the notebook from the term covariance matrix.')
+    parser.add_argument('--vocabulary', type=str, default=None, help='A text projection file whose vocabulary is used instead of counting one.')
+    parser.add_argument('--notebook', action='store_true', help='Run the in-memory pipeline of recommender_content.ipynb instead.')
+    parser.add_argument('--compare', action='store_true', help='Compare the time and peak memory of the streaming and notebook pipelines.')
+    parser.add_argument('--report', type=str, default=None, help='A json file to write the time and peak RSS to.')
+    parser.add_argument('--quiet', action='store_true', help='Do not print the progress.')
+    args = parser.parse_args()
+
+    if args.compare:
+        argv = [a for a in sys.argv[1:] if a != '--compare']
+        with tempfile.TemporaryDirectory() as tmp:
+            compare(argv, tmp, suffix=args.suffix)
+        sys.exit(0)
+
+    t0 = time.time()
+    business = pd.read_csv(args.business, usecols=['business_id']).business_id.values if args.business is not None else None
+    if args.notebook:
+        features = notebook_features(args.review, business, max_features=args.max_features, n_components=args.n_components)
+    else:
+        vocabulary = TextProjector.load(args.vocabulary).vocabulary.tolist() if args.vocabulary is not None else None
+        features = build_features(args.review, business, max_features=args.max_features, n_components=args.n_components, chunk_size=args.chunk_size,
+                                  max_terms=args.max_terms, solver=args.solver, vocabulary=vocabulary, verbose=not args.quiet)
+    save_features(*features, out_dir=args.out_dir, suffix=args.suffix)
+    seconds = time.time() - t0
+    from benchmark import peak_rss_mb
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump({'seconds': seconds, 'peak_rss_mb': peak_rss_mb(), 'restaurants': len(features[0]), 'users': len(features[1])}, f)
+    if not args.quiet:
+        print("feature vectors of {} restaurants and {} users written to {} in {:.1f}s, peak RSS {:.0f} MB"
+              .format(len(features[0]), len(features[1]), args.out_dir, seconds, peak_rss_mb()))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Offline gazetteer and geocoding helpers for the hybrid recommendation engine:
+locations of interest (zipcode, city, state) are resolved from the coordinates of the 'business' dataset,
+a remote geocoder is only used as a cached fallback.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import collections
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+# named tuple for a resolved location, shares the .latitude/.longitude attributes of a geopy location
+Location = collections.namedtuple('Location', ['latitude', 'longitude'])
+
+def normalize_place(s):
+    """Return the normalized lookup key of a place name or postal code (lower case, single spaces)."""
+    return ' '.join(str(s).lower().split())
+
+# gazetteer class
+class Gazetteer:
+
+    kinds = ('postal_code', 'city_state', 'city', 'state')
+
+    def __init__(self, centroids):
+        """initiate a Gazetteer object from a dictionary of centroids.
+        ---
+        centroids: a dictionary keyed by the kind of place ('postal_code', 'city_state', 'city', 'state'),
+            each value is a dictionary mapping the normalized place key to a (latitude, longitude) tuple.
+            The key of a (city, state) pair is 'city|state'.
+        ---
+        note: use Gazetteer.from_business() to build the gazetteer from the 'business' dataset, or Gazetteer.load() to read a saved one.
+        """
+        self.centroids = {kind: dict(centroids.get(kind, {})) for kind in self.kinds}
+
+    @classmethod
+    def from_business(cls, business):
+        """Build the gazetteer from the 'business' dataset: the centroid of a place is the mean coordinate of all its businesses."""
+        business = business[['postal_code', 'city', 'state', 'latitude', 'longitude']].dropna(subset=['latitude', 'longitude'])
+        # categorical columns are mapped once per category, the keys are then converted back to plain strings
+        keys = pd.DataFrame({'postal_code': business.postal_code.map(normalize_place, na_action='ignore').astype(object),
+                             'city': business.city.map(normalize_place, na_action='ignore').astype(object),
+                             'state': business.state.map(normalize_place, na_action='ignore').astype(object),
+                             'latitude': business.latitude, 'longitude': business.longitude})
+        keys['city_state'] = keys.city + '|' + keys.state
+        keys.loc[keys.postal_code == 'nan', 'postal_code'] = np.nan # postal codes missing in the csv file are read in as the string 'nan'
+        centroids = {}
+        for kind in cls.kinds:
+            mean = keys.dropna(subset=[kind]).groupby(kind)[['latitude', 'longitude']].mean()
+            centroids[kind] = dict(zip(mean.index, zip(mean.latitude.values.tolist(), mean.longitude.values.tolist())))
+        return cls(centroids)
+
+    def save(self, path):
+        """Save the gazetteer as a compact .npz artifact: one key array and one float32 coordinate array per kind of place."""
+        arrays = {}
+        for kind in self.kinds:
+            keys = list(self.centroids[kind].keys())
+            arrays[kind + '_keys'] = np.array(keys, dtype=str)
+            arrays[kind + '_coords'] = np.array([self.centroids[kind][k] for k in keys], dtype=np.float32).reshape(-1, 2)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a gazetteer saved by .save()"""
+        with np.load(path) as f:
+            centroids = {kind: dict(zip(f[kind + '_keys'].tolist(), map(tuple, f[kind + '_coords'].astype(float).tolist())))
+                         for kind in cls.kinds}
+        return cls(centroids)
+
+    def lookup(self, zipcode=None, city=None, state=None):
+        """Return the Location of the most specific place available, in the order of zipcode, (city, state), city and state.
+        Return None if none of the places is found in the gazetteer.
+        """
+        candidates = []
+        if zipcode is not None:
+            candidates.append(('postal_code', normalize_place(zipcode)))
+        if city is not None and state is not None:
+            candidates.append(('city_state', normalize_place(city) + '|' + normalize_place(state)))
+        if city is not None:
+            candidates.append(('city', normalize_place(city)))
+        if state is not None:
+            candidates.append(('state', normalize_place(state)))
+        for kind, key in candidates:
+            if key in self.centroids[kind]:
+                return Location(*self.centroids[kind][key])
+        return None
+
+    def __len__(self):
+        return sum(len(self.centroids[kind]) for kind in self.kinds)
+
+# remote geocoder backend using geopy Nominatim
+class NominatimBackend:
+
+    def __init__(self, user_agent="yelp_recommender", timeout=10):
+        """initiate a remote geocoder backend, calling the object with an address string returns a Location or None.
+        note: geopy is only needed when this backend is used.
+        """
+        from geopy.geocoders import Nominatim
+        self.geolocator = Nominatim(user_agent=user_agent) # use geopy.geocoders to make geolocation queries
+        self.timeout = timeout
+
+    def __call__(self, address):
+        from geopy.exc import GeopyError
+        try:
+            location = self.geolocator.geocode(address, timeout=self.timeout)
+        except GeopyError as e:
+            print("Error: geocode failed to locate the address of interest {} with message {}".format(address, e))
+            return None
+        if location is None:
+            return None
+        return Location(location.latitude, location.longitude)
+
+# bounded LRU/TTL cache in front of a geocoder backend
+class GeocodeCache:
+
+    def __init__(self, backend, maxsize=1024, ttl=24*3600):
+        """initiate a cache in front of a geocoder backend.
+        ---
+        backend: any callable taking an address string and returning a Location (or any object with .latitude/.longitude) or None
+        maxsize: the max number of addresses kept in the cache, the least recently used address is evicted first
+        ttl: the time to live of a cached address in seconds, None to never expire
+        ---
+        note: failed lookups (None) are not cached, so that a temporary outage of the backend is retried on the next query.
+            The cache is thread-safe, the backend is called outside of the lock.
+        """
+        self.backend = backend
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache = collections.OrderedDict()
+        self.hits, self.misses = 0, 0
+        self._lock = threading.Lock()
+
+    def __call__(self, address):
+        key = normalize_place(address)
+        now = time.monotonic()
+        with self._lock:
+            if key in self._cache:
+                location, expiry = self._cache[key]
+                if expiry is None or expiry > now:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return location
+                del self._cache[key]
+            self.misses += 1
+        location = self.backend(address)
+        if location is not None:
+            with self._lock:
+                self._cache[key] = (location, None if self.ttl is None else now + self.ttl)
+                while len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        return location
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+if __name__ == '__main__':
+    """Build the gazetteer artifact from the cleaned business csv file."""
+
+    parser = argparse.ArgumentParser(description='Build the offline gazetteer from business_clean.csv.')
+    parser.add_argument('business_csv', type=str, nargs='?', default='business_clean.csv', help='The cleaned business csv file.')
+    parser.add_argument('output', type=str, nargs='?', default='gazetteer.npz', help='The gazetteer artifact to write.')
+    args = parser.parse_args()
+
+    gazetteer = Gazetteer.from_business(pd.read_csv(args.business_csv, dtype={'postal_code': str}))
+    gazetteer.save(args.output)
+    print("{} places saved to {}".format(len(gazetteer), args.output))
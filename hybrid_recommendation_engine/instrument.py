@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the hybrid recommendation engine:
+timing spans around the stages of the recommendation pipeline (loading, scoring, filtering, top n selection, framing and display)
+record the duration, the number of rows in and out and optionally the memory allocated, and flow to pluggable sinks:
+a LoggingSink, an in-memory HistogramRegistry (which also dumps the Prometheus text format) or any callable taking a SpanRecord.
+Any single query can also be run under cProfile with profiled().
+
+Usage:
+    from instrument import Tracer, HistogramRegistry, LoggingSink, profiled
+    registry = HistogramRegistry()
+    recommender = Recommender(tracer=Tracer([registry, LoggingSink()], memory=False))
+    recommender.keyword(city='Las Vegas', state='NV', cuisine='thai')
+    print(registry.prometheus())
+    with profiled('keyword.prof'):
+        recommender.keyword(city='Las Vegas', state='NV', cuisine='thai')
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import bisect
+import collections
+import contextlib
+import cProfile
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+# named tuple for the measurements of one stage
+SpanRecord = collections.namedtuple('SpanRecord', ['name', 'parent', 'seconds', 'rows_in', 'rows_out', 'memory_delta'])
+SpanRecord.__doc__ = """The measurements of one stage of the pipeline.
+---
+name, parent: the name of the stage, e.g. 'filter.cuisine', and of the enclosing stage (None at the top level)
+seconds: the wall-clock duration
+rows_in, rows_out: the number of candidate rows entering and leaving the stage, None if not applicable
+memory_delta: the bytes allocated minus the bytes freed during the stage as traced by tracemalloc, None if memory tracing is off
+"""
+
+# span classes
+class _NullSpan:
+    """span of a tracer without sink, nothing is measured"""
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+
+    def __init__(self, tracer, name, rows_in):
+        self.tracer, self.name, self.rows_in = tracer, name, rows_in
+        self.rows_out = None # set by the instrumented code before the span exits
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self._memory = tracemalloc.get_traced_memory()[0] if self.tracer.memory else None
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._start
+        memory_delta = tracemalloc.get_traced_memory()[0] - self._memory if self._memory is not None else None
+        self.tracer._stack().pop()
+        self.tracer.emit(SpanRecord(self.name, self.parent, seconds, self.rows_in, self.rows_out, memory_delta))
+        return False
+
+# tracer class
+class Tracer:
+
+    def __init__(self, sinks=(), memory=False):
+        """initiate a Tracer, shared by all the threads of an Engine.
+        ---
+        sinks: the callables receiving the SpanRecord of every stage, the spans are not measured at all if there is no sink
+        memory: a boolean to indicate if the memory allocated by each stage is traced (tracemalloc is started, which slows down allocations)
+        """
+        self.sinks = list(sinks)
+        self.memory = memory
+        self._local = threading.local()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def span(self, name, rows_in=None):
+        """Return a context manager measuring a stage, set .rows_out on it before it exits. Spans can be nested."""
+        if not self.sinks:
+            return _NULL_SPAN
+        return _Span(self, name, rows_in)
+
+    def emit(self, record):
+        for sink in self.sinks:
+            sink(record)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+# sinks
+class LoggingSink:
+
+    def __init__(self, logger=None, level=logging.INFO):
+        """initiate a sink logging one line per span to a logger (default is the 'recommender' logger)"""
+        self.logger = logger if logger is not None else logging.getLogger('recommender')
+        self.level = level
+
+    def __call__(self, record):
+        self.logger.log(self.level, "%s%s: %.3f ms, rows %s -> %s%s", '' if record.parent is None else record.parent + ' > ', record.name,
+                        record.seconds * 1000, record.rows_in, record.rows_out,
+                        '' if record.memory_delta is None else ', memory {:+.1f} kB'.format(record.memory_delta / 1024))
+
+# upper bounds of the latency buckets in seconds, from 10 microseconds to 10 seconds
+DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class HistogramRegistry:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """initiate an in-memory registry of the latency histograms of the stages, with the total rows in and out and memory allocated"""
+        self.buckets = np.asarray(buckets, dtype=float)
+        self._bounds = tuple(self.buckets) # bisect on a tuple is faster than numpy for one value
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {} # stage name -> dictionary of the counters, see __call__
+
+    def __call__(self, record):
+        bucket = bisect.bisect_left(self._bounds, record.seconds) # the last bucket (index len(buckets)) is +Inf
+        with self._lock:
+            stage = self.stages.get(record.name)
+            if stage is None:
+                stage = self.stages[record.name] = {'counts': np.zeros(len(self.buckets) + 1, dtype=np.int64), 'count': 0, 'seconds': 0.0,
+                                                    'rows_in': 0, 'rows_out': 0, 'memory_delta': 0}
+            stage['counts'][bucket] += 1
+            stage['count'] += 1
+            stage['seconds'] += record.seconds
+            stage['rows_in'] += record.rows_in or 0
+            stage['rows_out'] += record.rows_out or 0
+            stage['memory_delta'] += record.memory_delta or 0
+
+    def quantile(self, name, q):
+        """Return the q-quantile of the latency of a stage in seconds, estimated as the upper bound of its bucket"""
+        counts = self.stages[name]['counts']
+        bucket = int(np.searchsorted(np.cumsum(counts), q * counts.sum()))
+        return float(self.buckets[bucket]) if bucket < len(self.buckets) else float('inf')
+
+    def summary(self):
+        """Return a JSON-serializable dictionary of the statistics of each stage, sorted by total time"""
+        with self._lock:
+            names = sorted(self.stages, key=lambda n: -self.stages[n]['seconds'])
+            return {n: {'count': self.stages[n]['count'], 'total_ms': self.stages[n]['seconds'] * 1000,
+                        'mean_ms': self.stages[n]['seconds'] * 1000 / self.stages[n]['count'],
+                        'p50_ms': self.quantile(n, 0.5) * 1000, 'p99_ms': self.quantile(n, 0.99) * 1000,
+                        'mean_rows_in': self.stages[n]['rows_in'] / self.stages[n]['count'],
+                        'mean_rows_out': self.stages[n]['rows_out'] / self.stages[n]['count'],
+                        'mean_memory_delta': self.stages[n]['memory_delta'] / self.stages[n]['count']} for n in names}
+
+    def prometheus(self, prefix='recommender'):
+        """Return the histograms and counters in the Prometheus text exposition format"""
+        lines = ['# HELP {}_stage_seconds Duration of the stages of the recommendation pipeline.'.format(prefix),
+                 '# TYPE {}_stage_seconds histogram'.format(prefix)]
+        with self._lock:
+            stages = sorted(self.stages.items())
+            for name, stage in stages:
+                cumulative = np.cumsum(stage['counts'])
+                for bound, count in zip(list(self.buckets) + ['+Inf'], cumulative):
+                    lines.append('{}_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(prefix, name, bound, count))
+                lines.append('{}_stage_seconds_sum{{stage="{}"}} {}'.format(prefix, name, stage['seconds']))
+                lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(prefix, name, stage['count']))
+            for key, kind, help in [('rows_in', 'counter', 'Rows entering the stages.'), ('rows_out', 'counter', 'Rows leaving the stages.'),
+                                    ('memory_delta', 'gauge', 'Net bytes allocated by the stages (traced by tracemalloc).')]:
+                metric = '{}_stage_{}'.format(prefix, key + ('_total' if kind == 'counter' else '_bytes'))
+                lines += ['# HELP {} {}'.format(metric, help), '# TYPE {} {}'.format(metric, kind)]
+                lines += ['{}{{stage="{}"}} {}'.format(metric, name, stage[key]) for name, stage in stages]
+        return '\n'.join(lines) + '\n'
+
+@contextlib.contextmanager
+def profiled(path=None, sort='cumulative', limit=20, stream=None):
+    """Run the enclosed code under cProfile, e.g. a single query.
+    ---
+    path: the file to save the stats to, to be loaded by pstats.Stats(path) (or snakeviz), not saved if None
+    sort, limit: the order and the number of the functions printed to 'stream' (default is stdout), nothing is printed if limit is 0
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path is not None:
+            profiler.dump_stats(path)
+        if limit:
+            pstats.Stats(profiler, stream=stream if stream is not None else sys.stdout).sort_stats(sort).print_stats(limit)
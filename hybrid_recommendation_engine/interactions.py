@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+User interaction index for the hybrid recommendation engine:
+a CSR-style (compressed sparse row) index of the restaurants rated by each user, along with the ratings.
+Interactions added after the index is built (e.g. newly ingested reviews) are kept in a small per-user overlay
+until the index is compacted into new CSR arrays.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import numpy as np
+import pandas as pd
+
+def _keep_last(items, values):
+    """Return the sorted distinct items and the value of the last occurrence of each item"""
+    items, last = np.unique(items[::-1], return_index=True)
+    return items, values[::-1][last]
+
+# interaction index class
+class InteractionIndex:
+
+    def __init__(self, user_ids, item_codes, n_items, values=None):
+        """build the index from a list of (user_id, item code) interactions, e.g. the reviews of the 'review_s' dataset.
+        ---
+        user_ids: the user_id of each interaction, or a pandas Categorical of them (e.g. the 'user_id' column of the compact 'review' dataset),
+            whose codes are then used as they are
+        item_codes: the integer code of the item of each interaction, e.g. the row position of the restaurant in the 'business' dataset,
+            negative codes (items unknown to the catalog) are left out
+        n_items: the number of distinct item codes (codes range from 0 to n_items-1)
+        values: the value of each interaction, e.g. the star rating of the review, default is 1.
+            The last value is kept for the duplicated (user, item) pairs.
+        ---
+        Users are dictionary-encoded to int32 codes, the items rated by the user of code u are
+        .indices[.indptr[u]:.indptr[u+1]], sorted and without duplicates, and their values are .values[.indptr[u]:.indptr[u+1]].
+        """
+
+        item_codes = np.asarray(item_codes)
+        values = np.ones(len(item_codes), dtype=np.float32) if values is None else np.asarray(values, dtype=np.float32)
+        keep = item_codes >= 0
+        if isinstance(user_ids, pd.Categorical): # already dictionary-encoded
+            user_ids = user_ids[keep].remove_unused_categories()
+            user_codes, self.users = user_ids.codes, user_ids.categories
+        else:
+            user_codes, self.users = pd.factorize(np.asarray(user_ids, dtype=object)[keep])
+        self.users = pd.Index(np.asarray(self.users, dtype=object), dtype=object) # object dtype, so that the hash table of the index is built once and reused
+        self.n_items = n_items
+        # sort the interactions by user and item, and drop the duplicated (user, item) pairs
+        pairs, self.values = _keep_last(user_codes.astype(np.int64) * n_items + item_codes[keep], values[keep])
+        user_codes = (pairs // n_items).astype(np.int32)
+        self.indices = (pairs % n_items).astype(np.int32)
+        self.indptr = np.zeros(len(self.users) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(user_codes, minlength=len(self.users)), out=self.indptr[1:])
+        # overlay of the interactions added by .add(): user_id -> (sorted array of item codes, their values)
+        self._added = {}
+        self.n_added, self._new_users = 0, 0
+
+    def user_code(self, user_id):
+        """Return the int32 code of the user_id of interest, or -1 if the user has no interaction"""
+        return self.users.get_loc(user_id) if user_id in self.users else -1
+
+    def has_history(self, user_id):
+        """Return True if the user_id of interest has at least one interaction"""
+        return user_id in self.users or user_id in self._added
+
+    def _csr_row(self, user_id):
+        u = self.user_code(user_id)
+        if u < 0:
+            return self.indices[:0], self.values[:0]
+        return self.indices[self.indptr[u]:self.indptr[u+1]], self.values[self.indptr[u]:self.indptr[u+1]]
+
+    def items(self, user_id):
+        """Return the sorted array of item codes the user_id of interest has interacted with (empty if none)"""
+        items, _ = self._csr_row(user_id)
+        added = self._added.get(user_id)
+        return items if added is None else np.union1d(items, added[0])
+
+    def ratings(self, user_id):
+        """Return the sorted array of item codes the user_id of interest has interacted with and their values,
+        the values of the added interactions override those of the CSR arrays.
+        """
+        items, values = self._csr_row(user_id)
+        added = self._added.get(user_id)
+        if added is None:
+            return items, values
+        return _keep_last(np.concatenate([items, added[0]]), np.concatenate([values, added[1]]))
+
+    def degree(self, user_id):
+        """Return the number of distinct items the user_id of interest has interacted with"""
+        return len(self.items(user_id))
+
+    def add(self, user_ids, item_codes, values=None):
+        """Add a list of (user_id, item code) interactions and their values to the overlay of the index, e.g. newly ingested reviews.
+        The cost is proportional to the number of interactions added, the CSR arrays are left untouched.
+        ---
+        note: the overlay entry of a user is replaced by a new tuple rather than modified, so that concurrent readers see either
+            the old or the new items of the user. Concurrent calls to .add() must be serialized by the caller.
+            An item both in the CSR row and in the overlay of a user is only returned once by .items().
+        """
+        item_codes = np.asarray(item_codes)
+        values = np.ones(len(item_codes), dtype=np.float32) if values is None else np.asarray(values, dtype=np.float32)
+        keep = item_codes >= 0
+        user_codes, users = pd.factorize(np.asarray(user_ids, dtype=object)[keep])
+        # sort the interactions by user and item, and drop the duplicated (user, item) pairs, as in __init__
+        pairs, values = _keep_last(user_codes.astype(np.int64) * self.n_items + item_codes[keep], values[keep])
+        items = (pairs % self.n_items).astype(np.int32)
+        bounds = np.searchsorted(pairs // self.n_items, np.arange(len(users) + 1))
+        for i, user_id in enumerate(users):
+            old = self._added.get(user_id)
+            new = (items[bounds[i]:bounds[i+1]], values[bounds[i]:bounds[i+1]])
+            if old is None:
+                self._new_users += user_id not in self.users
+            else:
+                new = _keep_last(np.concatenate([old[0], new[0]]), np.concatenate([old[1], new[1]]))
+            self.n_added += len(new[0]) - (0 if old is None else len(old[0]))
+            self._added[user_id] = new
+
+    def compacted(self):
+        """Return a new index with the interactions of the overlay merged into the CSR arrays, the cost is proportional to the size of the index"""
+        new_users = [u for u in self._added if u not in self.users]
+        user_ids = np.concatenate([np.asarray(self.users, dtype=object), np.asarray(new_users, dtype=object)])
+        rows, items, values = self._pairs(user_ids)
+        return InteractionIndex(user_ids[rows], items, self.n_items, values)
+
+    def pairs(self, user_ids):
+        """Return the (row, item code) pairs of the interactions of a list of users, where row is the position of the user in the list.
+        Users without interaction (or unknown) contribute no pair. Pairs are sorted by row,
+        a pair both in the CSR arrays and in the overlay of the added interactions is returned twice.
+        """
+        rows, items, _ = self._pairs(user_ids)
+        return rows, items
+
+    def _pairs(self, user_ids):
+        codes = self.users.get_indexer(pd.Index(user_ids, dtype=object))
+        start = np.where(codes >= 0, self.indptr[np.maximum(codes, 0)], 0)
+        count = np.where(codes >= 0, self.indptr[np.maximum(codes, 0) + 1] - start, 0)
+        rows = np.repeat(np.arange(len(codes)), count)
+        offset = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) # position within each user's row
+        flat = np.repeat(start, count) + offset
+        items, values = self.indices[flat], self.values[flat]
+        if len(self._added) == 0:
+            return rows, items, values
+        # merge the overlay of the added interactions, after the CSR pairs of each row so that their values come last
+        added = [(i, self._added.get(u)) for i, u in enumerate(user_ids)]
+        added = [(i, a) for i, a in added if a is not None]
+        if len(added) == 0:
+            return rows, items, values
+        rows = np.concatenate([rows] + [np.full(len(a[0]), i) for i, a in added])
+        items = np.concatenate([items] + [a[0] for _, a in added])
+        values = np.concatenate([values] + [a[1] for _, a in added])
+        order = np.argsort(rows, kind='stable')
+        return rows[order], items[order], values[order]
+
+    def __len__(self):
+        return len(self.users) + self._new_users
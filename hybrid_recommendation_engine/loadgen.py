@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Load generator for the HTTP service of the hybrid recommendation engine (server.py):
+a number of concurrent keep-alive connections send requests for randomly sampled user_ids (or keyword queries)
+and the throughput and the p50/p90/p99 latencies are reported.
+
+Usage:
+    python loadgen.py [--host 127.0.0.1] [--port 8080] [--module collaborative] [--concurrency 32] [--requests 2000]
+                      [--review-csv review_clean.csv | --artifact-dir artifacts] [--users 1000] [--n 10]
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlencode
+import numpy as np
+import pandas as pd
+
+# keyword queries sampled by the keyword module
+KEYWORD_QUERIES = [{'city': 'Las Vegas', 'state': 'NV'}, {'city': 'Phoenix', 'cuisine': 'mexican'}, {'city': 'Toronto', 'style': 'bars', 'price': '1,2'},
+                   {'state': 'NC', 'cuisine': 'thai'}, {'city': 'Charlotte', 'max_distance': 5}]
+
+def sample_users(args):
+    """Return a list of distinct user_ids sampled from the reviews"""
+    if args.artifact_dir is not None:
+        from artifacts import ArtifactStore
+        user_ids = ArtifactStore(args.artifact_dir).review().user_id
+    else:
+        user_ids = pd.read_csv(args.review_csv, usecols=['user_id']).user_id
+    user_ids = user_ids.drop_duplicates()
+    return user_ids.sample(min(args.users, len(user_ids)), random_state=42).tolist()
+
+def request_path(module, user_ids, n):
+    """Return the path and query string of a random request to the module of interest"""
+    if module == 'mix':
+        module = random.choice(['keyword', 'collaborative', 'content'])
+    if module == 'keyword':
+        params = dict(random.choice(KEYWORD_QUERIES), n=n)
+    else:
+        params = {'user_id': random.choice(user_ids), 'n': n}
+    return '/{}?{}'.format(module, urlencode(params))
+
+async def client(host, port, paths, latencies, statuses):
+    """Send the requests of a list of paths one after the other over one keep-alive connection"""
+    reader, writer = await asyncio.open_connection(host, port)
+    for path in paths:
+        start = time.perf_counter()
+        writer.write('GET {} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(path, host).encode())
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while True:
+            header = await reader.readline()
+            if header in (b'\r\n', b''):
+                break
+            if header.lower().startswith(b'content-length:'):
+                length = int(header.split(b':')[1])
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+    writer.close()
+
+async def stats(host, port):
+    """Return the /stats of the service"""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write('GET /stats HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n'.format(host).encode())
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+if __name__ == '__main__':
+    """Run the load test and report the latency percentiles."""
+
+    parser = argparse.ArgumentParser(description='Generate load against the recommendation service and report p50/p99 latencies.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='The host of the service.')
+    parser.add_argument('--port', type=int, default=8080, help='The port of the service.')
+    parser.add_argument('--module', type=str, default='collaborative', choices=['keyword', 'collaborative', 'content', 'mix'], help='The endpoint to query.')
+    parser.add_argument('--concurrency', type=int, default=32, help='The number of concurrent connections.')
+    parser.add_argument('--requests', type=int, default=2000, help='The total number of requests.')
+    parser.add_argument('--review-csv', type=str, default='review_clean.csv', help='The review csv file the user_ids are sampled from.')
+    parser.add_argument('--artifact-dir', type=str, default=None, help='The compiled artifact directory the user_ids are sampled from, instead of the csv file.')
+    parser.add_argument('--users', type=int, default=1000, help='The number of distinct user_ids to sample.')
+    parser.add_argument('--n', type=int, default=10, help='The number of recommendations per request.')
+    args = parser.parse_args()
+
+    random.seed(42)
+    user_ids = sample_users(args) if args.module != 'keyword' else []
+    paths = [request_path(args.module, user_ids, args.n) for _ in range(args.requests)]
+    latencies, statuses = [], {}
+
+    loop = asyncio.get_event_loop()
+    before = loop.run_until_complete(stats(args.host, args.port))
+    start = time.perf_counter()
+    loop.run_until_complete(asyncio.gather(*[client(args.host, args.port, paths[i::args.concurrency], latencies, statuses)
+                                             for i in range(args.concurrency)]))
+    elapsed = time.perf_counter() - start
+    after = loop.run_until_complete(stats(args.host, args.port))
+
+    latencies = np.array(latencies) * 1000
+    print("{} requests to /{} over {} connections in {:.2f}s: {:.0f} requests/s, status codes {}"
+          .format(len(latencies), args.module, args.concurrency, elapsed, len(latencies) / elapsed, statuses))
+    print("latency p50 = {:.1f}ms, p90 = {:.1f}ms, p99 = {:.1f}ms, max = {:.1f}ms"
+          .format(*np.percentile(latencies, [50, 90, 99, 100])))
+    for module in after['batches']:
+        batches = after['batches'][module]['batches'] - before['batches'][module]['batches']
+        if batches > 0:
+            print("{}: {} batches, {:.1f} requests per batch on average"
+                  .format(module, batches, (after['batches'][module]['requests'] - before['batches'][module]['requests']) / batches))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Offline top k materialization for the hybrid recommendation engine:
+the personalized recommendations of most users only change when the models are retrained, so the top k unrated open restaurants
+of every user of the collaborative module (the users of the matrix factorization) and of the content-based module
+(the users with a feature vector and a rating history) are computed once by a batch job and written to compact on-disk tables,
+int32 business codes and float16 scores (see artifacts.TopKTable), which are loaded by Recommender(precomputed=True).
+
+The users are split into chunks scored by a process pool: each worker memory-maps the user vectors (the artifact files,
+or a temporary copy for in-memory models) and only receives the rows and the rated restaurants of its chunks.
+With a versioned artifact directory (see artifacts.py), the tables are written into a new version linked to the current one,
+which is published once they are complete: the files of the version being served are never written.
+
+Usage:
+    python precompute.py [--artifact-dir artifacts] [--out-dir topk] [--k 100] [--n-jobs 4] [--chunk-size 1024] [--modules collaborative content]
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from artifacts import TopKTable, current_version, new_version_dir, publish
+
+_worker = None # memory-mapped user vectors and candidate restaurant vectors of a worker process
+
+def _init_worker(sources, item_vec, item_b, r_mean, k):
+    """initiate a worker process with the .npy files of the user vectors, biases and scales (None if not used) and the candidate restaurants"""
+    global _worker
+    vectors, biases, scale = [np.load(path, mmap_mode='r') if path is not None else None for path in sources]
+    _worker = (vectors, biases, scale, item_vec, item_b, r_mean, k)
+
+def _score_rows(rows, rated_rows, rated_cols):
+    """Return the (item columns, scores) of the top k of the users at the rows of interest, -1 columns for the excluded items"""
+    from engine import score_topk
+    vectors, biases, scale, item_vec, item_b, r_mean, k = _worker
+    user_vec = np.asarray(vectors[rows], dtype=item_vec.dtype)
+    if scale is not None:
+        user_vec *= scale[rows][:, None]
+    user_b = np.asarray(biases[rows], dtype=float) if biases is not None else np.zeros(len(rows))
+    top, score = score_topk(user_vec, user_b, item_vec, item_b, r_mean, k, rated_rows, rated_cols)
+    top[np.isneginf(score)] = -1 # fewer than k unrated restaurants
+    return top.astype(np.int32), score.astype(np.float16)
+
+def _source(array, path, temporary):
+    """Return the path of a .npy file holding the array: its own file if memory-mapped, otherwise a temporary copy written to path"""
+    if isinstance(array, np.memmap) and array.filename is not None and np.load(array.filename, mmap_mode='r').shape == array.shape:
+        return array.filename
+    np.save(path, np.asarray(array))
+    temporary.append(path)
+    return path
+
+def materialize(engine, module, out_dir, k=100, chunk_size=1024, n_jobs=1, verbose=True):
+    """Compute the top k unrated open restaurants of every user of a personalized module and write them to a TopKTable in out_dir/module.
+    ---
+    engine: a loaded Engine
+    module: 'collaborative' or 'content'
+    chunk_size: the number of users scored by one matrix product, memory use is bounded by n_jobs x chunk_size x number of restaurants
+    n_jobs: the number of worker processes, the chunks are scored in the calling process if 1
+    ---
+    return: the TopKTable written
+    ---
+    note: the table is built in out_dir/module.tmp and renamed to out_dir/module once complete,
+        so that an engine loaded meanwhile never reads a half-filled table
+    """
+    table_dir = os.path.join(out_dir, module)
+    building = table_dir + '.tmp'
+    os.makedirs(out_dir, exist_ok=True)
+    t0, temporary = time.time(), []
+    if module == 'collaborative':
+        engine._load_collaborative()
+        info = engine.svd_trained_info
+        user_ids = np.empty(len(info['userid_to_index']), dtype=object)
+        user_ids[list(info['userid_to_index'].values())] = list(info['userid_to_index'].keys())
+        rows = np.arange(len(user_ids))
+        pos, col_of_pos = engine._collab_pos, engine._collab_col_of_pos
+        item_vec, item_b = engine._collab_item_vec, engine._collab_item_b
+        sources = (_source(info['user_latent'], os.path.join(out_dir, '_user_latent.npy'), temporary),
+                   _source(info['user_bias'], os.path.join(out_dir, '_user_bias.npy'), temporary), None)
+        r_mean = info['mean_rating']
+    elif module == 'content':
+        engine._load_content()
+        store = engine.user_pcafeature
+        # only the stored rows of the users with a rating history, the other users get no recommendation from the module
+        stored = pd.Index(np.asarray(store.index, dtype=object), dtype=object)
+        rows = np.flatnonzero(engine.interactions.users.get_indexer(stored) >= 0)
+        user_ids = stored.values[rows]
+        pos, col_of_pos = engine._content_pos, engine._content_col_of_pos
+        item_vec = engine._content_item_vec
+        item_b, r_mean = np.zeros(len(pos)), 0.0
+        scale = getattr(store, 'scale', None)
+        sources = (_source(store.values, os.path.join(out_dir, '_user_pcafeature.npy'), temporary), None,
+                   None if scale is None else _source(scale, os.path.join(out_dir, '_user_pcafeature_scale.npy'), temporary))
+    else:
+        raise ValueError("module must be either 'collaborative' or 'content', got {}".format(module))
+    k = min(k, len(pos))
+
+    # (user row, item column) pairs of the restaurants already rated by the users
+    rated_rows, rated_pos = engine.interactions.pairs(user_ids)
+    rated_cols = col_of_pos[rated_pos]
+    rated_rows, rated_cols = rated_rows[rated_cols >= 0], rated_cols[rated_cols >= 0]
+    starts = range(0, len(user_ids), chunk_size)
+    bounds = [np.searchsorted(rated_rows, [start, start + chunk_size]) for start in starts]
+    chunks = ([rows[start:start+chunk_size] for start in starts],
+              [rated_rows[lo:hi] - start for start, (lo, hi) in zip(starts, bounds)],
+              [rated_cols[lo:hi] for lo, hi in bounds])
+
+    table = TopKTable.create(building, user_ids, engine._business_ids, k,
+                             {'module': module, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'model': engine._model_fingerprint(module)})
+    initargs = (sources, item_vec, item_b, r_mean, k)
+    try:
+        if n_jobs == 1:
+            _init_worker(*initargs)
+            results = map(_score_rows, *chunks)
+            for start, (top, score) in zip(starts, results):
+                table.codes[start:start+len(top)] = np.where(top >= 0, pos[top], -1)
+                table.scores[start:start+len(top)] = score
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=initargs) as pool:
+                for start, (top, score) in zip(starts, pool.map(_score_rows, *chunks)):
+                    table.codes[start:start+len(top)] = np.where(top >= 0, pos[top], -1)
+                    table.scores[start:start+len(top)] = score
+        table.codes.flush()
+        table.scores.flush()
+    finally:
+        for path in temporary:
+            os.remove(path)
+    table = None
+    # the previous table (or its links to another version, see artifacts.new_version_dir) is replaced by the complete one
+    shutil.rmtree(table_dir, ignore_errors=True)
+    os.rename(building, table_dir)
+    if verbose:
+        elapsed = time.time() - t0
+        print("{} module: top {} of {} users materialized in {:.1f}s ({:.0f} users/s) to {}"
+              .format(module, k, len(user_ids), elapsed, len(user_ids) / max(elapsed, 1e-9), table_dir))
+    return TopKTable(table_dir)
+
+if __name__ == '__main__':
+    """Materialize the top k recommendations of every user of the personalized modules."""
+
+    from engine import Engine
+
+    parser = argparse.ArgumentParser(description='Materialize the top k recommendations of all users of the personalized modules.')
+    parser.add_argument('--artifact-dir', type=str, default=None, help='The compiled artifact directory, csv and pickle files are used if omitted.')
+    parser.add_argument('--out-dir', type=str, default=None,
+                        help='The output directory, default is topk/ in a new published version of a versioned artifact directory, topk/ in the artifact directory otherwise (or the working directory).')
+    parser.add_argument('--k', type=int, default=100, help='The number of recommendations per user.')
+    parser.add_argument('--n-jobs', type=int, default=os.cpu_count(), help='The number of worker processes.')
+    parser.add_argument('--chunk-size', type=int, default=1024, help='The number of users scored by one matrix product.')
+    parser.add_argument('--modules', type=str, nargs='+', default=['collaborative', 'content'], choices=['collaborative', 'content'], help='The modules to materialize.')
+    args = parser.parse_args()
+
+    engine = Engine(personalized=True, artifact_dir=args.artifact_dir, lazy=True, cache_bytes=0)
+    # a versioned artifact directory is never written in place: the tables go into a copy of the loaded version, published once complete
+    versioned = args.out_dir is None and engine.artifacts is not None and engine.artifacts.version is not None
+    if versioned:
+        version_dir = new_version_dir(engine.artifacts.root)
+        out_dir = os.path.join(version_dir, 'topk')
+    else:
+        out_dir = args.out_dir if args.out_dir is not None else os.path.join(engine.artifacts.path if engine.artifacts is not None else '.', 'topk')
+    for module in args.modules:
+        materialize(engine, module, out_dir, k=args.k, chunk_size=args.chunk_size, n_jobs=args.n_jobs)
+    if versioned:
+        if current_version(engine.artifacts.root) != engine.artifacts.version:
+            # the tables were computed from the models of the loaded version, publishing them would roll back the new one
+            shutil.rmtree(version_dir)
+            print("version {} was published since version {} was loaded, the tables are dropped, please run again"
+                  .format(current_version(engine.artifacts.root), engine.artifacts.version))
+        else:
+            publish(engine.artifacts.root, os.path.basename(version_dir))
+            print("top k tables published in version {}".format(os.path.basename(version_dir)))
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Content profiles of the hybrid recommendation engine:
+the TF-IDF -> PCA text projection of recommender_content.ipynb saved as an artifact, and the incremental update of the user feature vectors
+(user_pcafeature) as a running weighted mean of the feature vectors of the restaurants (or reviews) rated by each user, weighted by the ratings.
+
+Fit the text projection on the reviews and save it (text_projector.npz in the working directory or the 'content' artifact directory):
+    python profiles.py review_clean.csv --out text_projector.npz [--max-features 1000] [--n-components 300]
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+def _normalize_rows(x):
+    """Rescale the rows to the unit length, same as the restaurant and user pcafeature vectors (rows of zeros are kept)"""
+    norm = np.sqrt((x * x).sum(axis=1))
+    norm[norm == 0] = 1.0
+    return x / norm[:, None]
+
+# TF-IDF -> PCA projection class
+class TextProjector:
+
+    def __init__(self, vocabulary, idf, mean, components, ngram_range=(1, 2), stop_words='english'):
+        """initiate a projection of review texts onto the restaurant feature space.
+        ---
+        vocabulary, idf: the terms and inverse document frequencies of the fitted TfidfVectorizer
+        mean, components: the mean and the kept components (n_components x n_terms) of the fitted PCA
+        ngram_range, stop_words: the tokenization of the fitted TfidfVectorizer
+        ---
+        note: the term frequencies are computed by a CountVectorizer over the fixed vocabulary and weighted by the saved idf,
+            which is the same as TfidfVectorizer.transform with its default settings (l2 norm, no sublinear tf).
+        """
+        from sklearn.feature_extraction.text import CountVectorizer
+        self.vocabulary = np.asarray(vocabulary, dtype=str)
+        self.idf = np.asarray(idf, dtype=float)
+        self.mean = np.asarray(mean, dtype=float)
+        self.components = np.asarray(components, dtype=float)
+        self.ngram_range = tuple(int(i) for i in ngram_range)
+        self.stop_words = stop_words
+        self._counter = CountVectorizer(stop_words=stop_words, ngram_range=self.ngram_range, vocabulary=self.vocabulary.tolist())
+        self._offset = np.dot(self.components, self.mean) # the projection of the mean, subtracted from every projection
+
+    @classmethod
+    def from_sklearn(cls, vectorizer, pca, n_components=300):
+        """Build a TextProjector from the fitted TfidfVectorizer and PCA of recommender_content.ipynb, keeping the top n_components"""
+        vocabulary = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get) # the terms in the order of the tfidf columns
+        return cls(vocabulary, vectorizer.idf_, pca.mean_, pca.components_[:n_components],
+                   ngram_range=vectorizer.ngram_range, stop_words=vectorizer.stop_words)
+
+    @classmethod
+    def fit(cls, documents, max_features=1000, n_components=300):
+        """Fit the pipeline of recommender_content.ipynb on a list of documents (e.g. the concatenated reviews of each restaurant):
+        the top max_features words (mono & bigrams) by TfidfVectorizer, then the top n_components by PCA.
+        Return a tuple (TextProjector, the unit-length feature vectors of the documents).
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.decomposition import PCA
+        vectorizer = TfidfVectorizer(stop_words='english', ngram_range=(1, 2), max_features=max_features)
+        x = vectorizer.fit_transform(documents).toarray()
+        pca = PCA(n_components=min(n_components, x.shape[0], x.shape[1])).fit(x)
+        projector = cls.from_sklearn(vectorizer, pca, n_components)
+        return projector, _normalize_rows(pca.transform(x))
+
+    def transform(self, texts):
+        """Return the unit-length feature vectors of a list of texts, comparable to the restaurant pcafeature vectors"""
+        counts = self._counter.transform(texts).astype(float)
+        tfidf = counts.multiply(self.idf).tocsr()
+        norm = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+        norm[norm == 0] = 1.0
+        projected = np.asarray(tfidf.dot(self.components.T)) / norm[:, None] - self._offset
+        return _normalize_rows(projected)
+
+    def save(self, path):
+        """Save the projection to a .npz file, no pickled objects"""
+        np.savez(path, vocabulary=self.vocabulary, idf=self.idf, mean=self.mean, components=self.components,
+                 ngram_range=np.array(self.ngram_range), stop_words=np.array(self.stop_words if self.stop_words is not None else ''))
+
+    @classmethod
+    def load(cls, path):
+        """Load a projection saved by .save()"""
+        with np.load(path) as f:
+            stop_words = str(f['stop_words']) or None
+            return cls(f['vocabulary'], f['idf'], f['mean'], f['components'], ngram_range=f['ngram_range'], stop_words=stop_words)
+
+def profile_statistics(user_ids, review, rest_ids, rest_values, chunk_size=65536):
+    """Return the (weight, norm) of the weighted mean feature vector of each user_id, used to update the user feature vectors incrementally:
+    weight is the sum of the ratings of the restaurants with a feature vector rated by the user in the 'review' dataset,
+    norm is the length of the weighted mean of their feature vectors (the stored user feature vectors are rescaled to the unit length).
+    ---
+    user_ids: the user_ids in the order of the rows of the user feature vectors
+    review: the 'review' dataset (user_id, business_id, stars)
+    rest_ids, rest_values: the business_ids and the feature vectors of the restaurants
+    chunk_size: the number of users whose weighted sums are computed at once, which bounds the memory use
+    """
+    from scipy import sparse
+    user_ids = pd.Index(np.asarray(user_ids, dtype=object), dtype=object)
+    rows = user_ids.get_indexer(pd.Index(review.user_id.values, dtype=object))
+    cols = pd.Index(np.asarray(rest_ids, dtype=object), dtype=object).get_indexer(pd.Index(review.business_id.values, dtype=object))
+    keep = (rows >= 0) & (cols >= 0)
+    ratings = sparse.csr_matrix((review.stars.values[keep].astype(float), (rows[keep], cols[keep])), shape=(len(user_ids), len(rest_ids)))
+    weight = np.asarray(ratings.sum(axis=1)).ravel()
+    norm = np.zeros(len(user_ids))
+    for start in range(0, len(user_ids), chunk_size):
+        weighted_sum = ratings[start:start+chunk_size].dot(rest_values)
+        norm[start:start+chunk_size] = np.sqrt((weighted_sum * weighted_sum).sum(axis=1))
+    norm = np.divide(norm, weight, out=np.zeros(len(user_ids)), where=weight > 0)
+    return weight.astype(np.float32), norm.astype(np.float32)
+
+# incremental updater of the user feature vectors
+class ProfileUpdater:
+
+    def __init__(self, store, weight=None, norm=None):
+        """initiate the updater of a store of user feature vectors (a FeatureMatrix or UserFeatureStore, see artifacts.py).
+        ---
+        weight, norm: the profile statistics of the rows of the store computed by profile_statistics(), e.g. memory-mapped from the artifacts.
+            The statistics of the users not covered are estimated from their rating history upon their first update.
+        ---
+        note: the stored vectors and statistics are never modified, the updated ones are kept in memory (see .updated_statistics())
+        """
+        self.store = store
+        self.weight, self.norm = weight, norm
+        self._stats = {} # user_id -> (weight, norm) of the profiles updated so far
+
+    def statistics(self, user_id, history):
+        """Return the (weight, norm) of the profile of the user_id of interest.
+        history: a function returning the (weight, norm) of the user from its rating history, called if the statistics are not stored
+        """
+        if user_id in self._stats:
+            return self._stats[user_id]
+        pos = self.store.position(user_id)
+        if self.weight is not None and 0 <= pos < len(self.weight):
+            return float(self.weight[pos]), float(self.norm[pos])
+        return history()
+
+    def update(self, user_id, vectors, weights, history):
+        """Fold the feature vectors of new ratings of the user_id of interest into its profile, as a running weighted mean.
+        ---
+        vectors: the feature vectors of the newly rated restaurants (or of the new reviews), one row per rating
+        weights: the ratings, i.e. the weights of the vectors in the mean
+        history: see .statistics()
+        ---
+        Only the row of the user is updated in the overlay of the store, a new row is added for a user without profile.
+        Return the new unit-length feature vector of the user.
+        """
+        weight, norm = self.statistics(user_id, history)
+        mean = norm * self.store.row(user_id) if (user_id in self.store and weight > 0) else np.zeros(vectors.shape[1])
+        total = weight + weights.sum()
+        if total <= 0:
+            return None
+        mean = (weight * mean + np.dot(weights, vectors)) / total
+        norm = float(np.sqrt(np.dot(mean, mean)))
+        vector = mean / norm if norm > 0 else mean
+        self.store.update(user_id, vector)
+        self._stats[user_id] = (float(total), norm)
+        return vector
+
+    def updated_statistics(self):
+        """Return a dictionary user_id -> (weight, norm) of the profiles updated so far, e.g. to write them with the updated vectors"""
+        return dict(self._stats)
+
+if __name__ == '__main__':
+    """Fit the TF-IDF -> PCA text projection on the reviews grouped by restaurant and save it."""
+
+    parser = argparse.ArgumentParser(description='Fit and save the text projection of the content-based module.')
+    parser.add_argument('review', type=str, help='The cleaned review csv file, with the text of the reviews.')
+    parser.add_argument('--out', type=str, default='text_projector.npz', help='The output file.')
+    parser.add_argument('--max-features', type=int, default=1000, help='The number of words (mono & bigrams) kept by the TF-IDF vectorizer.')
+    parser.add_argument('--n-components', type=int, default=300, help='The number of PCA components kept.')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    review = pd.read_csv(args.review, usecols=['business_id', 'text'])
+    # concatenate all reviews of the same business together, reviews are separated by '###'
+    documents = review.groupby('business_id').text.agg(lambda i: '###'.join(i.astype(str)))
+    projector, _ = TextProjector.fit(documents.values, max_features=args.max_features, n_components=args.n_components)
+    projector.save(args.out)
+    print("text projection of {} terms onto {} components fitted on {} restaurants in {:.1f}s, saved to {}"
+          .format(len(projector.vocabulary), len(projector.components), len(documents), time.time() - t0, args.out))
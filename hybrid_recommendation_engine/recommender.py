@@ -18,13 +18,8 @@ https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
 # import necessary modules to support the recommendation engine
 import warnings
 warnings.filterwarnings('ignore')
-import pandas as pd
-import numpy as np
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
-import pickle
-import os.path
-from sklearn.metrics.pairwise import linear_kernel
+from engine import Engine, Request, Result, score_topk
+from reloader import EngineReloader
 
 # function for calculating geodesic distance between two points
 def great_circle_mile(lat1, lon1, lat2, lon2):
@@ -48,346 +43,264 @@ def great_circle_mile(lat1, lon1, lat2, lon2):
 
 # recommender class
 class Recommender:
-    
-    def __init__(self, n=5, original_score=False, personalized=False):
+
+    def __init__(self, n=5, original_score=False, personalized=False, geocoder=None, artifact_dir=None, lazy=False, ann=False, nprobe=8, cache_bytes=64*2**20, cache_ttl=600, precomputed=False, tracer=None, engine=None):
         """initiate a Recommender object.
         ---
         Optional keyword arguments to be passed are:
         1. the desired number of recommendations to make ('n'), the default number is 10.
-        2. the score for ranking the recommendations ('original_score'): by default, the adjusted score will be used for ranking; 
+        2. the score for ranking the recommendations ('original_score'): by default, the adjusted score will be used for ranking;
             To rank by the original average rating of the restaurant, pass original_score=True
-        3. 'personalized': a boolean to indicate if additional data needs to be loaded to compute personalized recommendations. 
+        3. 'personalized': a boolean to indicate if additional data needs to be loaded to compute personalized recommendations.
+        4. 'geocoder': the remote geocoder used when a location of interest is not found in the offline gazetteer,
+            any callable taking an address string and returning an object with .latitude/.longitude (or None) is accepted and will be cached.
+            By default geopy Nominatim is used, pass geocoder=False to disable remote geocoding.
+        5. 'artifact_dir': a directory of binary artifacts compiled by artifacts.py, which are memory-mapped instead of parsing the csv and pickle files.
+        6. 'lazy': a boolean to indicate if the data of each personalized module is only loaded upon the first use of the module.
+            With personalized=True and lazy=False (default), all personalized data is pre-loaded upon creation.
+        7. 'ann': a boolean to indicate if the personalized modules retrieve the top n recommendations from the approximate (IVF) indices built by ann.py,
+            'ann_collaborative.npz' and 'ann_content.npz' in the artifact directory (or the working directory). The brute-force scoring is used otherwise.
+        8. 'nprobe': the number of inverted lists visited by an approximate search, the higher the better the recall and the slower the search.
+        9. 'cache_bytes' and 'cache_ttl': the memory budget in bytes and the time to live in seconds of the cache of the ranked recommendations
+            of repeated queries, pass cache_bytes=0 to disable the cache. The hit/miss counters are available via '.cache.stats()'.
+        10. 'precomputed': a boolean to indicate if the personalized modules answer from the top k recommendations materialized offline by precompute.py,
+            'topk/collaborative' and 'topk/content' in the artifact directory (or the working directory). A user missing from the tables,
+            a request for more than k recommendations or with keyword filters, and a user with reviews ingested since are scored live.
+        11. 'tracer': an instrument.Tracer measuring the duration, the rows in and out and optionally the memory of each stage of the pipeline,
+            e.g. Tracer([HistogramRegistry()]). No stage is measured by default.
+        12. 'engine': an already loaded Engine (see engine.py) to share among several Recommender objects, arguments 3 to 11 are ignored if passed.
+            An EngineReloader (see reloader.py) can be passed instead, the Recommender then switches to the latest engine it loaded
+            at the start of each call to a recommender module.
         ---
-        In addition, a few class variables will be initiated upon creation for internal use:        
+        In addition, a few class variables will be initiated upon creation for internal use:
         1. the class variable '.module' is used to keep track of whether a personalized recommendation is available or not.
             it only takes one of the following values with the default being 0
             0: no personalization yet
             1: a personalized recommendation has been computed using the collaborative module
             2: a personalzied recommendation has been computed using the content-based module
+            3: a personalized recommendation has been computed using the hybrid module
         2. the class variable '.column_to_dispay' is used to keep track of a list of column names to display in the recommendation results.
             the list will be updated based on the modules being called.
         3. the class variable '.recomm' is used to store the current list of recommendations
+        ---
+        note: the Recommender only keeps the state of the interactive session, all the datasets, indices and models are held by the read-only '.engine',
+            whose attributes (e.g. '.business') are also accessible from the Recommender.
         """
-        
-        # import datasets needed to power the recommendation engine
-        self.business = pd.read_csv('business_clean.csv')  # contains business data including location data, attributes and categories
-        self.business['postal_code'] = self.business.postal_code.astype(str) # update the data type of the 'postal_code' column to string
-        self.review = pd.read_csv('review_clean.csv') # contains full review text data including the user_id that wrote the review and the business_id the review is written for
-        # a subset of reviews related to restaurants
-        self.review_s = self.review[self.review.business_id.isin(self.business.business_id.unique())]
-        # add 'adjusted_score' to the 'business' dataset, which adjusts the restaurnat average star ratings by the number of ratings it has
-        globe_mean = ((self.business.stars * self.business.review_count).sum())/(self.business.review_count.sum())
-        k = 22 # set dumping strength k to 22, which is the 50% quantile of the review counts for all businesses
-        self.business['adjusted_score'] = (self.business.review_count * self.business.stars + k * globe_mean)/(self.business.review_count + k)
-        
+
+        # load the datasets, indices and models needed to power the recommendation engine
+        self._reloader = engine if isinstance(engine, EngineReloader) else None
+        if self._reloader is not None:
+            engine = self._reloader.engine
+        self.engine = engine if engine is not None else Engine(personalized=personalized, geocoder=geocoder, artifact_dir=artifact_dir,
+                                                               lazy=lazy, ann=ann, nprobe=nprobe, cache_bytes=cache_bytes, cache_ttl=cache_ttl,
+                                                               precomputed=precomputed, tracer=tracer)
+
         # initiate other class variables
         self.n = n # number of recommendations to make, default is 5
         self.original_score = original_score # boolean indicating whether the original average rating or the adjusted score is used
         self.module = 0 # variable indicating which recommender module is used, default is 0
         self.column_to_display = ['state','city','name','address','attributes.RestaurantsPriceRange2','cuisine',\
                                   'style','review_count','stars','adjusted_score'] # initiate a list of columns to display in the recommendation results
-        
+
         # upon class creation, initiate the recommendation to be all the open restaurants from the entire catalog of 'business' dataset sorted by the score of interest
-        if self.original_score:  # set sorting criteria to the originial star rating
-            score = 'stars'
-        else:  # set sorting criteria to the adjusted score
-            score = 'adjusted_score'
-        self.recomm = self.business[self.business.is_open == 1].sort_values(score, ascending=False)
-        
-        # pre-load additional information if personalized modules are desired
-        if personalized:
-            
-            # load information for collaborative module
-            with open('svd_trained_info.pkl', 'rb') as f:
-                self.svd_trained_info = pickle.load(f)
-                
-            # load information for content-based module
-            with open('rest_pcafeature_all.pkl', 'rb') as f: 
-                self.rest_pcafeature = pickle.load(f)   # load the saved restaurant pcafeature vectors
-            max_bytes = 2**31 - 1
-            bytes_in = bytearray(0)
-            input_size = os.path.getsize('user_pcafeature_all.pkl')
-            with open('user_pcafeature_all.pkl','rb') as f: 
-                for _ in range(0, input_size, max_bytes):
-                    bytes_in += f.read(max_bytes)
-                self.user_pcafeature = pickle.loads(bytes_in)  # load the saved user pcafeature vectors
-           
-    def _filter_by_location(self):
-        """Filter and update the dataframe of recommendations by the matching location of interest.
-        A combination of state, city and zipcode is used as the location information, partially missing information can be handled. 
-        Matching restaurant is defined as the restaurant within the acceptable distance (max_distance) of the location of interest.
-        note: this hidden method should only be called within the method 'keyword'
-        """       
-        geolocator = Nominatim(user_agent="yelp_recommender") # use geopy.geocoders to make geolocation queries
-        address = [self.city, self.state, self.zipcode]
-        address = ",".join([str(i) for i in address if i != None])
-        # use geolocate query to find the coordinate for the location of interest
-        try:
-            location = geolocator.geocode(address, timeout=10) 
-        except GeocoderTimedOut as e:
-            print("Error: geocode failed to locate the address of interest {} with message {}".format(address, e.message))            
-
-        # calculate the geodesic distance between each restaurant and the location of interest and add as a new column ''distance_to_interest'
-        self.recomm['distance_to_interest'] = self.recomm.apply(lambda row: great_circle_mile(row.latitude, row.longitude, location.latitude, location.longitude), axis=1)
-        # add the new column 'distance_to_interest' to the list of columns to display in the recommendation result
-        self.column_to_display.insert(0, 'distance_to_interest')
-        # filter by the desired distance
-        self.recomm = self.recomm[self.recomm.distance_to_interest <= self.max_distance]
-
-    def _filter_by_state(self):
-        """ Filter and update the dataframe of recommendations by the matching state.
-        note: this hidden method should only be called within the method 'keyword'
+        self._result = None # Result of the last recommender module, used to retrieve more recommendations on demand
+        self.recomm = self.engine.frame(self.engine.recommend(Request('keyword', original_score=self.original_score, n=None)))
+
+    def __getattr__(self, name):
+        """Look up the attributes not found on the Recommender, e.g. '.business' or '.svd_trained_info', on the engine"""
+        if name == 'engine':
+            raise AttributeError(name)
+        return getattr(self.engine, name)
+
+    def _pin(self):
+        """Switch to the latest engine of the reloader if any, the recommendations of the previous engine are not extended any more.
+        note: this hidden method should only be called at the start of the recommender modules, so that a query is answered by a single engine
         """
-        self.recomm = self.recomm[self.recomm.state == self.state.upper()]
-    
-    def _filter_by_cuisine(self):
-        """ Filter and update the dataframe of recommendations by the matching cuisine of interest. 
-        note: this hidden method should only be called within the method 'keyword'
-        """                         
-        idx = []
-        for i in self.recomm.index: 
-            if self.recomm.loc[i,'cuisine'] is not np.nan:
-                entries = self.recomm.loc[i,'cuisine'].split(',')
-                if self.cuisine in entries:
-                    idx.append(i)
-        self.recomm = self.recomm.loc[idx]
-    
-    def _filter_by_style(self):  
-        """ Filter and update the dataframe of recommendations by the matching style of interest. 
-        note: this hidden method should only be called within the method 'keyword'
+        if self._reloader is not None and self._reloader.engine is not self.engine:
+            self.engine = self._reloader.engine
+            self._result = None
+
+    def _show(self, result, n=None):
+        """Print the messages of a Result, then store and display its recommendations.
+        Return None if there is no recommendation, the dataframe of recommendations otherwise.
+        note: this hidden method should only be called within the recommender modules
         """
-        idx = []
-        for i in self.recomm.index: 
-            if self.recomm.loc[i,'style'] is not np.nan:
-                entries = self.recomm.loc[i,'style'].split(',')
-                if self.style in entries:
-                    idx.append(i)
-        self.recomm = self.recomm.loc[idx]
-        
-    def _filter_by_price(self):
-        """Filter and update the dataframe of recommendations by the matching price range of interest. 
-        note: this hidden method should only be called within the method 'keyword'
+        for message in result.messages:
+            print(message)
+        if result.total == 0:
+            return None
+        self._result = result
+        self.recomm = self.engine.frame(result)
+        self.display_recommendation(n=self.n if n is None else n)
+        return self.recomm
+
+    def full_recommendation(self):
+        """Return the full ranked list of recommendations of the last personalized module, e.g. to further filter by keywords.
+        The current list of recommendations is returned if no personalized module has been called since the last keyword filtering.
         """
-        self.recomm = self.recomm[self.recomm['attributes.RestaurantsPriceRange2'].isin(self.price)]
-    
+        if self._result is None or (self._result.exact and len(self._result.positions) == self._result.total):
+            return self.recomm
+        # only the top n have been retrieved, compute the complete scored catalog
+        return self.engine.frame(self.engine.recommend(self._result.request._replace(n=None, exact=True)))
+
     def display_recommendation(self, n=5):
         """ Display the list of top n recommended restaurants
         """
         self.n = n # update the number of recommendations to display
-        if len(self.recomm) == 0:
-            print("Sorry, there is no matching recommendations.")
-        elif self.n < len(self.recomm):  # display only the top n from the recommendation list
-            print("Below is a list of the top {} recommended restaurants for you: ".format(self.n))
-            print(self.recomm.iloc[:self.n][self.column_to_display])
-        else:  # display all if # of recommendations is less than self.n
-            print("Below is a list of all {} recommended restaurants for you: ".format(len(self.recomm)))
-            print(self.recomm[self.column_to_display])
-     
+        result = self._result
+        if result is not None and self.n > len(self.recomm) and (not result.exact or len(self.recomm) < result.total):
+            # retrieve more recommendations from the scored catalog if available
+            self._result = self.engine.recommend(result.request._replace(n=self.n, exact=True))
+            self.recomm = self.engine.frame(self._result)
+        with self.engine.tracer.span('display', rows_in=len(self.recomm)) as span:
+            if len(self.recomm) == 0:
+                print("Sorry, there is no matching recommendations.")
+            elif self.n < len(self.recomm):  # display only the top n from the recommendation list
+                print("Below is a list of the top {} recommended restaurants for you: ".format(self.n))
+                print(self.recomm.iloc[:self.n][self.column_to_display])
+            else:  # display all if # of recommendations is less than self.n
+                print("Below is a list of all {} recommended restaurants for you: ".format(len(self.recomm)))
+                print(self.recomm[self.column_to_display])
+            span.rows_out = min(self.n, len(self.recomm))
+
     #---------------------------------------------------------------
     # non-personalized keyword filtering-based recommender module
-    def keyword(self, df=None, zipcode=None, city=None, state=None, max_distance=10, cuisine=None, style=None, price=None, personalized=False, original_score=False):
-        """Non-personalized recommendation by keyword filtering: 
-        Support filtering by the distance and location (zipcode, city, state) of interest, 
-        by the desired cuisine, by the desired style, and by the desired price range. 
+    def keyword(self, df=None, zipcode=None, city=None, state=None, max_distance=10, cuisine=None, style=None, price=None, personalized=False, original_score=False, match='any'):
+        """Non-personalized recommendation by keyword filtering:
+        Support filtering by the distance and location (zipcode, city, state) of interest,
+        by the desired cuisine, by the desired style, and by the desired price range.
         The module supports multiple price range inputs separated by comma.
+        The module also supports multiple cuisines or styles passed as a list, e.g. cuisine=['thai','vietnamese'].
         ---
         Note:
-        df: the default restaurant catalog is all the open restaurants in the 'business' dataset, 
+        df: the default restaurant catalog is all the open restaurants in the 'business' dataset,
             if a subset is prefered, e.g. previous filtered result, the subset can be passed via keyword argument 'df'
         state: needs to be the upper case of the state abbreviation, e.g.: 'NV', 'CA'
         max_distance: the max acceptable distance between the restaurant and the location of interest, unit is in miles, default is 10
+        match: 'any' to keep restaurants matching at least one of the cuisines (styles) of interest, 'all' to keep restaurants matching every one of them
         """
-        
+
         # re-initiate the following variables every time the module is called so that the recommendation starts fresh
-        self.recomm = df if df is not None else self.business[self.business.is_open ==1] # start with the desired restaurant catalog
-        self.recomm['distance_to_interest'] = np.nan # reset the distance between each restaurant and the location of interest
+        self._pin()
         self.column_to_display = ['state','city','name','address','attributes.RestaurantsPriceRange2','cuisine','style','review_count','stars','adjusted_score'] # reset the columns to display
         self.original_score = original_score
-        
-        # assign variables based on user's keyword inputs
-        self.zipcode, self.city, self.state, self.max_distance = zipcode, city, state, max_distance
-        self.cuisine, self.style, self.price = cuisine, style, price
-        
-        # check self.module and column names to see a personalized score is available for ranking and displaying personalized recommendations
-        if personalized:
-            if (self.module == 0) or ('predicted_stars' not in self.recomm.columns and 'similarity_score' not in self.recomm.columns):
-                print("no personalized list of recommendations is generated yet!")
-                print("please first run the collaborative recommender module or content-based recommender module for a personalized recommendations.")
-                return None
-        
-        # filter by restaurant location
-        if (self.zipcode != None) or (self.city != None) or (self.state != None):      
-            if (self.zipcode != None) or (self.city != None): # use zipcode and/or city whenever available
-                self._filter_by_location()
-            else: # filter by state if state is the only location information available 
-                self._filter_by_state()
-            if len(self.recomm) == 0:
-                print("no restaurant found for the matching location of interest.")
-                return None
-        
-        # filter by restaurant 'cuisine'
-        if self.cuisine != None:
-            self._filter_by_cuisine()
-            if len(self.recomm) == 0:
-                print("no restaurant found for the matching cuisine of {}".format(self.cuisine))
-                return None
-    
-        # filter by restaurant 'style'
-        if self.style != None:
-            self._filter_by_style() 
-            if len(self.recomm) == 0:
-                print("no restaurant found for the matching style of {}".format(self.style))
-                return None
-        
-        # filter by restaurant price range
-        if self.price != None:
-            self.price = [i.strip() for i in price.split(',')] #extract multiple inputs of price range
-            self._filter_by_price()
-            if len(self.recomm) == 0:
-                print("no restaurant found for the matching price of {}".format(self.price))
-                return None
-        
-        # sort the matching list of restaurants by the score of interest
-        if personalized:
-            if self.module == 1:
-                score = 'predicted_stars'
-                self.column_to_display.insert(0, 'predicted_stars')  # add 'predicted_stars' to the list of columns to display
-            elif self.module == 2:
-                score = 'similarity_score'
-                self.column_to_display.insert(0, 'similarity_score')  # add 'similarity_score' to the list of columns to display
-        elif self.original_score:  # set sorting criteria to the originial star rating
-            score = 'stars'
-        else:  # set sorting criteria to the adjusted score
-            score = 'adjusted_score'
-        self.recomm = self.recomm.sort_values(score, ascending=False)
-        
+
+        # check self.module to see a personalized score is available for ranking and displaying personalized recommendations
+        if personalized and self.module == 0:
+            df = None # the engine reports that no personalized list of recommendations is generated yet
+        within = self.engine.as_result(df) if df is not None else None
+        result = self.engine.recommend(Request('keyword', zipcode=zipcode, city=city, state=state, max_distance=max_distance, cuisine=cuisine, style=style,
+                                               price=price, match=match, original_score=original_score, personalized=personalized, n=None, within=within))
+
+        # add the distance and the personalized score to the list of columns to display
+        if result.distance is not None:
+            self.column_to_display.insert(0, 'distance_to_interest')
+        if personalized and result.score_column is not None:
+            self.column_to_display.insert(0, result.score_column)
+
         # display the list of top n recommendations
-        self.display_recommendation()
-        
-        return self.recomm
-    
-    
+        return self._show(result)
+
+
     #------------------------------------------------------------
     # personalized collaborative recommender module
-    def collaborative(self, user_id=None):
-        """Personalized recommendation by collaborative filtering: 
+    def collaborative(self, user_id=None, n=None, ratings=None):
+        """Personalized recommendation by collaborative filtering:
         Recommendation is generated based on the predicted ratings from user x restaurant matrix factorization.
         ---
         note:
-        Passing of user_id is required for the collaborative personalized module. If user's history is not available,
-        a generic recommendation will be computed and returned based on all users' history in the database. 
+        Passing of user_id is required for the collaborative personalized module. If the user is missing from the matrix factorization,
+        the user is folded into the model from the user's ratings in the review data and the optional 'ratings', a dictionary {business_id: stars}.
+        If user's history is not available, a generic recommendation will be computed and returned based on all users' history in the database.
+        Only the top n recommendations are returned (default is the current .n),
+        the full ranked list of recommendations is available on demand via the method 'full_recommendation'.
         ---
         """
-        
-        self.user_id = user_id # user_id for personalized recommendation using collaborative module 
-        if self.user_id is None:
-            print("no user_id is provided!")
-            return None
-        if len(self.user_id) != 22:
-            print("invalid user id!")
-            return None
-        
+
         # initiate every time the module is called
-        self.recomm = self.business[self.business.is_open ==1] # start with all open restaurants from the entire 'business' catalog
+        self._pin()
         self.column_to_display = ['state','city','name','address','attributes.RestaurantsPriceRange2',\
                                   'cuisine','style','review_count','stars','adjusted_score'] # reset the columns to display
-        if 'predicted_stars' in self.recomm.columns:
-            self.recomm.drop('predicted_stars', axis=1, inplace=True) # delete the column of 'predicted_stars' if already present
-        
-        # extract all necessary information saved from the matrix factorization algorithm
-        user_latent, item_latent = self.svd_trained_info['user_latent'], self.svd_trained_info['item_latent']
-        user_bias, item_bias = self.svd_trained_info['user_bias'], self.svd_trained_info['item_bias']
-        r_mean = self.svd_trained_info['mean_rating'] # global mean of all ratings
-        userid_to_idx, itemid_to_idx = self.svd_trained_info['userid_to_index'], self.svd_trained_info['itemid_to_index']        
-        
-        # predict personalized restaurant ratings for the user_id of interest
-        if self.user_id in userid_to_idx:
-            u_idx = userid_to_idx[self.user_id]
-            pred = r_mean + user_bias[u_idx] + item_bias + np.dot(user_latent[u_idx,:],item_latent.T)
-        else: 
-            print("sorry, no personal data available for this user_id yet!")
-            print("Here is the generic recommendation computed from all the users in our database:")
-            pred = r_mean + item_bias
-        
-        # pairing the predicted ratings with the business_id by matching the corresponding matrix indices of the business_id
-        prediction = pd.DataFrame(data=pred, index=itemid_to_idx.values(), columns=['predicted_stars']) 
-        assert len(prediction) == len(pred)
-        prediction['business_id'] = list(itemid_to_idx.keys())
-        
-        # filter to unrated business_id only by the user_id of interest if a personal history is available
-        if self.user_id in userid_to_idx:       
-            busi_rated = self.review[self.review.user_id == self.user_id].business_id.unique()
-            prediction = prediction[~prediction.business_id.isin(busi_rated)]
-        
-        # inner-join the prediction dataframe with the recommendation catalog on 'business_id' to retrieve all relevant business information
-        # note: the .merge step needs to be performed prior to extracting the top n, because many businesses in 'review' dataset are not restaurant-related, therefore not present in 'business' dataset
-        self.recomm = self.recomm.merge(prediction, on='business_id', how='inner') 
-        
-        # sort the prediction by the predicted ratings in descending order
-        self.recomm = self.recomm.sort_values('predicted_stars', ascending=False).reset_index(drop=True)
-        
+
+        # predict personalized restaurant ratings for the user_id of interest and select the top n recommendations only
+        n = self.n if n is None else n
+        result = self.engine.recommend(Request('collaborative', user_id=user_id, n=n, ratings=ratings))
+        if result.total == 0:
+            return self._show(result)
+
         # add 'predicted_stars' to the list of columns to display and update self.module to 1
-        self.column_to_display.insert(0, 'predicted_stars') 
+        self.column_to_display.insert(0, 'predicted_stars')
         self.module = 1
-        
+
         # display the list of top n recommendations
-        self.display_recommendation()
-        
-        return self.recomm
-    
-    
+        return self._show(result, n=n)
+
+
     #------------------------------------------------------------
     # personalized content-based recommender module
-    def content(self, user_id=None):
-        """Personalized recommendation by content-based filtering based on restaurant reviews: 
-        Recommendation is generated based on cosine similarity scores between user and restaurant feature vectors. 
+    def content(self, user_id=None, n=None):
+        """Personalized recommendation by content-based filtering based on restaurant reviews:
+        Recommendation is generated based on cosine similarity scores between user and restaurant feature vectors.
         The feature vector space is extracted based on all the restaurant reviews.
         ---
         note:
-        Passing of user_id is required for the content-based personalized module. 
-        If user's history is not available, an empty dataframe will be returned along with a warning message. 
+        Passing of user_id is required for the content-based personalized module.
+        If user's history is not available, an empty dataframe will be returned along with a warning message.
+        Only the top n recommendations are returned (default is the current .n),
+        the full ranked list of recommendations is available on demand via the method 'full_recommendation'.
         ---
         """
-        
-        self.user_id = user_id # user_id for personalized recommendation using content-based module
-        if self.user_id is None:
-            print("no user_id is provided!")
-            return None
-        if len(self.user_id) != 22:
-            print("invalid user id!")
-            return None
-        if self.user_id not in self.review_s.user_id.unique(): # check if previous restaurant rating/review history is available for the user_id of interest
-            print("sorry, no personal data available for this user_id yet!")
-            return None
-        
+
         # initiate every time the module is called
-        self.recomm = self.business[self.business.is_open ==1] # start with all open restaurants from the entire 'business' catalog
+        self._pin()
         self.column_to_display = ['state','city','name','address','attributes.RestaurantsPriceRange2',\
                                   'cuisine','style','review_count','stars','adjusted_score'] # reset the columns to display
-        if 'similarity_score' in self.recomm.columns:
-            self.recomm.drop('similarity_score', axis=1, inplace=True) # delete the column of 'cosine_similarity' if already present
-        
-        # predict personalized cosine similarity scores for the user_id of interest
-        sim_matrix = linear_kernel(self.user_pcafeature.loc[user_id].values.reshape(1, -1), self.rest_pcafeature)
-        sim_matrix = sim_matrix.flatten()
-        sim_matrix = pd.Series(sim_matrix, index = self.rest_pcafeature.index)
-        sim_matrix.name = 'similarity_score'
-        
-        # pairing the computed cosine similarity score with the business_id by matching the corresponding matrix indices of the business_id
-        self.recomm = pd.concat([sim_matrix, self.recomm.set_index('business_id')], axis=1, join='inner').reset_index()
-        
-        # filter to unrated business_id only by the user_id of interest if a personal history is available      
-        busi_rated = self.review_s[self.review_s.user_id == self.user_id].business_id.unique()
-        self.recomm = self.recomm[~self.recomm.business_id.isin(busi_rated)]
-               
-        # sort the recommendation by the cosine similarity score in descending order
-        self.recomm = self.recomm.sort_values('similarity_score', ascending=False).reset_index(drop=True)
-           
+
+        # predict personalized cosine similarity scores for the user_id of interest and select the top n recommendations only
+        n = self.n if n is None else n
+        result = self.engine.recommend(Request('content', user_id=user_id, n=n))
+        if result.total == 0:
+            return self._show(result)
+
         # add 'similarity_score' to the list of columns to display and update self.module to 2
-        self.column_to_display.insert(0, 'similarity_score') 
+        self.column_to_display.insert(0, 'similarity_score')
         self.module = 2
-        
+
+        # display the list of top n recommendations
+        return self._show(result, n=n)
+
+
+    #------------------------------------------------------------
+    # personalized hybrid recommender module
+    def hybrid(self, user_id=None, n=None, weights=None, ratings=None):
+        """Personalized recommendation by both the collaborative and the content-based filtering:
+        Recommendation is generated based on a linear blend of the predicted ratings of the matrix factorization,
+        the cosine similarity scores between user and restaurant feature vectors and the adjusted scores, all computed in one pass.
+        ---
+        note:
+        Passing of user_id is required for the hybrid personalized module.
+        'weights' is an optional dictionary of blend weights {'intercept', 'predicted_stars', 'similarity_score', 'adjusted_score'}
+        overriding the default ones (see Engine.hybrid_weights), 'ratings' is the same as for the collaborative module.
+        If user's history is not available, a generic recommendation will be computed and returned based on all users' history in the database.
+        Only the top n recommendations are returned (default is the current .n),
+        the full ranked list of recommendations is available on demand via the method 'full_recommendation'.
+        ---
+        """
+
+        # initiate every time the module is called
+        self._pin()
+        self.column_to_display = ['state','city','name','address','attributes.RestaurantsPriceRange2',\
+                                  'cuisine','style','review_count','stars','adjusted_score'] # reset the columns to display
+
+        # blend the personalized scores for the user_id of interest and select the top n recommendations only
+        n = self.n if n is None else n
+        result = self.engine.recommend(Request('hybrid', user_id=user_id, n=n, weights=weights, ratings=ratings))
+        if result.total == 0:
+            return self._show(result)
+
+        # add 'hybrid_score' to the list of columns to display and update self.module to 3
+        self.column_to_display.insert(0, 'hybrid_score')
+        self.module = 3
+
         # display the list of top n recommendations
-        self.display_recommendation()
-        
-        return self.recomm
\ No newline at end of file
+        return self._show(result, n=n)
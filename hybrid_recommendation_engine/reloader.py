@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Hot reload of the hybrid recommendation engine:
+an EngineReloader holds the Engine currently serving and replaces it by a new one loaded in a background thread,
+e.g. when a new version of a versioned artifact directory is published (see artifacts.py), without restarting the process.
+
+The new engine is loaded with the same arguments as the current one and its personalized modules are warmed up before it is swapped in,
+by a single assignment of the '.engine' reference: the requests started before the swap finish on the engine they started with,
+which is freed (and its memory-mapped files unmapped) once the last of them returns. Every process of a host serving the same version
+maps the same files, so the user matrices are held once in the page cache whatever the number of worker processes
+(each process still builds its own id dictionaries and gathered restaurant vectors, see artifacts.py).
+
+The reviews ingested into the current engine since it was loaded (or persisted, see Engine.persist) are replayed into the new engine
+right before the swap, so that they are not lost: ingest them through EngineReloader.ingest_reviews(), which never adds a batch
+to an engine being replaced. The reviews of a new version persisted by another process are not replayed, only those of this process.
+
+Usage:
+    from reloader import EngineReloader
+    reloader = EngineReloader(Engine(personalized=True, artifact_dir='models/'))
+    reloader.watch(interval=10)            # reload whenever models/CURRENT points to a new version
+    reloader.reload()                      # or reload now, in the background (returns a Future)
+    engine = reloader.engine               # take the current engine once per request
+    reloader.ingest_reviews(batch)         # add new reviews to the current engine, replayed into the next one
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from engine import Engine
+from artifacts import current_version
+
+class EngineReloader:
+
+    def __init__(self, engine, on_swap=None):
+        """initiate a reloader of a loaded Engine.
+        ---
+        engine: the Engine serving until the first reload
+        on_swap: an optional function called with the (old, new) engines after each swap, e.g. to log the new version
+        ---
+        note: read '.engine' once per request and use that engine for the whole request, so that a request never mixes two versions
+        """
+        self.engine = engine
+        self.on_swap = on_swap
+        self._executor = ThreadPoolExecutor(max_workers=1) # the reloads are run one at a time, in the order requested
+        self._pending = None # the future of the reload queued or running, if any
+        self._lock = threading.Lock()
+        self._swap_lock = threading.Lock() # held by the ingestions and the replay + swap, so that no batch is added to an engine being replaced
+        self._stop = threading.Event()
+        self._watcher = None
+        self.reloads, self.failures, self.last_error = 0, 0, None
+        self._failed_version = None # the last version which failed to load, not retried by .check()
+
+    @property
+    def version(self):
+        """Return the version of the artifacts the current engine was loaded from (None if not loaded from a versioned artifact directory)"""
+        return self.engine.artifacts.version if self.engine.artifacts is not None else None
+
+    def reload(self, artifact_dir=None, wait=False):
+        """Load a new engine in the background and swap it in once loaded.
+        ---
+        artifact_dir: the artifact directory to load from, default is the one of the current engine (its current version if versioned)
+        wait: a boolean to indicate if the call blocks until the new engine is swapped in, it then returns the new engine (or raises the error)
+        ---
+        return: the Future of the new engine. A reload requested while another one is queued returns the queued one.
+        """
+        with self._lock:
+            if self._pending is None or self._pending.running() or self._pending.done() or artifact_dir is not None:
+                self._pending = self._executor.submit(self._reload, artifact_dir)
+            future = self._pending
+        return future.result() if wait else future
+
+    def _reload(self, artifact_dir):
+        old = self.engine
+        options = dict(old.options, lazy=True)
+        if artifact_dir is not None:
+            options['artifact_dir'] = artifact_dir
+        t0 = time.time()
+        try:
+            engine = Engine(**options)
+            # warm up the personalized modules used by the current engine, so that the first requests after the swap do not load them
+            if old.svd_trained_info is not None:
+                engine._load_collaborative()
+            if old.user_pcafeature is not None:
+                engine._load_content()
+            if old._hybrid is not None:
+                engine._load_hybrid()
+        except Exception as e: # the current engine keeps serving
+            self.failures += 1
+            self.last_error = repr(e)
+            print("the reload failed, version {} is still served: {!r}".format(self.version, e))
+            raise
+        engine.options['lazy'] = old.options['lazy']
+        with self._swap_lock:
+            # the reviews ingested into the old engine and not persisted into a version are added to the new one
+            replayed = engine.ingest_reviews(self.engine.ingested_reviews())
+            old = self.engine
+            self.engine = engine # the swap: a single reference assignment, the requests in flight keep the engine they started with
+        self.reloads += 1
+        print("version {} loaded in {:.1f}s and swapped in (was {}){}".format(self.version, time.time() - t0, old.artifacts.version if old.artifacts is not None else None,
+                                                                            ', {} ingested reviews replayed'.format(replayed) if replayed > 0 else ''))
+        if self.on_swap is not None:
+            self.on_swap(old, engine)
+        return engine
+
+    def ingest_reviews(self, batch):
+        """Add a batch of new reviews to the current engine, see Engine.ingest_reviews. Return the number of reviews ingested.
+        note: the batch waits for a swap in progress, it is then added to the new engine
+        """
+        with self._swap_lock:
+            return self.engine.ingest_reviews(batch)
+
+    def check(self):
+        """Reload if the current version of the versioned artifact directory differs from the version being served.
+        Return the Future of the reload, or None if there is nothing new (or the engine is not loaded from a versioned artifact directory).
+        """
+        artifacts = self.engine.artifacts
+        if artifacts is None:
+            return None
+        version = current_version(artifacts.root)
+        if version is None or version == artifacts.version or version == self._failed_version:
+            return None
+        with self._lock:
+            if self._pending is not None and not self._pending.done(): # the reload is already on its way
+                return self._pending
+        future = self.reload()
+        future.add_done_callback(lambda f: setattr(self, '_failed_version', version) if f.exception() is not None else None)
+        return future
+
+    def watch(self, interval=10.0):
+        """Start a daemon thread checking for a new version every 'interval' seconds, see .check()"""
+        def poll():
+            while not self._stop.wait(interval):
+                try:
+                    self.check()
+                except Exception: # reported by ._reload()
+                    pass
+        if self._watcher is None:
+            self._stop.clear()
+            self._watcher = threading.Thread(target=poll, name='engine-reloader', daemon=True)
+            self._watcher.start()
+        return self._watcher
+
+    def stop(self):
+        """Stop the watcher thread and wait for the reload in progress, if any"""
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+        self._executor.shutdown(wait=True)
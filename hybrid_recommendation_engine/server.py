@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio HTTP service for the hybrid recommendation engine:
+the keyword, collaborative, content-based and hybrid recommendations are exposed as JSON endpoints over one shared read-only Engine.
+Concurrent personalized requests arriving within a short window are coalesced into one batch, which is scored by a single matrix product
+against the item latent vectors (collaborative) or the restaurant pcafeature vectors (content) in a worker thread.
+
+Endpoints (GET, JSON responses):
+    /keyword?city=Las%20Vegas&state=NV&max_distance=5&cuisine=thai,mexican&match=any&style=bars&price=1,2&original_score=0&n=10
+    /collaborative?user_id=<22 characters>&n=10    (keyword filters are also accepted, such requests are not batched)
+    /collaborative?user_id=<22 characters>&ratings=<business_id>:5,<business_id>:3    (ratings folded in for a new user, not batched)
+    /content?user_id=<22 characters>&n=10
+    /hybrid?user_id=<22 characters>&n=10&weights=predicted_stars:0.2,similarity_score:0.1    (weights are optional, not batched)
+    /stats    the number of requests and batches served, the counters of the result cache and the version of the artifacts served
+    /metrics  the latency histograms of the stages of the pipeline in the Prometheus text format (text/plain, with --metrics only)
+    /health
+
+Each request is answered by the engine current when it arrives: with a versioned artifact directory, a new version is loaded in the background
+and swapped in (see reloader.py) every time CURRENT changes (--watch) or the process receives SIGHUP, without dropping the requests in flight.
+With --processes N, N processes share the port and memory-map the same artifact files, so the user matrices are held once in the page cache
+(the id dictionaries and the gathered restaurant vectors are built by each process, see artifacts.py).
+
+Usage:
+    python server.py [--artifact-dir artifacts] [--host 127.0.0.1] [--port 8080] [--max-batch 64] [--max-wait-ms 5] [--workers 4] [--metrics]
+    python server.py --artifact-dir models/ --watch 10 --processes 4
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from engine import Engine, Request, Result
+from instrument import Tracer, HistogramRegistry
+from reloader import EngineReloader
+
+def _json_value(value):
+    """Return a JSON-serializable value, missing values (NaN) become null"""
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    return value
+
+# micro-batching queue class
+class MicroBatcher:
+
+    def __init__(self, score_batch, max_batch=64, max_wait=0.005, executor=None):
+        """initiate a queue coalescing concurrent requests into batches.
+        ---
+        score_batch: a function taking a list of user_ids and k, returning a tuple of two arrays of shape (len(user_ids), k),
+            e.g. Engine.collaborative_batch or Engine.content_batch
+        max_batch: the max number of requests scored together
+        max_wait: the max time in seconds the first request of a batch waits for more requests to arrive
+        executor: the executor the batches are scored in, so that the event loop keeps serving while a batch is scored
+        """
+        self.score_batch = score_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.executor = executor
+        self.queue = None
+        self.batches, self.requests = 0, 0
+
+    async def submit(self, user_id, n):
+        """Queue a request and return the (business_ids, scores) of its top n recommendations once its batch is scored"""
+        loop = asyncio.get_event_loop()
+        if self.queue is None: # the queue and its consumer are created upon the first request, within the running event loop
+            self.queue = asyncio.Queue()
+            loop.create_task(self._collect())
+        future = loop.create_future()
+        self.queue.put_nowait((user_id, n, future))
+        return await future
+
+    async def _collect(self):
+        """Take the queued requests in batches: a batch is closed when it is full or max_wait after its first request"""
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # score the batch in the background and start collecting the next one
+            loop.create_task(self._score(batch))
+
+    async def _score(self, batch):
+        loop = asyncio.get_event_loop()
+        k = max(n for _, n, _ in batch)
+        try:
+            ids, scores = await loop.run_in_executor(self.executor, self.score_batch, [u for u, _, _ in batch], k)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.requests += len(batch)
+        for i, (_, n, future) in enumerate(batch):
+            if not future.done():
+                future.set_result((ids[i, :n], scores[i, :n]))
+
+# HTTP service class
+class RecommenderService:
+
+    filters = ('zipcode', 'city', 'state', 'cuisine', 'style', 'price', 'ratings') # requests with any of these are not batched
+
+    def __init__(self, engine, max_batch=64, max_wait=0.005, workers=4, registry=None):
+        """initiate the HTTP service over a loaded Engine (or the EngineReloader of one), see the module docstring for the endpoints.
+        max_batch and max_wait configure the micro-batching of the personalized requests, workers is the number of scoring threads.
+        registry: the HistogramRegistry fed by the tracer of the engine, exposed on /metrics (404 if None)
+        """
+        self.reloader = engine if isinstance(engine, EngineReloader) else EngineReloader(engine)
+        self.registry = registry
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # the batches are scored by the engine current when they are scored, the business_ids returned are looked up in the engine of each request
+        self.batchers = {'collaborative': MicroBatcher(lambda u, k: self.engine.collaborative_batch(u, k=k), max_batch, max_wait, self.executor),
+                         'content': MicroBatcher(lambda u, k: self.engine.content_batch(u, k=k), max_batch, max_wait, self.executor)}
+        self._columns = (None, None)
+        self.served, self.started = 0, time.time()
+
+    @property
+    def engine(self):
+        """The engine currently serving, to be read once per request"""
+        return self.reloader.engine
+
+    def columns(self, engine):
+        """Return the columns returned with each recommendation, gathered once per engine as plain arrays
+        (the review statistics are read from the engine upon each request)
+        """
+        cached, columns = self._columns
+        if cached is not engine:
+            columns = {c: engine.business[c].to_numpy(dtype=object) for c in ['business_id', 'name', 'city', 'state', 'address']}
+            self._columns = (engine, columns)
+        return columns
+
+    def records(self, positions, scores, distance=None, engine=None):
+        """Return the list of recommendations as JSON-serializable dictionaries, engine is the one the positions refer to (default is the current one)"""
+        engine = engine if engine is not None else self.engine
+        records = []
+        columns = self.columns(engine)
+        count, stars, adjusted = engine.catalog_stats(positions)
+        for i, p in enumerate(positions):
+            record = {c: _json_value(v[p]) for c, v in columns.items()}
+            record.update({'review_count': int(count[i]), 'stars': float(stars[i]), 'adjusted_score': float(adjusted[i])})
+            record['score'] = _json_value(scores[i])
+            if distance is not None:
+                record['distance_to_interest'] = float(distance[i])
+            records.append(record)
+        return records
+
+    def request(self, module, params):
+        """Return the Request of the query parameters of an endpoint"""
+        get = lambda key, default=None: params[key][0] if key in params else default
+        tags = lambda key: None if key not in params else ([tag.strip() for tag in get(key).split(',')] if ',' in get(key) else get(key).strip())
+        if get('match', 'any') not in ('any', 'all'):
+            raise ValueError("match must be either 'any' or 'all', got {}".format(get('match')))
+        # 'key:value' pairs separated by comma, e.g. the ratings {business_id: stars} or the blend weights of the hybrid module
+        pairs = lambda key: None if key not in params else {k: float(v) for k, _, v in (item.rpartition(':') for item in get(key).split(','))}
+        return Request(module, user_id=get('user_id'), zipcode=get('zipcode'), city=get('city'), state=get('state'),
+                       max_distance=float(get('max_distance', 10)), cuisine=tags('cuisine'), style=tags('style'), price=get('price'),
+                       match=get('match', 'any'), original_score=get('original_score', '0').lower() in ('1', 'true', 'yes'),
+                       n=int(get('n', 10)), ratings=pairs('ratings'), weights=pairs('weights'))
+
+    def counters(self):
+        """Return the request, batch, reload and cache counters in the Prometheus text format"""
+        engine = self.engine
+        lines = ['# TYPE recommender_requests_total counter', 'recommender_requests_total {}'.format(self.served),
+                 '# TYPE recommender_batches_total counter']
+        lines += ['recommender_batches_total{{module="{}"}} {}'.format(m, b.batches) for m, b in self.batchers.items()]
+        lines += ['# TYPE recommender_reloads_total counter', 'recommender_reloads_total{{outcome="ok"}} {}'.format(self.reloader.reloads),
+                  'recommender_reloads_total{{outcome="failed"}} {}'.format(self.reloader.failures)]
+        if engine.cache is not None:
+            lines.append('# TYPE recommender_cache_total counter')
+            lines += ['recommender_cache_total{{event="{}"}} {}'.format(k, v) for k, v in sorted(engine.cache.stats().items())
+                      if k in ('hits', 'misses', 'evictions')]
+        return '\n'.join(lines) + '\n'
+
+    async def dispatch(self, method, target):
+        """Answer one HTTP request, return a tuple (status code, JSON-serializable body or plain text)"""
+        url = urlsplit(target)
+        path = url.path.rstrip('/')
+        if method != 'GET':
+            return 405, {'error': 'only GET is supported'}
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        engine = self.engine # the engine of the whole request, even if a new one is swapped in meanwhile
+        if path == '/stats':
+            return 200, {'served': self.served, 'uptime': time.time() - self.started,
+                         'batches': {m: {'batches': b.batches, 'requests': b.requests} for m, b in self.batchers.items()},
+                         'cache': engine.cache.stats() if engine.cache is not None else None,
+                         'version': self.reloader.version, 'reloads': self.reloader.reloads, 'reload_failures': self.reloader.failures}
+        if path == '/metrics':
+            if self.registry is None:
+                return 404, {'error': 'metrics are disabled, start the service with --metrics'}
+            return 200, self.registry.prometheus() + self.counters()
+        if path not in ('/keyword', '/collaborative', '/content', '/hybrid'):
+            return 404, {'error': 'unknown endpoint {}'.format(path)}
+        try:
+            request = self.request(path[1:], parse_qs(url.query))
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        self.served += 1
+        loop = asyncio.get_event_loop()
+
+        if request.module != 'keyword':
+            if request.user_id is None:
+                return 400, {'error': "no user_id is provided!"}
+            if len(request.user_id) != 22:
+                return 400, {'error': "invalid user id!"}
+
+        # personalized requests without keyword filters are looked up in the materialized top k (--precomputed) or else micro-batched,
+        # all others are answered by Engine.recommend in a worker thread
+        result = engine.cached(request)
+        unfiltered = request.module in self.batchers and all(getattr(request, f) is None for f in self.filters)
+        if result is None and unfiltered:
+            result = engine.precomputed_result(request)
+            if result is not None:
+                engine.remember(result)
+        if result is None and unfiltered:
+            ids, scores = await self.batchers[request.module].submit(request.user_id, request.n)
+            if len(ids) > 0 and ids[0] is None: # content-based module, no personal data for the user_id
+                result = Result(request, np.array([], dtype=np.int64), ids[:0], scores[:0], 'similarity_score', None, 0, True,
+                                ("sorry, no personal data available for this user_id yet!",))
+            else:
+                messages = ()
+                if (request.module == 'collaborative' and request.user_id not in engine.svd_trained_info['userid_to_index']
+                        and engine.fold_in(request.user_id) is None):
+                    messages = ("sorry, no personal data available for this user_id yet!",
+                                "Here is the generic recommendation computed from all the users in our database:")
+                # only the top n are known, the result is cached as not exact so that the full ranked list is still computed on demand.
+                # A batch scored by an engine swapped in meanwhile may return restaurants unknown to the engine of the request, which are left out
+                positions = engine.business_pos.get_indexer(ids)
+                known = positions >= 0
+                result = Result(request, positions[known], ids[known], scores[known],
+                                'predicted_stars' if request.module == 'collaborative' else 'similarity_score', None, int(known.sum()), False, messages)
+            engine.remember(result)
+        elif result is None:
+            result = await loop.run_in_executor(self.executor, engine.recommend, request)
+
+        if result.total == 0:
+            return 404, {'error': ' '.join(result.messages)}
+        return 200, {'module': request.module, 'user_id': request.user_id, 'messages': list(result.messages), 'total': result.total,
+                     'recommendations': self.records(result.positions, result.scores, result.distance, engine=engine)}
+
+    async def handle(self, reader, writer):
+        """Serve the HTTP/1.1 requests of one connection, the connection is kept alive unless the client asks to close it"""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = header.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0)) > 0: # request bodies are not used, only drained
+                    await reader.readexactly(int(headers['content-length']))
+                try:
+                    status, body = await self.dispatch(method, target)
+                except Exception as e:
+                    status, body = 500, {'error': repr(e)}
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                text = isinstance(body, str)
+                payload = (body if text else json.dumps(body)).encode()
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'
+                             .format(status, 'OK' if status == 200 else 'Error', 'text/plain; version=0.0.4' if text else 'application/json', len(payload), 'keep-alive' if keep_alive else 'close').encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def serve(self, host='127.0.0.1', port=8080, reuse_port=False):
+        """Run the service until interrupted, SIGHUP reloads the engine in the background (see reloader.py).
+        reuse_port: a boolean to indicate if other processes can listen on the same port, the connections are then spread among them (Linux)
+        """
+        loop = asyncio.get_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(self.handle, host, port, reuse_port=reuse_port or None))
+        if hasattr(signal, 'SIGHUP'):
+            loop.add_signal_handler(signal.SIGHUP, self.reloader.reload)
+        print("serving on http://{}:{}".format(host, port))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            self.executor.shutdown()
+
+def run(args, reuse_port=None):
+    """Load the engine and serve it with the command line arguments"""
+    print("loading the recommendation engine...")
+    registry = HistogramRegistry() if args.metrics else None
+    engine = Engine(personalized=True, artifact_dir=args.artifact_dir, ann=args.ann, precomputed=args.precomputed,
+                    tracer=Tracer([registry]) if registry is not None else None)
+    reloader = EngineReloader(engine)
+    if args.watch > 0:
+        reloader.watch(args.watch)
+    RecommenderService(reloader, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000.0, workers=args.workers,
+                       registry=registry).serve(args.host, args.port, reuse_port=reuse_port if reuse_port is not None else args.processes > 1)
+
+if __name__ == '__main__':
+    """Start the HTTP service."""
+
+    parser = argparse.ArgumentParser(description='Serve the hybrid recommendation engine over HTTP.')
+    parser.add_argument('--artifact-dir', type=str, default=None, help='The compiled artifact directory, csv and pickle files are used if omitted.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='The host to listen on.')
+    parser.add_argument('--port', type=int, default=8080, help='The port to listen on.')
+    parser.add_argument('--max-batch', type=int, default=64, help='The max number of personalized requests scored together.')
+    parser.add_argument('--max-wait-ms', type=float, default=5, help='The max time a personalized request waits for a batch to fill, in milliseconds.')
+    parser.add_argument('--workers', type=int, default=4, help='The number of scoring threads.')
+    parser.add_argument('--ann', action='store_true', help='Use the approximate indices for the unbatched personalized requests.')
+    parser.add_argument('--precomputed', action='store_true', help='Answer the unbatched personalized requests from the top k materialized by precompute.py.')
+    parser.add_argument('--metrics', action='store_true', help='Measure the stages of every request and expose their histograms on /metrics.')
+    parser.add_argument('--watch', type=float, default=0, help='Check the versioned artifact directory for a new version every WATCH seconds, 0 to disable.')
+    parser.add_argument('--processes', type=int, default=1, help='The number of server processes sharing the port and the memory-mapped artifacts.')
+    args = parser.parse_args()
+
+    # the other processes are started before any data is loaded, each of them loads its own engine over the same memory-mapped files
+    children = [multiprocessing.Process(target=run, args=(args, True), daemon=True) for _ in range(args.processes - 1)]
+    for child in children:
+        child.start()
+
+    run(args)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial index for the hybrid recommendation engine:
+radius queries over the restaurant coordinates of the 'business' dataset.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+EARTH_RADIUS_KM = 6371.009  # earth's mean radius in kilometers, same as used by great_circle_mile()
+KM_TO_MILE = 0.621371
+EARTH_RADIUS_MILE = EARTH_RADIUS_KM * KM_TO_MILE
+
+# vectorized version of the function great_circle_mile() in recommender.py
+def haversine_mile(lat1, lon1, lat2, lon2):
+    """
+    Compute geodesic distances (great-circle distance) between points on the globe given their coordinates in degrees.
+    Any of the arguments can be a scalar or a numpy array, the usual numpy broadcasting rules apply.
+    The function returns the distance(s) in miles.
+    Note: 1. Calculation uses the earth's mean radius of 6371.009 km, same as great_circle_mile(),
+    2. The central subtended angle is calculated by the haversine formula, which is numerically stable for small distances:
+    alpha = 2*sin-1*sqrt[sin^2((lat2-lat1)/2) + cos(lat1)*cos(lat2)*sin^2((lon2-lon1)/2)]
+    """
+
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2) # convert degrees to radians
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2)**2
+    alpha = 2*np.arcsin(np.sqrt(np.clip(a, 0, 1))) # alpha is in radians
+
+    return alpha * EARTH_RADIUS_MILE
+
+# spatial index class
+class SpatialIndex:
+
+    def __init__(self, latitude, longitude):
+        """build a spatial index over a list of coordinates (in degrees), e.g. the 'latitude' and 'longitude' columns of the 'business' dataset.
+        ---
+        The index is a BallTree with the haversine metric, so that a radius query only visits the tree nodes close to the location of interest.
+        Rows with missing coordinates are left out of the tree and never returned by a query.
+        Positions returned by .query_radius() refer to the order of the coordinates passed in, i.e. the row positions of the 'business' dataset.
+        """
+
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        self.size = len(self.latitude)
+        # keep track of the row positions with valid coordinates, as BallTree does not accept missing values
+        valid = ~(np.isnan(self.latitude) | np.isnan(self.longitude))
+        self._positions = np.flatnonzero(valid)
+        self._tree = BallTree(np.radians(np.column_stack([self.latitude[valid], self.longitude[valid]])), metric='haversine')
+
+    def query_radius(self, latitude, longitude, max_distance):
+        """Find all the points within max_distance (in miles) of the location of interest.
+        Return a tuple of two numpy arrays: the row positions of the matching points and their exact distances (in miles) to the location of interest.
+        """
+
+        # retrieve the candidates from the tree, the radius is padded slightly so that no boundary point is lost to rounding
+        radius = max_distance / EARTH_RADIUS_MILE
+        candidates = self._tree.query_radius(np.radians([[latitude, longitude]]), r=radius*(1 + 1e-9) + 1e-12)[0]
+        positions = self._positions[candidates]
+        # compute the exact distances for the candidates only and filter by the desired distance
+        distance = haversine_mile(self.latitude[positions], self.longitude[positions], latitude, longitude)
+        keep = distance <= max_distance
+
+        return positions[keep], distance[keep]
+
+    def distance_to(self, latitude, longitude, max_distance):
+        """Return a numpy array of length .size with the distance (in miles) of every point to the location of interest,
+        points further away than max_distance (or with missing coordinates) are set to NaN.
+        """
+
+        distance = np.full(self.size, np.nan)
+        positions, dist = self.query_radius(latitude, longitude, max_distance)
+        distance[positions] = dist
+
+        return distance
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic dataset generator for the hybrid recommendation engine:
+schema-compatible 'business_clean.csv', 'review_clean.csv', 'svd_trained_info.pkl', 'rest_pcafeature_all.pkl' and 'user_pcafeature_all.pkl'
+at any scale, so that the engine can be benchmarked (see benchmark.py) and tested without downloading the multi-GB Yelp files.
+
+The distributions follow the cleaned Yelp data: restaurants spread over the main metro areas of the dataset,
+cuisine and style tags drawn from the lists of data_wrangling.ipynb with a long tail (22.6% of the restaurants have no cuisine),
+heavy-tailed review counts (median 22), skewed user activity, and ratings generated by a biased matrix factorization model
+whose factors are saved as the trained model. The restaurant feature vectors are clustered by cuisine and the user feature vectors
+are the rating-weighted means of the vectors of the restaurants they rated, as in recommender_content.ipynb.
+
+Usage:
+    python synthetic.py bench_data/ [--businesses 20000] [--users 100000] [--reviews 1000000] [--factors 100] [--features 300] [--artifacts]
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import os
+import pickle
+import time
+import numpy as np
+import pandas as pd
+
+# metro areas of the Yelp dataset: city, state, latitude, longitude, postal code prefix, relative number of restaurants
+CITIES = [('Las Vegas', 'NV', 36.17, -115.14, '891', 20), ('Toronto', 'ON', 43.65, -79.38, 'M5V', 18), ('Phoenix', 'AZ', 33.45, -112.07, '850', 12),
+          ('Charlotte', 'NC', 35.23, -80.84, '282', 7), ('Montréal', 'QC', 45.50, -73.57, 'H2X', 7), ('Pittsburgh', 'PA', 40.44, -79.99, '152', 6),
+          ('Scottsdale', 'AZ', 33.49, -111.93, '852', 4), ('Calgary', 'AB', 51.05, -114.07, 'T2P', 5), ('Cleveland', 'OH', 41.50, -81.69, '441', 3),
+          ('Mesa', 'AZ', 33.42, -111.83, '852', 3), ('Henderson', 'NV', 36.04, -114.98, '890', 3), ('Tempe', 'AZ', 33.43, -111.94, '852', 3),
+          ('Madison', 'WI', 43.07, -89.40, '537', 3), ('Champaign', 'IL', 40.12, -88.24, '618', 1)]
+# cuisine and style tags of data_wrangling.ipynb, most frequent first
+CUISINES = ['american (traditional)', 'pizza', 'mexican', 'sandwiches', 'american (new)', 'burgers', 'italian', 'chinese', 'coffee & tea',
+            'japanese', 'chicken wings', 'seafood', 'sushi bars', 'salad', 'asian fusion', 'mediterranean', 'desserts', 'steakhouse', 'barbeque',
+            'thai', 'bakeries', 'indian', 'vietnamese', 'specialty food', 'middle eastern', 'vegetarian', 'greek', 'korean', 'french', 'tacos',
+            'ice cream & frozen yogurt', 'tex-mex', 'southern', 'gluten-free', 'hot dogs', 'vegan', 'soup', 'beer', 'wine & spirits', 'latin american',
+            'bagels', 'donuts', 'hawaiian', 'tapas/small plates', 'cajun', 'bubble tea', 'local flavor', 'cupcakes', 'custom cakes', 'shaved ice',
+            'ethinic food']
+STYLES = ['restaurants', 'fast food', 'nightlife', 'bars', 'breakfast & brunch', 'cafes', 'delis', 'sports bars', 'pubs', 'caterers', 'food trucks',
+          'buffets', 'diners', 'cocktail bars', 'wine bars', 'lounges', 'juice bars & smoothies', 'food delivery services', 'beer bars', 'dive bars',
+          'breweries', 'casinos', 'music venues', 'food stands', 'dance clubs', 'street vendors', 'performing arts']
+WORDS = ['good', 'great', 'food', 'place', 'service', 'order', 'time', 'friendly', 'staff', 'delicious', 'menu', 'love', 'best', 'nice', 'restaurant',
+         'fresh', 'wait', 'back', 'amazing', 'price', 'bad', 'table', 'meal', 'lunch', 'dinner', 'taste', 'slow', 'recommend', 'atmosphere', 'bit']
+STAR_SHARES = [0.14, 0.08, 0.11, 0.23, 0.44] # share of the reviews of 1 to 5 stars
+ID_CHARS = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'))
+
+def random_ids(rng, n):
+    """Return n random 22-character ids in the alphabet of the Yelp ids"""
+    return np.ascontiguousarray(ID_CHARS[rng.randint(0, len(ID_CHARS), (n, 22))]).view('<U22').ravel().astype(object)
+
+def random_tags(rng, n, tags, counts, exponent):
+    """Return n comma-separated lists of tags, the number of tags follows the probabilities 'counts' (0, 1, 2, ... tags)
+    and the tags a Zipf law of the given exponent over their frequency rank, NaN if no tag
+    """
+    weights = 1.0 / np.arange(1, len(tags) + 1) ** exponent
+    k = rng.choice(len(counts), n, p=counts)
+    draws = rng.choice(len(tags), (n, len(counts) - 1), p=weights / weights.sum())
+    out = np.full(n, np.nan, dtype=object)
+    for i in np.flatnonzero(k > 0):
+        out[i] = ', '.join(tags[j] for j in dict.fromkeys(draws[i, :k[i]]))
+    return out
+
+def generate_business(rng, n):
+    """Return a synthetic 'business' dataset of n restaurants"""
+    share = np.array([c[5] for c in CITIES], dtype=float)
+    city = rng.choice(len(CITIES), n, p=share / share.sum())
+    pick = lambda j: np.array([c[j] for c in CITIES], dtype=object)[city]
+    canadian = np.isin(pick(1), ['ON', 'QC', 'AB'])
+    postal_code = np.where(canadian,
+                           pick(4) + ' ' + rng.randint(0, 10, n).astype(str) + ID_CHARS[rng.randint(0, 26, n)] + rng.randint(0, 10, n).astype(str),
+                           pick(4) + np.char.zfill(rng.randint(0, 100, n).astype(str), 2).astype(object))
+    review_count = np.maximum(3, np.round(np.exp(rng.normal(np.log(22), 1.3, n)))).astype(int)
+    quality = rng.normal(0, 0.45, n) # item bias of the rating model, also drives the star rating
+    stars = np.clip(np.round((3.6 + quality + rng.normal(0, 0.25, n)) * 2) / 2, 1, 5)
+    business = pd.DataFrame({'business_id': random_ids(rng, n), 'name': ['Restaurant {}'.format(i) for i in range(n)],
+                             'address': ['{} {} St'.format(rng.randint(1, 9999), WORDS[i % len(WORDS)].title()) for i in range(n)],
+                             'city': pick(0), 'state': pick(1), 'postal_code': postal_code,
+                             'latitude': pick(2).astype(float) + rng.normal(0, 0.08, n), 'longitude': pick(3).astype(float) + rng.normal(0, 0.08, n),
+                             'stars': stars, 'review_count': review_count, 'is_open': (rng.rand(n) < 0.75).astype(int),
+                             'attributes.RestaurantsPriceRange2': rng.choice([1.0, 2.0, 3.0, 4.0, np.nan], n, p=[0.38, 0.47, 0.07, 0.02, 0.06]),
+                             'cuisine': random_tags(rng, n, CUISINES, [0.226, 0.55, 0.18, 0.044], 0.9),
+                             'style': random_tags(rng, n, STYLES, [0.1, 0.6, 0.25, 0.05], 1.3)})
+    return business, quality
+
+def generate(out_dir, n_business=20000, n_users=100000, n_reviews=1000000, n_factors=100, n_features=300, text_words=8, seed=42, verbose=True):
+    """Write a synthetic dataset to out_dir, see the module docstring.
+    ---
+    n_business: the number of restaurants, 10% more businesses that are not restaurants are reviewed too, as in the Yelp data
+    n_users, n_reviews: the number of users and of reviews before the duplicated (user, business) pairs are dropped
+    n_factors, n_features: the dimensions of the matrix factorization and of the restaurant and user feature vectors
+    text_words: the number of words of each review text, 0 for empty texts
+    ---
+    return: a dictionary of the number of rows of each dataset
+    """
+    t0 = time.time()
+    rng = np.random.RandomState(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    business, quality = generate_business(rng, n_business)
+    business.to_csv(os.path.join(out_dir, 'business_clean.csv'), index=False)
+
+    # reviews: businesses are drawn by popularity (their review count) and users by a heavy-tailed activity
+    n_other = max(1, n_business // 10)
+    business_ids = np.concatenate([business.business_id.values, random_ids(rng, n_other)])
+    popularity = np.concatenate([business.review_count.values, np.full(n_other, 22)]).astype(float)
+    activity = rng.pareto(1.2, n_users) + 1
+    user_ids = random_ids(rng, n_users)
+    b = rng.choice(len(business_ids), n_reviews, p=popularity / popularity.sum())
+    u = rng.choice(n_users, n_reviews, p=activity / activity.sum())
+    pairs = np.unique(u.astype(np.int64) * len(business_ids) + b)
+    rng.shuffle(pairs)
+    u, b = pairs // len(business_ids), pairs % len(business_ids)
+
+    # ratings of a biased matrix factorization model, whose factors are saved as the trained model,
+    # cut into stars at the quantiles of the J-shaped rating distribution of the Yelp restaurant reviews
+    item_latent = rng.normal(0, 0.15, (len(business_ids), n_factors)) / np.sqrt(n_factors) * 4
+    user_latent = rng.normal(0, 0.15, (n_users, n_factors)) / np.sqrt(n_factors) * 4
+    item_bias = np.concatenate([quality, rng.normal(0, 0.45, n_other)])
+    user_bias = rng.normal(0, 0.35, n_users)
+    rating = user_bias[u] + item_bias[b] + np.einsum('ij,ij->i', user_latent[u], item_latent[b]) + rng.normal(0, 1.0, len(u))
+    stars = 1 + np.searchsorted(np.quantile(rating, np.cumsum(STAR_SHARES)[:-1]), rating)
+    mean_rating = float(stars.mean())
+    if text_words > 0:
+        primary = business.cuisine.fillna('food').str.split(', ').str[0].values
+        primary = np.concatenate([primary, np.full(n_other, 'shop', dtype=object)])
+        words = np.array(WORDS, dtype=object)[rng.randint(0, len(WORDS), (len(u), text_words))]
+        text = [' '.join(w) + ' ' + c for w, c in zip(words.tolist(), primary[b].tolist())]
+    else:
+        text = ''
+    days = rng.randint(0, 14 * 365, len(u))
+    review = pd.DataFrame({'review_id': random_ids(rng, len(u)), 'user_id': user_ids[u], 'business_id': business_ids[b], 'stars': stars,
+                           'date': (np.datetime64('2005-01-01') + days.astype('timedelta64[D]')).astype(str), 'text': text,
+                           'useful': rng.poisson(1.0, len(u)), 'funny': rng.poisson(0.4, len(u)), 'cool': rng.poisson(0.5, len(u))})
+    review.to_csv(os.path.join(out_dir, 'review_clean.csv'), index=False)
+
+    # the trained model covers the reviewed users and businesses, in order of first appearance
+    users, user_rows = np.unique(u, return_index=True)
+    users = users[np.argsort(user_rows)]
+    items, item_rows = np.unique(b, return_index=True)
+    items = items[np.argsort(item_rows)]
+    svd_trained_info = {'user_latent': user_latent[users], 'item_latent': item_latent[items], 'user_bias': user_bias[users],
+                        'item_bias': item_bias[items], 'mean_rating': mean_rating,
+                        'userid_to_index': {k: i for i, k in enumerate(user_ids[users].tolist())},
+                        'itemid_to_index': {k: i for i, k in enumerate(business_ids[items].tolist())}}
+    with open(os.path.join(out_dir, 'svd_trained_info.pkl'), 'wb') as f:
+        pickle.dump(svd_trained_info, f, protocol=4)
+    svd_trained_info = None
+
+    # restaurant feature vectors clustered by primary cuisine, for the reviewed restaurants
+    reviewed = np.unique(b[b < n_business])
+    cluster = pd.factorize(business.cuisine.fillna('').str.split(', ').str[0].values)[0]
+    centroids = rng.normal(0, 1, (cluster.max() + 1, n_features))
+    rest_values = centroids[cluster[reviewed]] + rng.normal(0, 1.5, (len(reviewed), n_features))
+    rest_values /= np.sqrt((rest_values * rest_values).sum(axis=1))[:, None]
+    columns = [str(i) for i in range(1, n_features + 1)]
+    rest_pcafeature = pd.DataFrame(rest_values, index=pd.Index(business.business_id.values[reviewed], name='business_id'), columns=columns)
+    with open(os.path.join(out_dir, 'rest_pcafeature_all.pkl'), 'wb') as f:
+        pickle.dump(rest_pcafeature, f, protocol=4)
+
+    # user feature vectors: the rating-weighted mean of the vectors of the rated restaurants, rescaled to the unit length
+    from scipy import sparse
+    keep = b < n_business
+    row_of_business = np.full(n_business, -1)
+    row_of_business[reviewed] = np.arange(len(reviewed))
+    rated, user_codes = np.unique(u[keep], return_inverse=True)
+    ratings = sparse.csr_matrix((stars[keep].astype(float), (user_codes, row_of_business[b[keep]])), shape=(len(rated), len(reviewed)))
+    user_values = np.asarray(ratings.dot(rest_values), dtype=np.float32)
+    user_values /= np.maximum(np.sqrt((user_values * user_values).sum(axis=1)), 1e-12)[:, None]
+    user_pcafeature = pd.DataFrame(user_values, index=pd.Index(user_ids[rated], name='user_id'), columns=columns)
+    with open(os.path.join(out_dir, 'user_pcafeature_all.pkl'), 'wb') as f:
+        pickle.dump(user_pcafeature, f, protocol=4)
+
+    sizes = {'business': len(business), 'review': len(review), 'users': len(users), 'user_pcafeature': len(user_pcafeature)}
+    if verbose:
+        print("synthetic dataset of {} restaurants, {} reviews by {} users written to {} in {:.1f}s"
+              .format(sizes['business'], sizes['review'], sizes['users'], out_dir, time.time() - t0))
+    return sizes
+
+if __name__ == '__main__':
+    """Generate a synthetic dataset, and optionally compile it into a binary artifact directory."""
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic dataset with the schema of the cleaned Yelp files and the trained models.')
+    parser.add_argument('out_dir', type=str, help='The directory to write the csv and pickle files to.')
+    parser.add_argument('--businesses', type=int, default=20000, help='The number of restaurants.')
+    parser.add_argument('--users', type=int, default=100000, help='The number of users.')
+    parser.add_argument('--reviews', type=int, default=1000000, help='The number of reviews (before dropping duplicated user and business pairs).')
+    parser.add_argument('--factors', type=int, default=100, help='The number of latent factors of the matrix factorization.')
+    parser.add_argument('--features', type=int, default=300, help='The dimension of the restaurant and user feature vectors.')
+    parser.add_argument('--text-words', type=int, default=8, help='The number of words of each review text, 0 for empty texts.')
+    parser.add_argument('--seed', type=int, default=42, help='The random seed.')
+    parser.add_argument('--artifacts', action='store_true', help='Also compile the dataset into out_dir/artifacts, see artifacts.py.')
+    args = parser.parse_args()
+
+    generate(args.out_dir, n_business=args.businesses, n_users=args.users, n_reviews=args.reviews, n_factors=args.factors,
+             n_features=args.features, text_words=args.text_words, seed=args.seed)
+    if args.artifacts:
+        from artifacts import compile_artifacts
+        p = lambda name: os.path.join(args.out_dir, name)
+        compile_artifacts(p('artifacts'), business=p('business_clean.csv'), review=p('review_clean.csv'), svd=p('svd_trained_info.pkl'),
+                          rest_feature=p('rest_pcafeature_all.pkl'), user_feature=p('user_pcafeature_all.pkl'), text_projector=None)
+        print("artifacts written to {}".format(p('artifacts')))
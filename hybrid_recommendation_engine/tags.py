@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Inverted tag index for the hybrid recommendation engine:
+boolean masks over the comma-separated 'cuisine' and 'style' columns of the 'business' dataset.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import numpy as np
+
+# inverted index class
+class TagIndex:
+
+    def __init__(self, column):
+        """build an inverted index over a column of comma-separated tags, e.g. the 'cuisine' column of the 'business' dataset.
+        ---
+        Each tag is mapped to a numpy boolean mask over the rows of the column, so that filtering by tags becomes mask operations.
+        Missing values have no tags. The tags are stripped of the spaces around them, as the dataset joins them with ', ',
+        and are otherwise matched exactly as they are written in the column.
+        """
+
+        self.size = len(column)
+        rows, tags = [], []
+        for i, entry in enumerate(column):
+            if isinstance(entry, str):
+                for tag in entry.split(','):
+                    if tag.strip() != '':
+                        rows.append(i)
+                        tags.append(tag.strip())
+        # assign each distinct tag an integer code and fill one mask per tag
+        self.tags, codes = np.unique(np.array(tags, dtype=object).astype(str), return_inverse=True)
+        self._masks = np.zeros((len(self.tags), self.size), dtype=bool)
+        self._masks[codes.ravel(), np.array(rows, dtype=np.int64)] = True
+        self._code = {tag: code for code, tag in enumerate(self.tags)}
+
+    def mask(self, tags, match='any'):
+        """Return the boolean mask of the rows tagged with the tag(s) of interest.
+        ---
+        tags: a single tag or a list of tags, stripped of the spaces around them
+        match: 'any' to match rows with at least one of the tags (OR), 'all' to match rows with every tag (AND)
+        """
+
+        if isinstance(tags, str):
+            tags = [tags]
+        tags = [tag.strip() for tag in tags]
+        if match not in ('any', 'all'):
+            raise ValueError("match must be either 'any' or 'all', got {}".format(match))
+        masks = [self._masks[self._code[tag]] if tag in self._code else np.zeros(self.size, dtype=bool) for tag in tags]
+        if len(masks) == 0:
+            return np.ones(self.size, dtype=bool)
+        if match == 'any':
+            return np.logical_or.reduce(masks)
+        return np.logical_and.reduce(masks)
+
+    def count(self, tag):
+        """Return the number of rows tagged with the tag of interest"""
+        tag = tag.strip()
+        return int(self._masks[self._code[tag]].sum()) if tag in self._code else 0
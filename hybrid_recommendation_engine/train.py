@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Matrix factorization trainer of the collaborative module of the hybrid recommendation engine:
+the biased model of the notebooks, rating = mean + b_u + b_i + p_u.q_i, is fitted by blocked alternating least squares (ALS)
+on all cores, and written as the 'svd_trained_info' dictionary consumed by the engine (and optionally into an artifact directory).
+Into a versioned artifact directory, the model is written into a new version (a copy of the current one) which is then published,
+so that the servers watching the directory reload it (see reloader.py).
+
+The ratings are indexed twice as CSR matrices (see interactions.InteractionIndex), by user and by restaurant. Each half epoch
+solves the regularized least squares problem of every user (resp. restaurant) with the restaurant (resp. user) factors fixed,
+the same problem as Engine.fold_in: min sum (r - mean - b_i - b_u - q_i.p_u)^2 + reg * n_u * (|p_u|^2 + b_u^2).
+Users are grouped into blocks of similar rating counts, padded into dense arrays and solved by one batched matrix product and
+one batched linear solve per block, the blocks being spread over a thread pool (numpy releases the GIL in both).
+Training stops early when the RMSE on a validation split stops improving.
+
+Usage:
+    python train.py review_clean.csv [--business business_clean.csv] [--factors 10] [--reg 0.5] [--epochs 20] [--n-jobs 4] [--out svd_trained_info.pkl] [--artifact-dir artifacts]
+    python train.py review_clean.csv --benchmark    (training throughput for 1 to n-jobs threads)
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import argparse
+import json
+import os
+import pickle
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from interactions import InteractionIndex
+from artifacts import compact_review, read_review, write_collaborative, remove_derived, current_version, new_version_dir, publish
+from evaluate import RATING_SCALE, split_holdout
+
+class RatingMatrix:
+
+    def __init__(self, review):
+        """index the ratings of a review dataframe ('user_id', 'business_id', 'stars') by user and by restaurant.
+        ---
+        .users and .items are the pd.Index of the user_ids and business_ids, in the order of the rows of the factor matrices,
+        .by_user and .by_item the InteractionIndex CSR matrices, the last rating of a duplicated (user, restaurant) pair is kept.
+        """
+        item, self.items = pd.factorize(review.business_id.to_numpy(dtype=object))
+        self.items = pd.Index(np.asarray(self.items, dtype=object), dtype=object)
+        keep = item >= 0 # the reviews of the restaurants missing from the catalog have no business_id
+        item, user_ids, stars = item[keep], review.user_id.to_numpy(dtype=object)[keep], review.stars.to_numpy(dtype=float)[keep]
+        self.by_user = InteractionIndex(user_ids, item, len(self.items), stars)
+        self.users = self.by_user.users
+        user = self.users.get_indexer(user_ids)
+        self.by_item = InteractionIndex(pd.Categorical.from_codes(item, categories=self.items), user, len(self.users), stars)
+        self.mean = float(self.by_user.values.mean())
+
+    def __len__(self):
+        return len(self.by_user.values)
+
+def _blocks(count, cells):
+    """Split the rows into blocks of rows of similar counts, padded to at most 'cells' entries each (rows x the largest count)"""
+    order = np.argsort(count, kind='stable')
+    count = np.maximum(count[order], 1)
+    blocks, start = [], 0
+    while start < len(order):
+        stop = min(len(order), start + max(1, cells // count[start]))
+        while stop > start + 1 and (stop - start) * count[stop-1] > cells: # the counts increase along the block
+            stop = start + max(1, cells // count[stop-1])
+        blocks.append(order[start:stop])
+        start = stop
+    return blocks
+
+def _solve_block(rows, index, fixed_vec, fixed_b, mean, reg):
+    """Return the [vector, bias] of the rows of a block of a CSR index solving their regularized least squares problems,
+    with the factors of the other side fixed. The ratings of the rows are padded into dense arrays, padded entries are zero.
+    """
+    start, count = index.indptr[rows], index.indptr[rows+1] - index.indptr[rows]
+    offset = np.arange(count.max())
+    mask = offset[None, :] < count[:, None]
+    flat = np.where(mask, start[:, None] + offset[None, :], 0)
+    other = index.indices[flat]
+    x = np.concatenate([fixed_vec[other], np.ones(other.shape + (1,))], axis=2) * mask[:, :, None]
+    y = (index.values[flat] - mean - fixed_b[other]) * mask
+    xt = x.transpose(0, 2, 1)
+    a = np.matmul(xt, x)
+    diag = np.arange(a.shape[1])
+    a[:, diag, diag] += reg * np.maximum(count, 1)[:, None]
+    return np.linalg.solve(a, np.matmul(xt, y[:, :, None]))[:, :, 0]
+
+def _half_epoch(index, blocks, vec, b, fixed_vec, fixed_b, mean, reg, pool):
+    """Update the factors (vec, b) of every row of the index in place, block by block"""
+    def solve(rows):
+        w = _solve_block(rows, index, fixed_vec, fixed_b, mean, reg)
+        vec[rows], b[rows] = w[:, :-1], w[:, -1] # the blocks are disjoint, the threads write different rows
+    list(pool.map(solve, blocks)) if pool is not None else [solve(rows) for rows in blocks]
+
+def rmse(model, user, item, stars):
+    """Return the RMSE of the predicted ratings (clipped to the rating scale) of the (user row, item row) pairs, -1 for unknown rows"""
+    known = (user >= 0) & (item >= 0)
+    u, i = np.maximum(user, 0), np.maximum(item, 0)
+    pred = model['mean_rating'] + np.where(user >= 0, model['user_bias'][u], 0) + np.where(item >= 0, model['item_bias'][i], 0)
+    pred += np.where(known, np.einsum('ij,ij->i', model['user_latent'][u], model['item_latent'][i]), 0)
+    error = np.clip(pred, *RATING_SCALE) - stars
+    return float(np.sqrt(np.dot(error, error) / max(len(error), 1)))
+
+def train(review, n_factors=10, reg=0.5, n_epochs=20, validation=0.05, patience=2, tol=1e-4, n_jobs=1, cells=2**15, seed=42, verbose=True):
+    """Fit the biased matrix factorization on the ratings of a review dataframe by blocked ALS.
+    ---
+    n_factors: the number of latent factors (10 as the model tuned in the notebook)
+    reg: the regularization, weighted by the number of ratings of each user and restaurant (recorded in the version of the model,
+        the engine folds new users in with the same one)
+    n_epochs: the max number of epochs, one epoch solves all the users then all the restaurants
+    validation: the fraction of the ratings held out to stop early, 0 to train on all the ratings for n_epochs
+    patience, tol: training stops when the validation RMSE has not improved by tol for 'patience' epochs, the best epoch is kept
+    n_jobs: the number of threads solving the blocks
+    cells: the max number of padded ratings per block, small blocks stay in the CPU cache (memory use per thread is about cells x (n_factors+1) x 24 bytes)
+    ---
+    return: the 'svd_trained_info' dictionary (user_latent, item_latent, user_bias, item_bias, mean_rating, userid_to_index, itemid_to_index)
+        with a 'version' entry describing the training run
+    """
+    t0 = time.time()
+    train_set, valid_set = split_holdout(review, validation, seed) if validation > 0 else (review, review.iloc[:0])
+    ratings = RatingMatrix(train_set)
+    valid = (ratings.users.get_indexer(valid_set.user_id.to_numpy(dtype=object)), ratings.items.get_indexer(valid_set.business_id.to_numpy(dtype=object)),
+             valid_set.stars.to_numpy(dtype=float))
+    rng = np.random.RandomState(seed)
+    model = {'user_latent': np.zeros((len(ratings.users), n_factors)), 'user_bias': np.zeros(len(ratings.users)),
+             'item_latent': rng.normal(0, 0.1, (len(ratings.items), n_factors)), 'item_bias': np.zeros(len(ratings.items)),
+             'mean_rating': ratings.mean}
+    user_blocks = _blocks(np.diff(ratings.by_user.indptr), cells)
+    item_blocks = _blocks(np.diff(ratings.by_item.indptr), cells)
+    if verbose:
+        print("{} ratings of {} users and {} restaurants indexed in {:.1f}s, {} validation ratings"
+              .format(len(ratings), len(ratings.users), len(ratings.items), time.time() - t0, len(valid_set)))
+
+    best, history, epoch_seconds = None, [], []
+    pool = ThreadPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+    try:
+        for epoch in range(n_epochs):
+            t1 = time.time()
+            _half_epoch(ratings.by_user, user_blocks, model['user_latent'], model['user_bias'], model['item_latent'], model['item_bias'],
+                        ratings.mean, reg, pool)
+            _half_epoch(ratings.by_item, item_blocks, model['item_latent'], model['item_bias'], model['user_latent'], model['user_bias'],
+                        ratings.mean, reg, pool)
+            epoch_seconds.append(time.time() - t1)
+            score = rmse(model, *valid) if len(valid_set) else None
+            history.append(score)
+            if verbose:
+                print("epoch {}: {:.2f}s ({:.0f} ratings/s){}".format(epoch + 1, epoch_seconds[-1], len(ratings) / epoch_seconds[-1],
+                                                                       '' if score is None else ', validation RMSE {:.4f}'.format(score)))
+            if score is None:
+                continue
+            if best is None or score < best[0] - tol:
+                best = (score, epoch, {k: v.copy() for k, v in model.items() if isinstance(v, np.ndarray)})
+            elif epoch - best[1] >= patience:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if best is not None:
+        model.update(best[2])
+
+    model['userid_to_index'] = {u: i for i, u in enumerate(ratings.users.tolist())}
+    model['itemid_to_index'] = {b: i for i, b in enumerate(ratings.items.tolist())}
+    model['version'] = {'id': time.strftime('%Y%m%dT%H%M%S'), 'algorithm': 'als', 'n_factors': n_factors, 'reg': reg, 'seed': seed,
+                        'epochs': len(history), 'best_epoch': (best[1] + 1) if best is not None else len(history),
+                        'validation_rmse': best[0] if best is not None else None, 'validation_history': history,
+                        'train_ratings': len(ratings), 'users': len(ratings.users), 'items': len(ratings.items),
+                        'n_jobs': n_jobs, 'seconds': time.time() - t0,
+                        'ratings_per_second': len(ratings) * len(epoch_seconds) / max(sum(epoch_seconds), 1e-9)}
+    return model
+
+def save_model(info, path):
+    """Save a trained model as a versioned pickle, '<name>.<version id>.pkl' with its version in '<name>.<version id>.json',
+    and point 'path' to it: 'path' is replaced atomically by a hard link to (or a copy of) the versioned file,
+    so that an engine loading 'path' never reads a partially written file. The previous versions are kept.
+    Return the path of the versioned file.
+    """
+    root, ext = os.path.splitext(path)
+    versioned = '{}.{}{}'.format(root, info['version']['id'], ext or '.pkl')
+    with open(versioned, 'wb') as f:
+        pickle.dump(info, f, protocol=4) # protocol 4 supports objects larger than 4GB
+    with open(os.path.splitext(versioned)[0] + '.json', 'w') as f:
+        json.dump(info['version'], f, indent=2)
+    temporary = path + '.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    try:
+        os.link(versioned, temporary)
+    except OSError: # no hard links on this file system
+        shutil.copyfile(versioned, temporary)
+    os.replace(temporary, path)
+    return versioned
+
+def benchmark(review, n_factors=10, reg=0.5, n_epochs=2, jobs=None):
+    """Print and return the training throughput (ratings per second per epoch) for 1 to os.cpu_count() threads"""
+    jobs = jobs if jobs is not None else sorted({1, 2, 4, os.cpu_count() or 1})
+    results = {}
+    for n_jobs in jobs:
+        info = train(review, n_factors=n_factors, reg=reg, n_epochs=n_epochs, validation=0, n_jobs=n_jobs, verbose=False)
+        results[n_jobs] = info['version']['ratings_per_second']
+        print("{} threads: {:.0f} ratings/s per epoch ({} factors)".format(n_jobs, results[n_jobs], n_factors))
+    return results
+
+if __name__ == '__main__':
+    """Train the matrix factorization of the collaborative module and write the model."""
+
+    parser = argparse.ArgumentParser(description='Train the matrix factorization of the collaborative module by blocked ALS.')
+    parser.add_argument('review', type=str, help='The cleaned review csv file.')
+    parser.add_argument('--business', type=str, default=None, help='The cleaned business csv file, only the ratings of its restaurants are used if passed.')
+    parser.add_argument('--factors', type=int, default=10, help='The number of latent factors.')
+    parser.add_argument('--reg', type=float, default=0.5, help='The regularization, weighted by the number of ratings.')
+    parser.add_argument('--epochs', type=int, default=20, help='The max number of epochs.')
+    parser.add_argument('--validation', type=float, default=0.05, help='The fraction of ratings held out for early stopping, 0 to disable.')
+    parser.add_argument('--patience', type=int, default=2, help='The number of epochs without improvement before stopping.')
+    parser.add_argument('--n-jobs', type=int, default=os.cpu_count(), help='The number of threads.')
+    parser.add_argument('--seed', type=int, default=42, help='The random seed of the initialization and of the validation split.')
+    parser.add_argument('--out', type=str, default='svd_trained_info.pkl', help='The model file to write (a versioned copy is kept beside it).')
+    parser.add_argument('--artifact-dir', type=str, default=None, help='An artifact directory to write the collaborative module into as well, as a new published version if versioned.')
+    parser.add_argument('--benchmark', action='store_true', help='Only measure the training throughput for 1 to n-jobs threads.')
+    args = parser.parse_args()
+
+    review = read_review(args.review)
+    if args.business is not None:
+        review = compact_review(review, pd.read_csv(args.business, usecols=['business_id']).business_id)
+    if args.benchmark:
+        benchmark(review, n_factors=args.factors, reg=args.reg, jobs=sorted({1, args.n_jobs}))
+    else:
+        info = train(review, n_factors=args.factors, reg=args.reg, n_epochs=args.epochs, validation=args.validation, patience=args.patience,
+                     n_jobs=args.n_jobs, seed=args.seed)
+        print("model {} written to {} ({})".format(info['version']['id'], args.out, save_model(info, args.out)))
+        if args.artifact_dir is not None:
+            # a versioned artifact directory is never written in place: the model goes into a copy of the current version, published once complete
+            versioned = current_version(args.artifact_dir) is not None
+            out_dir = new_version_dir(args.artifact_dir) if versioned else args.artifact_dir
+            manifest_path = os.path.join(out_dir, 'manifest.json')
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            manifest.update(write_collaborative(info, out_dir))
+            removed = remove_derived(out_dir, 'collaborative')
+            manifest['modules'] = sorted(set(manifest['modules']) | {'collaborative'})
+            with open(manifest_path + '.tmp', 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(manifest_path + '.tmp', manifest_path)
+            print("collaborative module written to {}".format(out_dir))
+            if len(removed) > 0:
+                print("{} computed from the previous model removed, rebuild them with ann.py and precompute.py if needed".format(', '.join(removed)))
+            if versioned:
+                publish(args.artifact_dir, os.path.basename(out_dir))
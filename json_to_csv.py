@@ -1,11 +1,30 @@
 # -- coding: utf-8 --
-"""Convert the Yelp Dataset Challenge dataset from json format to csv.
+"""Convert the Yelp Dataset Challenge dataset from json format to csv, parquet or feather.
 For more information on the Yelp Dataset Challenge please visit http://yelp.com/dataset_challenge
+
+The json file is read once: the column names are discovered from a sample of the first lines (or given by an explicit schema),
+then the file is split into line-aligned chunks which are parsed in a process pool and written out in order,
+as csv rows or as parquet/feather row groups (requires pyarrow).
+
+Usage:
+    python json_to_csv.py dataset/review.json                      # writes dataset/review.csv
+    python json_to_csv.py dataset/review.json --format parquet     # writes dataset/review.parquet
+    python json_to_csv.py dataset/business.json --sample-lines 0   # discover the columns from the whole file
+    python json_to_csv.py dataset/review.json --legacy             # the original two-pass single-core converter, for comparison
 """
 import argparse
 import collections
 import csv
+import io
 import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from collections.abc import MutableMapping
+except ImportError: # python < 3.3
+    from collections import MutableMapping
 
 def read_and_write_file(json_file_path, csv_file_path, column_names):
     """Read in the json dataset file and write it out to a csv file, given the column names."""
@@ -30,7 +49,7 @@ def get_superset_of_column_names_from_file(json_file_path):
     return column_names
 
 def get_column_names(line_contents, parent_key=''):
-    
+
     """Return a list of flattened key names given a dict.
     Example:
         line_contents = {
@@ -45,7 +64,7 @@ def get_column_names(line_contents, parent_key=''):
     column_names = []
     for k, v in line_contents.items():
         column_name = "{0}.{1}".format(parent_key, k) if parent_key else k
-        if isinstance(v, collections.MutableMapping):
+        if isinstance(v, MutableMapping):
             # if parent key is not in the column_names, add parent key,value pair first
             if column_name not in column_names:
                 column_names.append((column_name,v))
@@ -101,11 +120,198 @@ def get_row(line_contents, column_names):
             row.append('')
     return row
 
+#------------------------------------------------------------
+# single-pass streaming converter
+def get_chunks(json_file_path, chunk_bytes):
+    """Return the (start, end) byte ranges of the chunks of a file, a chunk holds the lines starting within its range."""
+    size = os.path.getsize(json_file_path)
+    return [(start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)]
+
+def read_chunk(json_file_path, start, end):
+    """Return the json lines of the file starting within the byte range [start, end)."""
+    with open(json_file_path, 'rb') as fin:
+        if start > 0:
+            fin.seek(start - 1)
+            fin.readline() # skip the line started in the previous chunk
+        position = fin.tell()
+        if position >= end:
+            return []
+        data = fin.read(end - position)
+        if not data.endswith(b'\n'):
+            data += fin.readline() # complete the last line started in this chunk
+    return [line for line in data.splitlines() if line.strip()]
+
+def merge_column_names(column_names, line_contents):
+    """Add the flattened key names of a dict to an ordered dictionary of column names, in the order of first appearance."""
+    for column_name in get_column_names(line_contents):
+        column_names.setdefault(column_name, None)
+
+def get_column_names_from_chunk(args):
+    """Return the ordered column names of the lines of a chunk."""
+    json_file_path, start, end = args
+    column_names = collections.OrderedDict()
+    for line in read_chunk(json_file_path, start, end):
+        merge_column_names(column_names, json.loads(line))
+    return list(column_names)
+
+def discover_column_names(json_file_path, sample_lines=10000, workers=None, chunk_bytes=32*2**20):
+    """Return the column names of the json dataset file, in the order of first appearance.
+    Only the first sample_lines lines are read, the whole file is scanned in the process pool if sample_lines is 0.
+    """
+    column_names = collections.OrderedDict()
+    if sample_lines > 0:
+        with open(json_file_path, 'rb') as fin:
+            for i, line in enumerate(fin):
+                if i >= sample_lines:
+                    break
+                if line.strip():
+                    merge_column_names(column_names, json.loads(line))
+        return list(column_names)
+    chunks = [(json_file_path, start, end) for start, end in get_chunks(json_file_path, chunk_bytes)]
+    if (workers or os.cpu_count() or 1) == 1:
+        results = list(map(get_column_names_from_chunk, chunks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(get_column_names_from_chunk, chunks))
+    for names in results:
+        column_names.update((name, None) for name in names)
+    return list(column_names)
+
+def compile_accessors(column_names):
+    """Return one accessor function per flattened column name, each returning the nested value of a dict or None.
+    The flattened keys are split once here instead of for every cell.
+    """
+    def accessor(path):
+        if len(path) == 1:
+            key = path[0]
+            return lambda d: d.get(key)
+        def get(d):
+            for key in path:
+                if not isinstance(d, dict):
+                    return None
+                d = d.get(key)
+            return d
+        return get
+    return [accessor(tuple(column_name.split('.'))) for column_name in column_names]
+
+def infer_types(json_file_path, column_names, sample_lines=10000):
+    """Return the arrow type name ('bool', 'int64', 'float64' or 'string') of each column, inferred from a sample of the first lines.
+    Nested dictionaries, lists and columns of mixed types are stored as strings, formatted the same way as in the csv output.
+    """
+    seen = [set() for _ in column_names]
+    accessors = compile_accessors(column_names)
+    with open(json_file_path, 'rb') as fin:
+        for i, line in enumerate(fin):
+            if i >= max(sample_lines, 1000):
+                break
+            if line.strip():
+                line_contents = json.loads(line)
+                for kinds, get in zip(seen, accessors):
+                    value = get(line_contents)
+                    if value is not None:
+                        kinds.add(type(value))
+    types = []
+    for kinds in seen:
+        if kinds == {bool}:
+            types.append('bool')
+        elif kinds == {int}:
+            types.append('int64')
+        elif kinds and kinds <= {int, float}:
+            types.append('float64')
+        else:
+            types.append('string')
+    return types
+
+def load_schema(schema_path):
+    """Return the (column names, types) of an explicit schema file: a json list of column names,
+    or a json object mapping each column name to its type ('bool', 'int64', 'float64' or 'string', null to infer).
+    """
+    with open(schema_path) as fin:
+        schema = json.load(fin, object_pairs_hook=collections.OrderedDict)
+    if isinstance(schema, list):
+        return schema, [None] * len(schema)
+    return list(schema.keys()), list(schema.values())
+
+def convert_chunk(args):
+    """Parse the lines of a chunk and return them as csv text, or as an arrow record batch for the columnar formats."""
+    json_file_path, start, end, column_names, types, output_format = args
+    accessors = compile_accessors(column_names)
+    records = [json.loads(line) for line in read_chunk(json_file_path, start, end)]
+    if output_format == 'csv':
+        fout = io.StringIO()
+        csv_file = csv.writer(fout)
+        for line_contents in records:
+            row = [get(line_contents) for get in accessors]
+            csv_file.writerow(['' if value is None else '{0}'.format(value) for value in row])
+        return fout.getvalue(), len(records)
+
+    import pyarrow as pa
+    arrays = []
+    for column_name, get, kind in zip(column_names, accessors, types):
+        values = [get(line_contents) for line_contents in records]
+        if kind == 'string':
+            values = [None if value is None else '{0}'.format(value) for value in values]
+        try:
+            arrays.append(pa.array(values, type=pa.type_for_alias(kind)))
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            raise ValueError("column '{}' does not match the type {} inferred from the sample ({}), "
+                             "please pass an explicit --schema".format(column_name, kind, e))
+    return pa.RecordBatch.from_arrays(arrays, column_names), len(records)
+
+def convert_file(json_file_path, output_path, output_format='csv', column_names=None, types=None,
+                 sample_lines=10000, workers=None, chunk_bytes=32*2**20):
+    """Convert the json dataset file in a single pass, the chunks being parsed in a process pool and written out in order.
+    Return the number of records written.
+    """
+    if column_names is None:
+        column_names = discover_column_names(json_file_path, sample_lines, workers, chunk_bytes)
+    if output_format != 'csv' and (types is None or None in types):
+        inferred = infer_types(json_file_path, column_names, sample_lines)
+        types = inferred if types is None else [t if t is not None else i for t, i in zip(types, inferred)]
+
+    if output_format == 'csv':
+        fout = open(output_path, 'w', encoding='utf8', newline='')
+        csv.writer(fout).writerow(column_names)
+        write = lambda text: fout.write(text)
+    else:
+        import pyarrow as pa
+        schema = pa.schema([(column_name, pa.type_for_alias(kind)) for column_name, kind in zip(column_names, types)])
+        if output_format == 'parquet':
+            import pyarrow.parquet as pq
+            fout = pq.ParquetWriter(output_path, schema)
+            write = lambda batch: fout.write_table(pa.Table.from_batches([batch], schema)) # one row group per chunk
+        else: # feather (v2) is the arrow ipc file format, one record batch per chunk
+            fout = pa.ipc.new_file(output_path, schema)
+            write = lambda batch: fout.write_batch(batch)
+
+    # keep at most two chunks per worker in flight, so that memory use is bounded by the chunk size whatever the file size
+    n_records = 0
+    workers = workers or os.cpu_count() or 1
+    tasks = [(json_file_path, start, end, column_names, types, output_format) for start, end in get_chunks(json_file_path, chunk_bytes)]
+    try:
+        if workers == 1: # no process pool on a single core, the chunks would only be pickled back and forth
+            for task in tasks:
+                output, n = convert_chunk(task)
+                write(output)
+                n_records += n
+            return n_records
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = collections.deque(pool.submit(convert_chunk, task) for task in tasks[:2*workers])
+            for task in tasks[2*workers:] + [None] * len(futures):
+                output, n = futures.popleft().result()
+                write(output)
+                n_records += n
+                if task is not None:
+                    futures.append(pool.submit(convert_chunk, task))
+    finally:
+        fout.close()
+    return n_records
+
 if __name__ == '__main__':
-    """Convert a yelp dataset file from json to csv."""
+    """Convert a yelp dataset file from json to csv, parquet or feather."""
 
     parser = argparse.ArgumentParser(
-            description='Convert Yelp Dataset Challenge data from JSON format to CSV.',
+            description='Convert Yelp Dataset Challenge data from JSON format to CSV, Parquet or Feather.',
             )
 
     parser.add_argument(
@@ -113,11 +319,65 @@ if __name__ == '__main__':
             type=str,
             help='The json file to convert.',
             )
+    parser.add_argument(
+            '--format',
+            type=str,
+            default='csv',
+            choices=['csv', 'parquet', 'feather'],
+            help='The output format, default is csv.',
+            )
+    parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='The output file, default is the json file name with the extension of the output format.',
+            )
+    parser.add_argument(
+            '--schema',
+            type=str,
+            default=None,
+            help='A json file listing the column names (or mapping them to their types) instead of discovering them.',
+            )
+    parser.add_argument(
+            '--sample-lines',
+            type=int,
+            default=10000,
+            help='The number of lines the column names are discovered from, 0 to scan the whole file.',
+            )
+    parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='The number of worker processes, default is the number of cpus.',
+            )
+    parser.add_argument(
+            '--chunk-mb',
+            type=float,
+            default=32,
+            help='The size of the chunks parsed by the workers in MB.',
+            )
+    parser.add_argument(
+            '--legacy',
+            action='store_true',
+            help='Use the original two-pass single-core csv converter, e.g. to compare the throughput.',
+            )
 
     args = parser.parse_args()
 
     json_file = args.json_file
-    csv_file = '{0}.csv'.format(json_file.split('.json')[0])
+    output_format = 'csv' if args.legacy else args.format
+    output_file = args.output or '{0}.{1}'.format(json_file.split('.json')[0], output_format)
 
-    column_names = get_superset_of_column_names_from_file(json_file)
-    read_and_write_file(json_file, csv_file, column_names)
\ No newline at end of file
+    start = time.time()
+    if args.legacy:
+        column_names = get_superset_of_column_names_from_file(json_file)
+        read_and_write_file(json_file, output_file, column_names)
+        n_records = None
+    else:
+        column_names, types = load_schema(args.schema) if args.schema is not None else (None, None)
+        n_records = convert_file(json_file, output_file, output_format, column_names, types,
+                                 sample_lines=args.sample_lines, workers=args.workers, chunk_bytes=int(args.chunk_mb * 2**20))
+    elapsed = time.time() - start
+    size_mb = os.path.getsize(json_file) / 2**20
+    print('{0} converted to {1}{2} in {3:.1f}s: {4:.1f} MB of json, {5:.1f} MB/s'.format(
+            json_file, output_file, '' if n_records is None else ' ({0} records)'.format(n_records), elapsed, size_mb, size_mb / elapsed))
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+pytest configuration: the modules of the hybrid recommendation engine import each other by their flat names
+(e.g. 'from engine import Engine'), as when the scripts are run from their folder, so the folder is put on the import path.
+The fixtures compile a small synthetic dataset (see synthetic.py) into artifact directories shared by the tests.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hybrid_recommendation_engine'))
+
+from artifacts import compile_artifacts, new_version_dir, publish
+from engine import Engine
+from precompute import materialize
+from synthetic import generate
+
+@pytest.fixture(scope='session')
+def artifact_dir(tmp_path_factory):
+    """A small synthetic dataset compiled into an artifact directory, with the top 20 of every user materialized.
+    The directory is shared by the tests, which must not modify it (see versioned_root)
+    """
+    data = str(tmp_path_factory.mktemp('data'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate(data, n_business=300, n_users=400, n_reviews=6000, n_factors=8, n_features=16, text_words=0, verbose=False)
+        path = os.path.join(data, 'artifacts')
+        compile_artifacts(path, business=os.path.join(data, 'business_clean.csv'), review=os.path.join(data, 'review_clean.csv'),
+                          svd=os.path.join(data, 'svd_trained_info.pkl'), rest_feature=os.path.join(data, 'rest_pcafeature_all.pkl'),
+                          user_feature=os.path.join(data, 'user_pcafeature_all.pkl'), text_projector=None, gazetteer=None, verbose=False)
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=path)
+        for module in ['collaborative', 'content']:
+            materialize(engine, module, os.path.join(path, 'topk'), k=20, n_jobs=1, verbose=False)
+    return path
+
+@pytest.fixture
+def versioned_root(artifact_dir, tmp_path):
+    """A versioned artifact directory (see artifacts.py) whose current version is a copy of artifact_dir without the top k tables"""
+    root = str(tmp_path / 'models')
+    version = new_version_dir(root)
+    shutil.copytree(artifact_dir, version, dirs_exist_ok=True, ignore=shutil.ignore_patterns('topk'))
+    publish(root, os.path.basename(version))
+    return root
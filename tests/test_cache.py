@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+The bounded result cache (cache.py): LRU eviction within the memory budget, time to live and invalidation,
+and the cache keys of the requests of the engine.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import contextlib
+import io
+import numpy as np
+import pytest
+import cache
+from cache import ResultCache, value_nbytes
+from engine import Engine, Request
+
+class Clock:
+    """A replacement of the time module of cache.py whose monotonic clock is set by the test"""
+    def __init__(self):
+        self.now = 1000.0
+    def monotonic(self):
+        return self.now
+
+def entry(i):
+    """A cached value of 10 int32 positions and float scores, as cached by the engine"""
+    return (np.arange(10, dtype=np.int32) + i, np.ones(10))
+
+def test_least_recently_used_entries_are_evicted_beyond_the_budget():
+    size = value_nbytes(('key', 0)) + value_nbytes(entry(0))
+    results = ResultCache(maxbytes=3 * size, ttl=None)
+    for i in range(3):
+        results.put(('key', i), entry(i))
+    assert len(results) == 3 and results.nbytes == 3 * size
+    assert results.get(('key', 0))[0][0] == 0 # now the most recently used
+    results.put(('key', 3), entry(3))
+    # the least recently used entry is evicted, not the oldest one
+    assert results.get(('key', 1)) is None
+    assert all(results.get(('key', i)) is not None for i in [0, 2, 3])
+    assert results.nbytes == 3 * size and results.evictions == 1
+    # a value larger than the whole budget is not cached, and evicts nothing
+    results.put(('key', 4), (np.zeros(10**4),))
+    assert results.get(('key', 4)) is None and len(results) == 3
+    stats = results.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (4, 2, 1)
+
+def test_a_replaced_entry_is_counted_once():
+    results = ResultCache(maxbytes=2**20, ttl=None)
+    results.put('key', entry(0))
+    results.put('key', entry(1))
+    assert len(results) == 1 and results.nbytes == value_nbytes('key') + value_nbytes(entry(1))
+    assert results.get('key')[0][0] == 1
+
+def test_entries_expire_after_their_time_to_live(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, 'time', clock)
+    results = ResultCache(maxbytes=2**20, ttl=60)
+    results.put('key', entry(0))
+    clock.now += 59
+    assert results.get('key') is not None
+    clock.now += 2
+    assert results.get('key') is None
+    # the expired entry is dropped, with its bytes
+    assert len(results) == 0 and results.nbytes == 0
+
+def test_discard_and_invalidate():
+    results = ResultCache(maxbytes=2**20, ttl=None)
+    for i in range(3):
+        results.put(i, entry(i))
+    results.discard(0)
+    results.discard(5)
+    assert results.get(0) is None and len(results) == 2
+    results.invalidate()
+    assert len(results) == 0 and results.nbytes == 0 and results.stats()['invalidations'] == 1
+
+@pytest.fixture(scope='module')
+def engine(artifact_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Engine(personalized=True, geocoder=False, artifact_dir=artifact_dir)
+
+def test_cache_keys_of_equivalent_requests(engine):
+    key = engine._cache_key
+    located = Request('keyword', city='Las Vegas', state='NV', cuisine='pizza')
+    # the place names are normalized, and the parameters without effect are left out
+    assert key(located) == key(located._replace(city='  las   VEGAS', state='nv'))
+    assert key(Request('keyword', cuisine='pizza')) == key(Request('keyword', cuisine='pizza', max_distance=20))
+    assert key(Request('keyword')) == key(Request('keyword', match='all'))
+    assert key(Request('keyword', user_id='a')) == key(Request('keyword', user_id='b'))
+
+def test_cache_keys_of_different_requests(engine):
+    key = engine._cache_key
+    located = Request('keyword', city='Las Vegas', state='NV')
+    for changed in [located._replace(max_distance=20), located._replace(personalized=True), located._replace(original_score=True),
+                    located._replace(n=10), located._replace(cuisine='pizza'), located._replace(style='bars'), located._replace(price='1,2')]:
+        assert key(changed) != key(located)
+    assert key(Request('keyword', cuisine=['pizza', 'mexican'])) != key(Request('keyword', cuisine=['pizza', 'mexican'], match='all'))
+    user_id = engine.review_s.user_id.iloc[0]
+    content = Request('content', user_id=user_id)
+    assert key(content) != key(content._replace(user_id=engine.review_s.user_id.iloc[-1]))
+    assert key(content) != key(content._replace(module='collaborative'))
+    assert key(content._replace(within=engine.recommend(content))) is None
+
+def test_results_are_cached_until_invalidated(artifact_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=artifact_dir)
+    request = Request('keyword', city='Las Vegas', state='NV', n=5)
+    first = engine.recommend(request)
+    assert len(first.positions) == 5 and len(engine.cache) == 1
+    assert np.array_equal(engine.recommend(request).positions, first.positions) and engine.cache.hits == 1
+    engine.invalidate()
+    engine.recommend(request)
+    assert engine.cache.hits == 1 and engine.cache.misses == 2
+
+def test_results_without_recommendation_are_not_cached(artifact_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=artifact_dir)
+    # a personalized ranking without previous personalized result, and a place unknown to the catalog
+    for request in [Request('keyword', personalized=True), Request('keyword', zipcode='00000')]:
+        result = engine.recommend(request)
+        assert len(result.positions) == 0 and len(result.messages) > 0
+    assert len(engine.cache) == 0
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+The randomized principal components of the streaming feature builder (features.py) against the exact PCA of the term covariance matrix.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import numpy as np
+from scipy import sparse
+from features import principal_components
+
+def test_randomized_components_match_the_exact_pca():
+    # a sparse non-negative matrix of restaurants mixing sparse topics of decreasing weights, i.e. with a decaying spectrum
+    rng = np.random.RandomState(0)
+    topics = sparse.random(20, 200, density=0.1, random_state=rng, format='csr').multiply(0.7 ** np.arange(20)[:, None])
+    x = sparse.csr_matrix((rng.rand(1500, 20) < 0.2).astype(float)).dot(topics).tocsr()
+    mean, exact = principal_components(x, n_components=5, solver='covariance')
+    mean_r, randomized = principal_components(x, n_components=5, solver='randomized')
+    assert np.allclose(mean, mean_r)
+    # the same components (up to the orientation set by the largest loading), so the same projections
+    assert np.abs(np.abs((exact * randomized).sum(axis=1)) - 1).max() < 1e-3
+    project = lambda components: x.dot(components.T) - np.dot(components, mean)
+    assert np.allclose(project(exact), project(randomized), atol=1e-3)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+The fold-in of users into the trained matrix factorization (Engine.fold_in) against the ridge regression of their ratings
+solved as an augmented least squares problem, and the promotion of the folded-in users into the model (Engine.promote_users).
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+import pytest
+from engine import Engine, Request
+
+@pytest.fixture
+def engine(artifact_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=artifact_dir)
+    engine._load_collaborative()
+    return engine
+
+def ridge(engine, ratings, reg):
+    """The (latent vector, bias) minimizing sum (r - mean - b_i - b - q_i.p)^2 + reg * n * (|p|^2 + b^2) over the ratings {position: stars}
+    of the restaurants of the model, solved by least squares on the rows [q_i, 1] augmented with sqrt(reg * n) * I
+    """
+    info = engine.svd_trained_info
+    idx = engine._collab_item_of_pos[list(ratings.keys())]
+    stars = np.array(list(ratings.values()), dtype=float)[idx >= 0]
+    idx = idx[idx >= 0]
+    x = np.hstack([np.asarray(info['item_latent'][idx], dtype=float), np.ones((len(idx), 1))])
+    y = stars - info['mean_rating'] - np.asarray(info['item_bias'][idx], dtype=float)
+    x = np.vstack([x, np.sqrt(reg * len(idx)) * np.eye(x.shape[1])])
+    w = np.linalg.lstsq(x, np.concatenate([y, np.zeros(x.shape[1])]), rcond=None)[0]
+    return w[:-1], w[-1]
+
+def history(engine, user_id):
+    pos, stars = engine.interactions.ratings(user_id)
+    return dict(zip(pos.tolist(), stars.tolist()))
+
+def model_positions(engine, n):
+    """The positions in 'business' of n open restaurants of the model"""
+    pos = engine._collab_pos
+    return pos[engine._collab_item_of_pos[pos] >= 0][:n]
+
+def check(factors, expected):
+    assert np.allclose(factors[0], expected[0], atol=1e-8) and np.isclose(factors[1], expected[1], atol=1e-8)
+
+def test_fold_in_solves_the_ridge_regression_of_the_ratings(engine):
+    user_id = engine.review_s.user_id.iloc[0]
+    ratings = history(engine, user_id)
+    assert len(ratings) > 0
+    check(engine.fold_in(user_id), ridge(engine, ratings, engine.fold_in_reg))
+    # the fold-in is cached
+    assert engine.fold_ins.get(user_id) is not None
+
+def test_the_regularization_of_the_model_version_is_used(engine):
+    user_id = engine.review_s.user_id.iloc[0]
+    info = engine.svd_trained_info
+    engine.svd_trained_info = dict(info, version=dict(info.get('version') or {}, reg=0.5))
+    check(engine.fold_in(user_id), ridge(engine, history(engine, user_id), 0.5))
+
+def test_ratings_override_the_review_data(engine):
+    user_id = engine.review_s.user_id.iloc[0]
+    ratings = history(engine, user_id)
+    rated = next(iter(ratings))
+    new = [p for p in model_positions(engine, 50) if p not in ratings][0]
+    override = {engine._business_ids[rated]: 6 - ratings[rated], engine._business_ids[new]: 5, 'not a restaurant': 1}
+    ratings.update({rated: 6 - ratings[rated], new: 5})
+    check(engine.fold_in(user_id, override), ridge(engine, ratings, engine.fold_in_reg))
+    # the fold-in of passed ratings is not cached
+    assert engine.fold_ins.get(user_id) is None
+    # users without rating of a restaurant of the model have no personal data
+    assert engine.fold_in('a-user-without-reviews') is None
+    assert engine.fold_in('a-user-without-reviews', {'not a restaurant': 5}) is None
+
+def test_ingested_users_are_folded_in_and_promoted(engine):
+    user_id = 'a-user-without-reviews'
+    pos = model_positions(engine, engine.promote_min_ratings)
+    stars = [5, 4, 2, 1, 3][:len(pos)]
+    engine.ingest_reviews(pd.DataFrame({'user_id': user_id, 'business_id': engine._business_ids[pos], 'stars': stars}))
+    expected = ridge(engine, dict(zip(pos.tolist(), stars)), engine.fold_in_reg)
+    assert user_id not in engine.svd_trained_info['userid_to_index']
+    result = engine.recommend(Request('collaborative', user_id=user_id, n=5))
+    assert len(result.positions) == 5 and not set(result.positions) & set(pos) and len(result.messages) == 0
+    # the user, queued for promotion by the fold-in, is served as a trained user once promoted
+    assert engine.promote_users() == 1
+    info = engine.svd_trained_info
+    u_idx = info['userid_to_index'][user_id]
+    check((info['user_latent'][u_idx], info['user_bias'][u_idx]), expected)
+    assert np.array_equal(engine.recommend(Request('collaborative', user_id=user_id, n=5)).positions, result.positions)
+    top, _ = engine.collaborative_batch([user_id], k=5)
+    assert list(top[0]) == list(result.business_ids)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+The incremental ingestion of new reviews into a running engine (Engine.ingest_reviews): the review statistics of the restaurants,
+the adjusted scores, the rated restaurants of the users and the result cache.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+import pytest
+from engine import Engine, Request
+
+@pytest.fixture
+def engine(artifact_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Engine(personalized=True, geocoder=False, artifact_dir=artifact_dir)
+
+def test_review_statistics_are_updated(engine):
+    pos = np.flatnonzero(engine.business.is_open.values == 1)[:2]
+    business_ids = list(engine._business_ids[pos])
+    count, _, _ = engine.catalog_stats(pos)
+    star_sum = engine._star_sum[pos].copy()
+    total_stars, total_count = engine._total_stars, engine._total_count
+    batch = pd.DataFrame({'user_id': ['new user 1', 'new user 2', 'new user 1', 'new user 1'],
+                          'business_id': business_ids + [business_ids[0], 'not a restaurant'], 'stars': [5, 1, 4, 3]})
+    # the review of a business missing from the catalog is left out
+    assert engine.ingest_reviews(batch) == 3
+    new_count, stars, adjusted = engine.catalog_stats(pos)
+    assert list(new_count) == [count[0] + 2, count[1] + 1]
+    assert np.allclose(engine._star_sum[pos], star_sum + [9, 1])
+    assert list(stars) == list(np.round((star_sum + [9, 1]) / new_count * 2) / 2)
+    globe_mean = (total_stars + 10) / (total_count + 3)
+    assert np.allclose(adjusted, (star_sum + [9, 1] + engine.adjusted_k * globe_mean) / (new_count + engine.adjusted_k))
+    # the adjusted scores of the catalog are frames of the running statistics
+    frame = engine.frame(engine.recommend(Request('keyword', n=None)))
+    row = frame[frame.business_id == business_ids[0]].iloc[0]
+    assert row.review_count == count[0] + 2 and np.isclose(row.adjusted_score, adjusted[0])
+
+def test_ingested_reviews_are_rated_restaurants(engine):
+    user_id = engine.review_s.user_id.iloc[0]
+    result = engine.recommend(Request('content', user_id=user_id, n=5))
+    assert engine.ingest_reviews([{'user_id': user_id, 'business_id': result.business_ids[0], 'stars': 5}]) == 1
+    assert engine.business_pos.get_loc(result.business_ids[0]) in engine.interactions.items(user_id)
+    # the cached result is invalidated, the restaurant rated since is no longer recommended
+    after = engine.recommend(Request('content', user_id=user_id, n=5))
+    assert result.business_ids[0] not in list(after.business_ids)
+    assert list(after.business_ids[:4]) == list(result.business_ids[1:])
+    assert list(engine.ingested_reviews().user_id) == [user_id]
+
+def test_new_users_get_personalized_recommendations(engine):
+    user_id = 'a-user-without-reviews' # the user ids of Yelp are 22 characters long
+    assert len(user_id) == 22 and not engine.interactions.has_history(user_id)
+    assert engine.recommend(Request('content', user_id=user_id)).total == 0
+    business_ids = engine._business_ids[np.flatnonzero(engine.business.is_open.values == 1)[:3]]
+    engine.ingest_reviews(pd.DataFrame({'user_id': [user_id] * 3, 'business_id': business_ids, 'stars': [5, 4, 2]}))
+    assert engine.interactions.has_history(user_id)
+    for module in ['content', 'collaborative']:
+        result = engine.recommend(Request(module, user_id=user_id, n=5))
+        assert len(result.positions) == 5 and not set(result.business_ids) & set(business_ids)
+
+def test_batches_without_the_required_columns_are_refused(engine):
+    with pytest.raises(ValueError):
+        engine.ingest_reviews(pd.DataFrame({'user_id': ['a'], 'business_id': [engine._business_ids[0]]}))
+    assert engine.ingest_reviews(pd.DataFrame({'user_id': ['a'], 'business_id': ['unknown'], 'stars': [3]})) == 0
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+The user interaction index (interactions.py): the CSR arrays, the overlay of the added interactions and their compaction,
+against the interactions kept in plain dictionaries.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import numpy as np
+import pandas as pd
+from interactions import InteractionIndex
+
+N_ITEMS = 50
+
+def random_interactions(rng, n, users):
+    """n random (user_id, item code, value) interactions of the users, with some unknown items (-1)"""
+    user_ids = rng.choice(users, n).astype(object)
+    items = rng.randint(-1, N_ITEMS, n)
+    return user_ids, items, rng.randint(1, 6, n).astype(float)
+
+def reference(*batches):
+    """The interactions as a dictionary user_id -> {item code: last value}"""
+    ratings = {}
+    for user_ids, items, values in batches:
+        for u, i, v in zip(user_ids, items, values):
+            if i >= 0:
+                ratings.setdefault(u, {})[i] = v
+    return ratings
+
+def check(index, ratings, users):
+    for u in users:
+        expected = ratings.get(u, {})
+        items, values = index.ratings(u)
+        assert list(items) == sorted(expected)
+        assert list(values) == [expected[i] for i in sorted(expected)]
+        assert list(index.items(u)) == sorted(expected)
+        assert index.has_history(u) == (len(expected) > 0) and index.degree(u) == len(expected)
+    rows, items = index.pairs(users)
+    # a pair both in the CSR arrays and in the overlay is returned twice
+    assert set(zip(rows.tolist(), items.tolist())) == {(r, i) for r, u in enumerate(users) for i in ratings.get(u, {})}
+    assert np.all(np.diff(rows) >= 0)
+
+def test_csr_index_keeps_the_last_value_of_each_pair():
+    rng = np.random.RandomState(0)
+    users = np.array(['u{}'.format(i) for i in range(30)])
+    batch = random_interactions(rng, 500, users[:20])
+    index = InteractionIndex(batch[0], batch[1], N_ITEMS, batch[2])
+    check(index, reference(batch), users)
+    assert len(index) == len(reference(batch))
+    assert index.user_code('unknown') == -1 and len(index.items('unknown')) == 0
+
+def test_categorical_users_are_indexed_by_their_codes():
+    user_ids = pd.Categorical(['b', 'a', 'b', 'c'], categories=['a', 'b', 'c', 'd'])
+    index = InteractionIndex(user_ids, np.array([3, 1, 2, -1]), N_ITEMS, np.array([5, 4, 3, 2]))
+    assert list(index.users) == ['a', 'b'] # 'c' has no known item and 'd' no interaction
+    assert list(index.items('b')) == [2, 3] and not index.has_history('c')
+
+def test_added_interactions_override_and_compact():
+    rng = np.random.RandomState(1)
+    users = np.array(['u{}'.format(i) for i in range(40)])
+    initial = random_interactions(rng, 400, users[:25])
+    index = InteractionIndex(initial[0], initial[1], N_ITEMS, initial[2])
+    added = [random_interactions(rng, 60, users[15:40]) for _ in range(3)]
+    for batch in added:
+        index.add(*batch)
+    ratings = reference(initial, *added)
+    # the overlay: existing users get more items (new values override the old ones), new users are counted
+    check(index, ratings, users)
+    assert len(index) == len(ratings)
+    # the CSR arrays are left untouched by .add()
+    assert len(index.indices) == sum(len(r) for r in reference(initial).values())
+    compacted = index.compacted()
+    check(compacted, ratings, users)
+    assert len(compacted._added) == 0 and len(compacted) == len(ratings)
+    assert len(compacted.indices) == sum(len(r) for r in ratings.values())
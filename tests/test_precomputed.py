@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+The materialized top k of precompute.py served by the HTTP service (server.py --precomputed), and refused once the model changes.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+from artifacts import current_version, write_collaborative
+from engine import Engine
+from precompute import materialize
+from server import RecommenderService
+
+def get(service, target):
+    """Answer one GET request of the service, return (status code, body)"""
+    return asyncio.run(service.dispatch('GET', target))
+
+@pytest.mark.parametrize('module', ['collaborative', 'content'])
+def test_unfiltered_requests_are_served_from_the_top_k(artifact_dir, module):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=artifact_dir, precomputed=True, cache_bytes=0)
+    assert module in engine.topk
+    service = RecommenderService(engine, max_wait=0.001, workers=1)
+    table = engine.topk[module]
+    user_id = str(table.user_ids[0])
+    status, body = get(service, '/{}?user_id={}&n=5'.format(module, user_id))
+    assert status == 200
+    # answered by a lookup in the table, never scored by the micro-batcher
+    assert service.batchers[module].requests == 0
+    codes, scores = table.lookup(user_id)
+    assert [r['business_id'] for r in body['recommendations']] == [str(table.business_ids[c]) for c in codes[:5]]
+    assert body['total'] == 5
+    # more than k recommendations are scored live, by the micro-batcher
+    status, body = get(service, '/{}?user_id={}&n=30'.format(module, user_id))
+    assert status == 200 and service.batchers[module].requests == 1
+    service.executor.shutdown()
+
+@pytest.mark.parametrize('module', ['collaborative', 'content'])
+def test_rows_with_fewer_than_n_open_restaurants_are_scored_live(artifact_dir, module):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=artifact_dir, precomputed=True, cache_bytes=0)
+    service = RecommenderService(engine, max_wait=0.001, workers=1)
+    table = engine.topk[module]
+    user_id = str(table.user_ids[0])
+    codes, _ = table.lookup(user_id)
+    # all but 3 of the restaurants of the row closed since the table was computed
+    table.positions[codes[3:]] = -1
+    status, body = get(service, '/{}?user_id={}&n=3'.format(module, user_id))
+    assert status == 200 and body['total'] == 3 and service.batchers[module].requests == 0
+    status, body = get(service, '/{}?user_id={}&n=5'.format(module, user_id))
+    assert status == 200 and body['total'] == 5 and service.batchers[module].requests == 1
+    service.executor.shutdown()
+
+def test_tables_are_built_aside(artifact_dir, tmp_path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=artifact_dir)
+        out = str(tmp_path / 'topk')
+        # an interrupted run leaves its table under construction, which is neither loaded nor kept
+        os.makedirs(os.path.join(out, 'content.tmp'))
+        materialize(engine, 'content', out, k=5, n_jobs=1, verbose=False)
+    assert sorted(os.listdir(out)) == ['content']
+    assert sorted(os.listdir(os.path.join(out, 'content'))) == ['business_ids.npy', 'codes.npy', 'meta.json', 'scores.npy', 'user_ids.npy', 'user_index.npy']
+
+def test_model_digests_are_read_from_the_manifest(artifact_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=artifact_dir, precomputed=True)
+    assert sorted(engine.topk) == ['collaborative', 'content']
+    # the tables are checked against the recorded digests, the models are not read to compute them
+    assert engine._digests == {}
+    for module in ['collaborative', 'content']:
+        recorded = engine.artifacts.manifest.pop(module + '_digest')
+        assert recorded == {side: engine._model_digest(module, side) for side in ['users', 'items']}
+
+def test_precompute_publishes_a_new_version(versioned_root, tmp_path):
+    root = versioned_root
+    version = os.path.join(root, 'versions', current_version(root))
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hybrid_recommendation_engine', 'precompute.py')
+    subprocess.run([sys.executable, script, '--artifact-dir', root, '--k', '5', '--n-jobs', '1', '--modules', 'content'],
+                   check=True, capture_output=True, cwd=str(tmp_path))
+    # the served version is left untouched, the tables come with a new version
+    assert not os.path.exists(os.path.join(version, 'topk'))
+    assert current_version(root) != os.path.basename(version)
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=root, precomputed=True)
+    assert 'content' in engine.topk and engine.topk['content'].k == 5
+
+def test_top_k_of_another_model_is_refused(artifact_dir, tmp_path):
+    # a model retrained on the same data: same users, items and sizes, other factors
+    path = str(tmp_path / 'retrained')
+    os.makedirs(path)
+    for name in os.listdir(artifact_dir):
+        if name not in ('collaborative', 'manifest.json'):
+            os.symlink(os.path.join(artifact_dir, name), os.path.join(path, name))
+    with open(os.path.join(artifact_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    info = Engine(personalized=True, geocoder=False, artifact_dir=artifact_dir).svd_trained_info
+    manifest.update(write_collaborative(dict(info, item_latent=np.asarray(info['item_latent']) * 1.01), path))
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=path, precomputed=True)
+    assert 'collaborative' not in engine.topk and 'content' in engine.topk
+    assert 'computed from another model' in output.getvalue()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+The user feature vectors of the content-based module: the user_id -> row hash index and the int8 store (artifacts.py),
+the running weighted mean of ProfileUpdater (profiles.py) against a full recompute, and the persistence of the updated profiles (Engine.persist).
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import contextlib
+import hashlib
+import io
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from artifacts import FeatureMatrix, UserFeatureStore, build_hash_index, current_version, hash_lookup, write_user_features
+from engine import Engine
+from profiles import ProfileUpdater, profile_statistics
+
+def random_ids(rng, n):
+    """n distinct random ids of 22 characters, as the user_ids of Yelp"""
+    ids = rng.permutation(np.unique(rng.randint(0, 10**9, 2 * n)))[:n]
+    return ['{:022d}'.format(i) for i in ids]
+
+def load_store(path, scale=False):
+    load = lambda name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+    return UserFeatureStore(load('user_ids'), load('user_pcafeature'), load('user_index'), load('user_pcafeature_scale') if scale else None)
+
+def test_hash_index_maps_every_id_to_its_row():
+    rng = np.random.RandomState(0)
+    ids = random_ids(rng, 5000)
+    table = build_hash_index(ids)
+    assert len(table) & (len(table) - 1) == 0 and len(table) >= 2 * len(ids)
+    assert np.array_equal(np.sort(table[table >= 0]), np.arange(len(ids)))
+    assert [hash_lookup(table, ids, key) for key in ids] == list(range(len(ids)))
+    assert all(hash_lookup(table, ids, key) == -1 for key in random_ids(np.random.RandomState(1), 100) if key not in set(ids))
+    # the tables of a single id and of no id
+    assert hash_lookup(build_hash_index(ids[:1]), ids[:1], ids[0]) == 0
+    assert hash_lookup(build_hash_index([]), [], ids[0]) == -1
+
+@pytest.mark.parametrize('dtype', ['float32', 'int8'])
+def test_user_feature_store_round_trip(tmp_path, dtype):
+    rng = np.random.RandomState(0)
+    values = rng.randn(300, 16)
+    values[5] = 0 # a row of zeros
+    df = pd.DataFrame(values, index=random_ids(rng, len(values)))
+    write_user_features(df, str(tmp_path), dtype=dtype)
+    store = load_store(str(tmp_path), scale=dtype == 'int8')
+    assert store.values.dtype == np.dtype(dtype) and len(store) == len(df)
+    rows = store.rows(np.arange(len(df)))
+    assert rows.dtype == np.float32
+    # int8 rows are within half a quantization step (max |value| / 127 / 2) of the original vectors
+    tolerance = np.abs(values).max(axis=1, keepdims=True) / 254 * 1.001 if dtype == 'int8' else 1e-6 * np.abs(values).max()
+    assert np.all(np.abs(rows - values) <= tolerance)
+    assert np.array_equal(store.row(df.index[7]), rows[7]) and df.index[7] in store and 'unknown' not in store
+    with pytest.raises(KeyError):
+        store.row('unknown')
+
+def test_updates_are_kept_in_an_overlay(tmp_path):
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame(rng.randn(100, 8), index=random_ids(rng, 100))
+    write_user_features(df, str(tmp_path), dtype='int8')
+    files = {name: hashlib.md5(open(os.path.join(str(tmp_path), name), 'rb').read()).hexdigest() for name in os.listdir(str(tmp_path))}
+    store = load_store(str(tmp_path), scale=True)
+    updated, added = np.ones(8, dtype=np.float32), np.full(8, 2, dtype=np.float32)
+    store.update(df.index[3], updated)
+    store.update('a-new-user', added)
+    assert np.array_equal(store.row(df.index[3]), updated) and np.array_equal(store.row('a-new-user'), added)
+    assert len(store) == 101 and store.position('a-new-user') == 100
+    assert np.array_equal(store.rows([2, 3, 100])[1:], [updated, added])
+    positions, vectors, new_ids, new_vectors = store.updates()
+    assert list(positions) == [3] and new_ids == ['a-new-user'] and np.array_equal(new_vectors, [added])
+    # the stored files are never modified
+    assert files == {name: hashlib.md5(open(os.path.join(str(tmp_path), name), 'rb').read()).hexdigest() for name in os.listdir(str(tmp_path))}
+
+def profiles(review, rest_ids, rest_values, user_ids):
+    """The unit-length mean feature vectors of the restaurants rated by the users, weighted by the ratings (the full recompute)"""
+    row = pd.Index(rest_ids).get_indexer(review.business_id)
+    vectors = []
+    for user_id in user_ids:
+        mine = (review.user_id.values == user_id) & (row >= 0)
+        mean = np.dot(review.stars.values[mine], rest_values[row[mine]]) / review.stars.values[mine].sum()
+        vectors.append(mean / np.sqrt(np.dot(mean, mean)))
+    return np.array(vectors)
+
+def random_reviews(rng, n, user_ids, rest_ids):
+    return pd.DataFrame({'user_id': rng.choice(user_ids, n), 'business_id': rng.choice(rest_ids, n), 'stars': rng.randint(1, 6, n)})
+
+def test_running_mean_matches_a_full_recompute():
+    rng = np.random.RandomState(0)
+    rest_ids, rest_values = np.array(['r{}'.format(i) for i in range(60)], dtype=object), rng.rand(60, 8)
+    user_ids = np.array(['u{}'.format(i) for i in range(20)], dtype=object)
+    review = random_reviews(rng, 400, user_ids, np.append(rest_ids, 'not a restaurant'))
+    weight, norm = profile_statistics(user_ids, review, rest_ids, rest_values)
+    store = FeatureMatrix(user_ids, profiles(review, rest_ids, rest_values, user_ids))
+    # the statistics of the last users are not stored, they are estimated from their rating history
+    updater = ProfileUpdater(store, weight[:15], norm[:15])
+    reviews = [review]
+    for new_users in [user_ids[10:20], np.array(['u20', 'u21'], dtype=object)]:
+        batch = random_reviews(rng, 50, new_users, rest_ids)
+        reviews.append(batch)
+        for user_id, group in batch.groupby('user_id'):
+            history = lambda: tuple(s[0] for s in profile_statistics([user_id], pd.concat(reviews[:-1]), rest_ids, rest_values))
+            vectors = rest_values[pd.Index(rest_ids).get_indexer(group.business_id)]
+            updater.update(user_id, vectors, group.stars.values.astype(float), history)
+    all_ids = np.append(user_ids, ['u20', 'u21'])
+    expected = profiles(pd.concat(reviews), rest_ids, rest_values, all_ids)
+    assert np.allclose(store.rows(np.arange(len(all_ids))), expected, atol=1e-5)
+    # the statistics of the updated profiles are those of the full recompute
+    full_weight, full_norm = profile_statistics(all_ids, pd.concat(reviews), rest_ids, rest_values)
+    statistics = updater.updated_statistics()
+    assert sorted(statistics) == list(all_ids[10:])
+    assert all(np.allclose(statistics[u], (full_weight[i], full_norm[i]), rtol=1e-5) for i, u in enumerate(all_ids) if u in statistics)
+
+def test_persisted_profiles_are_loaded_by_new_engines(versioned_root):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=versioned_root)
+    engine._load_content()
+    version = current_version(versioned_root)
+    business_ids = engine._business_ids[engine._content_pos[:3]]
+    user_id = engine.review_s.user_id.iloc[0]
+    engine.ingest_reviews(pd.DataFrame({'user_id': [user_id, user_id, 'a-user-without-reviews'], 'business_id': business_ids, 'stars': [5, 1, 4]}))
+    updated = engine.user_pcafeature.rows([engine.user_pcafeature.position(u) for u in [user_id, 'a-user-without-reviews']])
+    statistics = engine.profiles.updated_statistics()
+    with contextlib.redirect_stdout(io.StringIO()):
+        new = engine.persist()
+        reloaded = Engine(personalized=True, geocoder=False, artifact_dir=versioned_root)
+    assert current_version(versioned_root) == new != version
+    reloaded._load_content()
+    store = reloaded.user_pcafeature
+    assert isinstance(store, UserFeatureStore) and len(store) == len(engine.user_pcafeature)
+    assert np.allclose(store.rows([store.position(u) for u in [user_id, 'a-user-without-reviews']]), updated, atol=1e-6)
+    for u, (w, r) in statistics.items():
+        assert np.allclose(reloaded.profiles.statistics(u, None), (w, r))
+    # the loaded version is left untouched
+    with contextlib.redirect_stdout(io.StringIO()):
+        old = Engine(personalized=True, geocoder=False, artifact_dir=os.path.join(versioned_root, 'versions', version))
+    old._load_content()
+    assert 'a-user-without-reviews' not in old.user_pcafeature
+    assert len(old.review) == len(reloaded.review) - 3
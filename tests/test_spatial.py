@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Equivalence of the vectorized distances and the spatial index (spatial.py) with great_circle_mile() of recommender.py,
+the distance the location filter of the recommender was originally computed with.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import numpy as np
+import pytest
+from recommender import great_circle_mile
+from spatial import haversine_mile, SpatialIndex, EARTH_RADIUS_MILE
+
+# great_circle_mile() computes the angle with acos, which loses about 1e-8 radians (a few feet) for nearby points
+TOLERANCE_MILE = 1e-3
+
+def destination(latitude, longitude, distance, bearing):
+    """Return the coordinates (in degrees) of the point at 'distance' miles from a location along 'bearing' (in radians)"""
+    lat, lon, d = np.radians(latitude), np.radians(longitude), distance / EARTH_RADIUS_MILE
+    lat2 = np.arcsin(np.sin(lat)*np.cos(d) + np.cos(lat)*np.sin(d)*np.cos(bearing))
+    lon2 = lon + np.arctan2(np.sin(bearing)*np.sin(d)*np.cos(lat), np.cos(d) - np.sin(lat)*np.sin(lat2))
+    return np.degrees(lat2), (np.degrees(lon2) + 180) % 360 - 180
+
+@pytest.fixture
+def points():
+    """Random restaurant-like coordinates around a few cities, with some missing coordinates"""
+    rng = np.random.default_rng(0)
+    centers = np.array([[36.17, -115.14], [43.65, -79.38], [33.45, -112.07], [-33.87, 151.21], [64.84, -147.72]])
+    city = rng.integers(len(centers), size=5000)
+    latitude = centers[city, 0] + rng.normal(scale=0.3, size=len(city))
+    longitude = centers[city, 1] + rng.normal(scale=0.3, size=len(city))
+    latitude[rng.choice(len(city), 50, replace=False)] = np.nan
+    return latitude, longitude
+
+def test_haversine_mile_matches_great_circle_mile(points):
+    latitude, longitude = points
+    valid = ~np.isnan(latitude)
+    lat, lon = latitude[valid][:-1], longitude[valid][:-1]
+    lat2, lon2 = latitude[valid][1:], longitude[valid][1:]
+    expected = np.array([great_circle_mile(*p) for p in zip(lat, lon, lat2, lon2)])
+    np.testing.assert_allclose(haversine_mile(lat, lon, lat2, lon2), expected, rtol=1e-9, atol=TOLERANCE_MILE)
+    # scalars and broadcasting
+    assert abs(haversine_mile(lat[0], lon[0], lat2[0], lon2[0]) - expected[0]) < TOLERANCE_MILE
+    np.testing.assert_allclose(haversine_mile(lat, lon, lat[0], lon[0]),
+                               [great_circle_mile(a, b, lat[0], lon[0]) for a, b in zip(lat, lon)], rtol=1e-9, atol=TOLERANCE_MILE)
+
+@pytest.mark.parametrize('max_distance', [0.5, 5, 25, 300])
+def test_query_radius_matches_great_circle_mile(points, max_distance):
+    latitude, longitude = points
+    index = SpatialIndex(latitude, longitude)
+    for center in [(36.17, -115.14), (43.7, -79.4), (64.84, -147.72), (0.0, 0.0)]:
+        positions, distance = index.query_radius(center[0], center[1], max_distance)
+        expected = np.array([great_circle_mile(a, b, center[0], center[1]) if not np.isnan(a) else np.nan for a, b in zip(latitude, longitude)])
+        # same points as the loop over great_circle_mile(), up to its rounding for the points within the tolerance of the radius
+        assert np.isin(positions, np.flatnonzero(expected <= max_distance + TOLERANCE_MILE)).all()
+        assert np.isin(np.flatnonzero(expected <= max_distance - TOLERANCE_MILE), positions).all()
+        np.testing.assert_allclose(distance, expected[positions], rtol=1e-9, atol=TOLERANCE_MILE)
+        # exactly the points within the radius by haversine_mile(), none of the missing coordinates
+        valid = ~np.isnan(latitude)
+        exact = haversine_mile(latitude, longitude, center[0], center[1])
+        assert set(positions) == set(np.flatnonzero(valid & (exact <= max_distance)))
+
+@pytest.mark.parametrize('max_distance', [0.1, 2, 10, 150])
+def test_query_radius_boundary(max_distance):
+    center = (36.17, -115.14)
+    bearing = np.linspace(0, 2*np.pi, 64, endpoint=False)
+    inside_lat, inside_lon = destination(center[0], center[1], max_distance - 0.01, bearing)
+    outside_lat, outside_lon = destination(center[0], center[1], max_distance + 0.01, bearing)
+    on_lat, on_lon = destination(center[0], center[1], max_distance, bearing)
+    latitude = np.concatenate([inside_lat, outside_lat, on_lat])
+    longitude = np.concatenate([inside_lon, outside_lon, on_lon])
+    index = SpatialIndex(latitude, longitude)
+    positions, distance = index.query_radius(center[0], center[1], max_distance)
+    great_circle = np.array([great_circle_mile(a, b, center[0], center[1]) for a, b in zip(latitude, longitude)])
+    # the points 0.01 mile inside (outside) the radius are all (never) returned, as by great_circle_mile()
+    assert (great_circle[:64] <= max_distance).all() and (great_circle[64:128] > max_distance).all()
+    assert np.isin(np.arange(64), positions).all()
+    assert not np.isin(np.arange(64, 128), positions).any()
+    # the points on the radius are returned exactly when their haversine distance is within it, none is lost by the tree
+    on = np.arange(128, 192)
+    np.testing.assert_allclose(great_circle[on], max_distance, atol=TOLERANCE_MILE)
+    assert set(positions[positions >= 128]) == set(on[haversine_mile(latitude[on], longitude[on], center[0], center[1]) <= max_distance])
+    np.testing.assert_allclose(index.distance_to(center[0], center[1], max_distance)[positions], distance)
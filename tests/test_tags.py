@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+The inverted tag index (tags.py) against a row by row match of the comma-separated tags, as joined by data_wrangling.ipynb (', ').
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import numpy as np
+import pytest
+from synthetic import generate_business
+from tags import TagIndex
+
+def reference(column, tags, match):
+    """The rows of column matching the tags, one row at a time"""
+    test = all if match == 'all' else any
+    return np.array([isinstance(entry, str) and test(tag in [t.strip() for t in entry.split(',')] for tag in tags) for entry in column])
+
+def test_tags_after_the_first_are_matched():
+    index = TagIndex(np.array(['pizza, italian', 'mexican, pizza', np.nan, 'italian', 'mexican, tacos, pizza'], dtype=object))
+    assert list(index.mask('pizza')) == [True, True, False, False, True]
+    assert list(index.mask(' pizza ')) == [True, True, False, False, True]
+    assert list(index.mask(['pizza', 'mexican'], match='all')) == [False, True, False, False, True]
+    assert list(index.mask(['tacos', 'italian'], match='any')) == [True, False, False, True, True]
+    assert index.count('pizza') == 3 and index.count('sushi') == 0
+    assert ' pizza' not in index.tags
+
+@pytest.mark.parametrize('tags,match', [(['pizza'], 'any'), (['pizza', 'mexican'], 'all'), (['pizza', 'mexican'], 'any'),
+                                        (['sushi bars', 'japanese'], 'all'), (['unknown'], 'any')])
+def test_mask_matches_every_row(tags, match):
+    business, _ = generate_business(np.random.RandomState(0), 2000)
+    column = business.cuisine.values
+    expected = reference(column, tags, match)
+    assert np.array_equal(TagIndex(column).mask(tags, match=match), expected)
+    if tags != ['unknown']:
+        assert expected.sum() > 0
+
+def test_invalid_match_raises():
+    with pytest.raises(ValueError):
+        TagIndex(np.array(['pizza'], dtype=object)).mask('pizza', match='some')
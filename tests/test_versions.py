@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+The versioned artifact directories (artifacts.py): new versions hard-linked from the current one, publication and pruning,
+and the hot reload of the engine (reloader.py) with the replay of the reviews ingested since it was loaded.
+
+Github repo:
+https://github.com/jingzhaomirror/capstone2_hybrid_yelp_recommender.git
+"""
+
+import contextlib
+import io
+import json
+import os
+import pandas as pd
+import pytest
+from artifacts import current_version, new_version_dir, prune_versions, publish, resolve_artifact_dir
+from engine import Engine
+from reloader import EngineReloader
+
+def files(path):
+    return sorted(os.path.relpath(os.path.join(d, f), path) for d, _, names in os.walk(path) for f in names)
+
+def test_new_versions_are_linked_from_the_current_one(versioned_root):
+    current = resolve_artifact_dir(versioned_root)
+    path = new_version_dir(versioned_root)
+    # the new version is not published, its files are the files of the current version
+    assert current_version(versioned_root) != os.path.basename(path) and resolve_artifact_dir(versioned_root) == current
+    assert files(path) == files(current)
+    assert all(os.path.samefile(os.path.join(path, f), os.path.join(current, f)) for f in files(path))
+    assert os.listdir(new_version_dir(versioned_root, link=False)) == []
+
+def test_publish_switches_the_current_version(versioned_root):
+    old = current_version(versioned_root)
+    path = new_version_dir(versioned_root)
+    publish(versioned_root, os.path.basename(path))
+    with open(os.path.join(versioned_root, 'CURRENT')) as f:
+        assert f.read() == os.path.basename(path) + '\n'
+    assert resolve_artifact_dir(versioned_root) == path and old != os.path.basename(path)
+    # a version without manifest (not compiled, or being written) cannot be published
+    empty = new_version_dir(versioned_root, link=False)
+    with pytest.raises(ValueError):
+        publish(versioned_root, os.path.basename(empty))
+    assert current_version(versioned_root) == os.path.basename(path)
+    # a directory without CURRENT is not versioned
+    assert current_version(path) is None and resolve_artifact_dir(path) == path
+
+def test_prune_keeps_the_current_and_most_recent_versions(versioned_root):
+    first = current_version(versioned_root)
+    names = [first] + [os.path.basename(new_version_dir(versioned_root)) for _ in range(4)]
+    for i, name in enumerate(names): # the versions created within the same second are ordered by their modification time
+        os.utime(os.path.join(versioned_root, 'versions', name), (1e9 + i, 1e9 + i))
+    assert sorted(prune_versions(versioned_root, keep=2)) == sorted(names[1:3])
+    assert sorted(os.listdir(os.path.join(versioned_root, 'versions'))) == sorted([first] + names[3:])
+    assert prune_versions(versioned_root, keep=2) == [] and current_version(versioned_root) == first
+
+@pytest.fixture
+def reloader(versioned_root):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = Engine(personalized=True, geocoder=False, artifact_dir=versioned_root)
+    reloader = EngineReloader(engine)
+    yield reloader
+    reloader.stop()
+
+def reviews(engine, user_id, n):
+    return pd.DataFrame({'user_id': [user_id] * n, 'business_id': engine._business_ids[engine._open_pos[:n]], 'stars': [5, 3, 1][:n]})
+
+def test_ingested_reviews_are_replayed_into_the_new_engine(reloader, versioned_root):
+    old = reloader.engine
+    assert reloader.check() is None # nothing new
+    user_id = 'a-user-without-reviews'
+    assert reloader.ingest_reviews(reviews(old, user_id, 3)) == 3
+    publish(versioned_root, os.path.basename(new_version_dir(versioned_root)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        new = reloader.check().result()
+    assert reloader.engine is new and new is not old and reloader.reloads == 1
+    assert reloader.version == current_version(versioned_root)
+    # the reviews are replayed (into the profiles too), and the modules loaded by the old engine are warmed up
+    assert len(new.ingested_reviews()) == 3 and new.interactions.degree(user_id) == 3
+    assert new.svd_trained_info is not None and user_id in new.user_pcafeature
+    assert reloader.check() is None
+
+def test_persisted_reviews_are_not_replayed(reloader, versioned_root):
+    user_id = 'a-user-without-reviews'
+    reloader.ingest_reviews(reviews(reloader.engine, user_id, 2))
+    with contextlib.redirect_stdout(io.StringIO()):
+        reloader.engine.persist()
+        new = reloader.check().result()
+    assert len(new.ingested_reviews()) == 0 and new.interactions.degree(user_id) == 2
+    assert (new.review.user_id == user_id).sum() == 2
+
+def test_a_version_failing_to_load_is_not_retried(reloader, versioned_root):
+    old = reloader.engine
+    path = new_version_dir(versioned_root, link=False)
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump({'format_version': 0}, f)
+    publish(versioned_root, os.path.basename(path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        future = reloader.check()
+        assert future.exception() is not None
+    assert reloader.engine is old and reloader.failures == 1
+    assert reloader.check() is None